@@ -0,0 +1,95 @@
+"""
+Compares the vectorized `_df_to_records` with the previous row-by-row implementation:
+checks both produce identical records and reports the speedup.
+
+Run from the backend directory:
+    python -m benchmarks.bench_parse_records [rows]
+"""
+import random
+import sys
+import time
+
+import pandas as pd
+
+from services.parser import _df_to_records, _resolve_columns
+
+
+def legacy_df_to_records(df: pd.DataFrame, supplier_name: str, actual_mapping: dict) -> list[dict]:
+    """The `df.iterrows()` implementation the vectorized version replaces."""
+    records = []
+    df = df.astype(object).where(pd.notnull(df), None)
+
+    for _, row in df.iterrows():
+        # pandas >= 3 turns the None back into NaN when building the row Series
+        row = {key: None if pd.isna(value) else value for key, value in row.items()}
+        raw_name = row.get(actual_mapping.get("name"))
+        if not raw_name or pd.isna(raw_name) or str(raw_name).strip() == "":
+            continue
+
+        record = {
+            "supplier_name": supplier_name,
+            "name": str(raw_name).strip(),
+            "barcode": str(row.get(actual_mapping.get("barcode", "none_existent"))).strip() if actual_mapping.get("barcode") and row.get(actual_mapping.get("barcode")) else None,
+            "article": str(row.get(actual_mapping.get("article", "none_existent"))).strip() if actual_mapping.get("article") and row.get(actual_mapping.get("article")) else None,
+            "price": None
+        }
+
+        if record["barcode"] and record["barcode"].endswith(".0"):
+            record["barcode"] = record["barcode"][:-2]
+
+        if actual_mapping.get("price"):
+            raw_price = row.get(actual_mapping.get("price"))
+            if raw_price:
+                try:
+                    record["price"] = float(str(raw_price).replace(',', '.'))
+                except ValueError:
+                    pass
+
+        records.append(record)
+
+    return records
+
+
+def make_price_list(rows: int, seed: int = 42) -> pd.DataFrame:
+    """A noisy price list: empty names, float barcodes with gaps, comma/dot/garbage prices."""
+    rnd = random.Random(seed)
+    names = ["Смартфон Samsung Galaxy S23", "  Наушники Sony WH-1000XM5 ", "Ноутбук Apple MacBook Air", "", "   ", None]
+    prices = ["1 999", "1999,90", "2500.5", "", "0", "abc", "1_000", None, 0, 150, 99.9]
+    data = {
+        "Наименование": [rnd.choice(names) for _ in range(rows)],
+        "Штрихкод": [float(4600000000000 + i) if rnd.random() > 0.2 else None for i in range(rows)],
+        "Артикул": [rnd.choice(["ART-001", " sku 2 ", "", None, 12345]) for _ in range(rows)],
+        "Цена": [rnd.choice(prices) for _ in range(rows)],
+    }
+    return pd.DataFrame(data)
+
+
+def best_time(func, repeat: int = 3) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(rows: int = 100000):
+    df = make_price_list(rows)
+    mapping = _resolve_columns(df)
+
+    expected = legacy_df_to_records(df, "Supplier", mapping)
+    actual = _df_to_records(df, "Supplier", mapping)
+    if actual != expected:
+        raise SystemExit("Vectorized records differ from the row-by-row implementation")
+
+    legacy = best_time(lambda: legacy_df_to_records(df, "Supplier", mapping), repeat=1)
+    vectorized = best_time(lambda: _df_to_records(df, "Supplier", mapping))
+
+    print(f"{rows} rows -> {len(actual)} records (identical output)")
+    print(f"iterrows:   {legacy:.3f}s ({rows / legacy:,.0f} rows/s)")
+    print(f"vectorized: {vectorized:.3f}s ({rows / vectorized:,.0f} rows/s)")
+    print(f"speedup:    {legacy / vectorized:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,180 @@
+"""
+Synthetic, deterministic data for the benchmarks: a Russian/English product catalog
+(the master nomenclature) and noisy supplier price lists derived from it, written
+as CSV, XLSX or XML the way suppliers send them.
+"""
+import csv
+import random
+from typing import Iterator, List
+from xml.sax.saxutils import escape
+
+import openpyxl
+
+ELECTRONICS_TYPES = [
+    "Смартфон", "Ноутбук", "Планшет", "Наушники беспроводные", "Телевизор", "Монитор",
+    "Умные часы", "Колонка портативная", "Клавиатура", "Мышь беспроводная", "Роутер Wi-Fi",
+    "Пылесос", "Чайник электрический", "Утюг", "Фен", "Кофемашина", "Микроволновая печь",
+]
+ELECTRONICS_BRANDS = [
+    "Samsung", "Apple", "Sony", "Xiaomi", "LG", "Bosch", "Philips", "Lenovo", "Asus", "Huawei",
+    "Redmi", "Tefal", "Braun", "JBL", "Logitech", "TP-Link", "Dyson", "Polaris", "Яндекс", "Витязь",
+]
+ELECTRONICS_SPECS = ["64GB", "128GB", "256GB", "512GB", "8/256", "16/512", "1 ТБ", "2000 Вт", "1.7 л", "55\"", "27\""]
+COLORS = ["Black", "White", "Silver", "Blue", "черный", "белый", "серый", "синий", "красный"]
+
+GROCERY_TYPES = [
+    "Молоко", "Кефир", "Сыр", "Масло сливочное", "Йогурт", "Творог", "Сметана", "Кофе молотый",
+    "Чай черный", "Чай зеленый", "Шоколад", "Печенье", "Макароны", "Рис", "Гречка", "Сок",
+]
+GROCERY_BRANDS = [
+    "Простоквашино", "Домик в деревне", "Веселый молочник", "Parmalat", "Danone", "Lipton",
+    "Jacobs", "Nescafe", "Alpen Gold", "Milka", "Barilla", "Makfa", "Увелка", "Мистраль", "Добрый",
+]
+GROCERY_SPECS = ["2.5%", "3.2%", "1%", "9%", "15%", "20%", "45%"]
+GROCERY_SIZES = ["0.5 л", "0.9 л", "1 л", "1.5 л", "100 г", "200 г", "250 г", "500 г", "900 г", "1 кг"]
+
+# Latin letters suppliers type instead of the Cyrillic look-alikes (and back)
+HOMOGLYPHS = str.maketrans("АВЕКМНОРСТХаеорсх", "ABEKMHOPCTXaeopcx")
+
+SUPPLIER_SUFFIXES = ["", "", "", " шт", " (новинка)", " арт.", ", 1 шт.", " NEW", " /уп"]
+
+
+def make_catalog(size: int, seed: int = 1) -> List[dict]:
+    """Master items with unique 1C codes, EAN-13 barcodes (90%) and articles (80%)."""
+    rnd = random.Random(seed)
+    items = []
+    for i in range(1, size + 1):
+        if rnd.random() < 0.6:
+            name = " ".join([
+                rnd.choice(ELECTRONICS_TYPES),
+                rnd.choice(ELECTRONICS_BRANDS),
+                f"{rnd.choice('ABCDEFGHKMNPRSTXZ')}{rnd.randint(1, 999)}{rnd.choice(['', 'X', 'Pro', 'Max', 'Lite', 'Ultra'])}",
+                rnd.choice(ELECTRONICS_SPECS),
+                rnd.choice(COLORS),
+            ])
+        else:
+            name = " ".join([
+                rnd.choice(GROCERY_TYPES),
+                rnd.choice(GROCERY_BRANDS),
+                rnd.choice(GROCERY_SPECS),
+                rnd.choice(GROCERY_SIZES),
+            ])
+        items.append({
+            "code_1c": f"ЦБ-{i:08d}",
+            "barcode": ean13(460000000000 + i * 7) if rnd.random() < 0.9 else None,
+            "article": f"{name.split()[1][:3].upper()}-{i:06d}" if rnd.random() < 0.8 else None,
+            "name": name,
+        })
+    return items
+
+
+def make_price_list(catalog: List[dict], rows: int, seed: int = 2, unknown_share: float = 0.1) -> List[dict]:
+    """
+    Supplier rows for random catalog items: codes dropped or reformatted, names with
+    reordered words, typos, homoglyphs, different case and supplier suffixes.
+    `unknown_share` of the rows are products missing from the catalog.
+    Each row keeps the `code_1c` of the catalog item it was made from (None for unknown
+    products) as the ground truth for match quality; the writers leave it out.
+    """
+    rnd = random.Random(seed)
+    unknown = make_catalog(max(1, int(rows * unknown_share)), seed=seed + 1000)
+    price_list = []
+    for _ in range(rows):
+        if rnd.random() < unknown_share:
+            item = rnd.choice(unknown)
+            code_1c = None
+            barcode = ean13(290000000000 + rnd.randint(0, 10 ** 9))
+        else:
+            item = rnd.choice(catalog)
+            code_1c = item["code_1c"]
+            barcode = item["barcode"] if rnd.random() < 0.6 else None
+
+        article = item["article"] if rnd.random() < 0.4 else None
+        if article and rnd.random() < 0.3:
+            article = article.lower()
+
+        price_list.append({
+            "article": article,
+            "barcode": barcode,
+            "name": noisy_name(item["name"], rnd),
+            "price": round(rnd.uniform(50, 250000), 2) if rnd.random() < 0.97 else None,
+            "code_1c": code_1c,
+        })
+    return price_list
+
+
+def noisy_name(name: str, rnd: random.Random) -> str:
+    words = name.split()
+    if len(words) > 2 and rnd.random() < 0.3:
+        # Brand first: "Samsung Смартфон ..."
+        words[0], words[1] = words[1], words[0]
+    if len(words) > 3 and rnd.random() < 0.2:
+        del words[rnd.randrange(2, len(words))]
+    name = " ".join(words)
+
+    if rnd.random() < 0.2:
+        position = rnd.randrange(len(name) - 1)
+        name = name[:position] + name[position + 1] + name[position] + name[position + 2:]
+    if rnd.random() < 0.15:
+        name = name.translate(HOMOGLYPHS)
+    if rnd.random() < 0.1:
+        name = name.upper()
+    return name + rnd.choice(SUPPLIER_SUFFIXES)
+
+
+def ean13(number: int) -> str:
+    digits = f"{number % 10 ** 12:012d}"
+    checksum = (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10) % 10
+    return digits + str(checksum)
+
+
+PRICE_LIST_COLUMNS = [("article", "Артикул"), ("barcode", "Штрихкод"), ("name", "Наименование"), ("price", "Цена")]
+
+
+def write_price_list(rows: List[dict], path: str):
+    """Writes the rows in the format given by the file extension (.csv, .xlsx or .xml)."""
+    extension = path.rsplit(".", 1)[-1].lower()
+    writers = {"csv": write_csv, "xlsx": write_xlsx, "xml": write_xml}
+    writers[extension](rows, path)
+
+
+def write_csv(rows: List[dict], path: str):
+    # Semicolon separated with decimal commas, like a Russian Excel export
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow([header for _, header in PRICE_LIST_COLUMNS])
+        for row in rows:
+            writer.writerow([_csv_value(row[key]) for key, _ in PRICE_LIST_COLUMNS])
+
+
+def write_xlsx(rows: List[dict], path: str):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Прайс")
+    sheet.append([header for _, header in PRICE_LIST_COLUMNS])
+    for row in rows:
+        sheet.append([row[key] for key, _ in PRICE_LIST_COLUMNS])
+    workbook.save(path)
+
+
+def write_xml(rows: List[dict], path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<Прайс>\n')
+        for row in rows:
+            f.write("".join(_iter_xml_item(row)))
+        f.write("</Прайс>\n")
+
+
+def _iter_xml_item(row: dict) -> Iterator[str]:
+    yield "  <Товар>"
+    for key, tag in PRICE_LIST_COLUMNS:
+        if row[key] is not None:
+            yield f"<{tag}>{escape(str(row[key]))}</{tag}>"
+    yield "</Товар>\n"
+
+
+def _csv_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return str(value).replace(".", ",")
+    return value
@@ -0,0 +1,470 @@
+"""
+Benchmark suite for the upload → match → review → export pipeline on synthetic data.
+
+For every size a catalog and a noisy price list are generated (see benchmarks.datagen)
+into a scratch directory holding a local SQLite database. Each scenario then runs in its
+own subprocess on a copy of that database, so peak RSS is per scenario and one
+scenario's caches don't warm up the next. Results (throughput, p50/p99 latency,
+peak RSS) are written as a JSON report that can be compared with an earlier one.
+
+Run from the backend directory:
+    python -m benchmarks.suite --sizes 10000,100000 --output bench-report.json
+    python -m benchmarks.suite --sizes 10000 --scenarios parse_csv,match_blocking
+    python -m benchmarks.suite --compare old-report.json bench-report.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.datagen import make_catalog, make_price_list, write_price_list
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SIZES = (10000, 100000)
+
+# Records between two latency samples for the streaming stages
+SAMPLE_ROWS = 1000
+
+# Queries issued by the search scenario
+SEARCH_QUERIES = 500
+
+# Matched items read per batch by the export scenarios, as the export endpoint does
+EXPORT_BATCH_SIZE = 5000
+
+SUPPLIER_NAME = "Bench Supplier"
+
+
+def parse_scenario(extension: str):
+    def run(workdir: str, rows: int) -> dict:
+        from services.parser import iter_price_list
+
+        path = os.path.join(workdir, "..", f"price_list.{extension}")
+        timer = Timer(SAMPLE_ROWS)
+        with open(path, "rb") as f:
+            for _ in iter_price_list(f, path, SUPPLIER_NAME):
+                timer.tick()
+        return timer.result(latency_unit=f"{SAMPLE_ROWS} records")
+    return run
+
+
+def upload_csv(workdir: str, rows: int) -> dict:
+    """Parse + insert, the work done by /api/upload/ in append mode."""
+    from sqlalchemy import delete
+
+    from database import SessionLocal
+    from models import SupplierItem
+    from services.ingest import ingest_supplier_items
+    from services.parser import iter_price_list
+
+    db = SessionLocal()
+    db.execute(delete(SupplierItem))
+    db.commit()
+
+    path = os.path.join(workdir, "..", "price_list.csv")
+    timer = Timer(SAMPLE_ROWS)
+    with open(path, "rb") as f:
+        ingest_supplier_items(db, timed(iter_price_list(f, path, SUPPLIER_NAME), timer), SUPPLIER_NAME)
+    db.close()
+    return timer.result(latency_unit=f"{SAMPLE_ROWS} records")
+
+
+def upload_csv_delta(workdir: str, rows: int) -> dict:
+    """Delta re-upload of the price list already in the DB: parse + diff, nothing is written."""
+    from database import SessionLocal
+    from services.ingest import ingest_supplier_items_delta
+    from services.parser import iter_price_list
+
+    db = SessionLocal()
+    path = os.path.join(workdir, "..", "price_list.csv")
+    timer = Timer(SAMPLE_ROWS)
+    with open(path, "rb") as f:
+        stats = ingest_supplier_items_delta(db, timed(iter_price_list(f, path, SUPPLIER_NAME), timer), SUPPLIER_NAME)
+    db.commit()
+    db.close()
+    report = timer.result(latency_unit=f"{SAMPLE_ROWS} records")
+    report["unchanged"] = stats["unchanged"]
+    return report
+
+
+def match_scenario(engine: str):
+    def run(workdir: str, rows: int) -> dict:
+        from database import SessionLocal
+        from services.master_index import MasterIndex
+        from services.matcher import MATCH_CHECKPOINT_SIZE, match_supplier_items
+
+        db = SessionLocal()
+        started = time.perf_counter()
+        index = MasterIndex.build(db)
+        index_build_seconds = time.perf_counter() - started
+
+        timer = Timer()
+
+        def on_progress(stats: dict):
+            # The first call comes before any item is processed
+            if stats["processed"]:
+                timer.tick()
+
+        result = match_supplier_items(db, index=index, engine=engine, on_progress=on_progress)
+        report = timer.result(items=rows, latency_unit=f"{MATCH_CHECKPOINT_SIZE}-item checkpoint")
+        report["index_build_seconds"] = round(index_build_seconds, 3)
+        report["matched_by_stage"] = result.get("by_stage", {})
+        report.update(match_quality(db, os.path.join(workdir, "..", "truth.json")))
+        db.close()
+        return report
+    return run
+
+
+def search(workdir: str, rows: int) -> dict:
+    from sqlalchemy import select
+
+    from database import SessionLocal
+    from models import SupplierItem
+    from services.search import search_master_items
+
+    db = SessionLocal()
+    supplier_rows = db.execute(
+        select(SupplierItem.name, SupplierItem.barcode, SupplierItem.article).limit(SEARCH_QUERIES * 4)
+    ).all()
+    queries = make_search_queries(supplier_rows, SEARCH_QUERIES)
+
+    timer = Timer()
+    hits = 0
+    for query in queries:
+        hits += bool(search_master_items(db, query))
+        timer.tick()
+    db.close()
+
+    report = timer.result(items=len(queries), latency_unit="query")
+    report["queries_with_hits"] = hits
+    return report
+
+
+def export_scenario(fmt: str):
+    def run(workdir: str, rows: int) -> dict:
+        from database import SessionLocal
+        from services.export import iter_1c_export_csv, iter_1c_export_xml
+        from services.results import iter_results
+
+        db = SessionLocal()
+        mark_all_matched(db)
+
+        generate_chunks = {"csv": iter_1c_export_csv, "xml": iter_1c_export_xml}[fmt]
+        timer = Timer()
+        size = 0
+        for chunk in generate_chunks(iter_results(db, status="matched", batch_size=EXPORT_BATCH_SIZE)):
+            size += len(chunk.encode("utf-8"))
+            timer.tick()
+        db.close()
+
+        report = timer.result(items=rows, latency_unit="flushed chunk")
+        report["output_mb"] = round(size / 2 ** 20, 2)
+        return report
+    return run
+
+
+SCENARIOS = {
+    "parse_csv": parse_scenario("csv"),
+    "parse_xlsx": parse_scenario("xlsx"),
+    "parse_xml": parse_scenario("xml"),
+    "upload_csv": upload_csv,
+    "upload_csv_delta": upload_csv_delta,
+    "match_blocking": match_scenario("blocking"),
+    "match_batch": match_scenario("batch"),
+    "match_tfidf": match_scenario("tfidf"),
+    "search": search,
+    "export_csv": export_scenario("csv"),
+    "export_xml": export_scenario("xml"),
+}
+
+
+class Timer:
+    """
+    Collects latency samples: the time between consecutive `tick()` calls, or between
+    every `every`-th call for per-record streams.
+    """
+
+    def __init__(self, every: int = 1):
+        self.every = every
+        self.count = 0
+        self.samples = []
+        self.started = self.last = time.perf_counter()
+
+    def tick(self):
+        self.count += 1
+        if self.count % self.every == 0:
+            now = time.perf_counter()
+            self.samples.append(now - self.last)
+            self.last = now
+
+    def result(self, items: int = None, latency_unit: str = "") -> dict:
+        seconds = time.perf_counter() - self.started
+        items = self.count if items is None else items
+        return {
+            "items": items,
+            "seconds": round(seconds, 3),
+            "throughput_per_s": round(items / seconds, 1) if seconds else None,
+            "latency_unit": latency_unit,
+            "p50_ms": percentile_ms(self.samples, 50),
+            "p99_ms": percentile_ms(self.samples, 99),
+        }
+
+
+def timed(records, timer: Timer):
+    for record in records:
+        timer.tick()
+        yield record
+
+
+def percentile_ms(samples: list, percent: float):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    position = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return round(ordered[position] * 1000, 3)
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def make_search_queries(supplier_rows: list, count: int, seed: int = 3) -> list:
+    """A review session's mix: name fragments, single words, scanned barcodes, articles, short prefixes."""
+    rnd = random.Random(seed)
+    queries = []
+    while len(queries) < count and supplier_rows:
+        name, barcode, article = rnd.choice(supplier_rows)
+        words = name.split()
+        kind = rnd.random()
+        if kind < 0.4:
+            queries.append(" ".join(words[:2]))
+        elif kind < 0.6:
+            queries.append(rnd.choice(words))
+        elif kind < 0.8 and barcode:
+            queries.append(barcode)
+        elif kind < 0.9 and article:
+            queries.append(article)
+        else:
+            queries.append(name[:2])
+    return queries
+
+
+def match_quality(db, truth_path: str) -> dict:
+    """Precision/recall of the matches against the catalog items the rows were generated from."""
+    from sqlalchemy import select
+
+    from models import MasterItem, SupplierItem
+
+    with open(truth_path, encoding="utf-8") as f:
+        truth = json.load(f)
+    matched = db.execute(
+        select(SupplierItem.id, MasterItem.code_1c)
+        .join(MasterItem, MasterItem.id == SupplierItem.matched_master_id)
+        .where(SupplierItem.is_matched == True)
+    ).all()
+
+    # Supplier items were inserted in price list order, so id n is row n - 1
+    correct = sum(1 for supplier_id, code_1c in matched if truth[supplier_id - 1] == code_1c)
+    known = sum(1 for code_1c in truth if code_1c is not None)
+    return {
+        "precision": round(correct / len(matched), 4) if matched else None,
+        "recall": round(correct / known, 4) if known else None,
+    }
+
+
+def mark_all_matched(db):
+    from sqlalchemy import text
+
+    db.execute(text(
+        "UPDATE supplier_items SET is_matched = 1, match_type = 'barcode', match_confidence = 100, "
+        "matched_master_id = 1 + id % (SELECT COUNT(*) FROM master_items)"
+    ))
+    db.commit()
+
+
+def prepare(workdir: str, rows: int, catalog_size: int, scenarios: list):
+    """Generates the size's database (catalog + unmatched price list) and the price list files."""
+    from sqlalchemy import insert
+
+    import models
+    from database import SessionLocal, engine
+    from services.ingest import batched, ingest_supplier_items
+    from services.search import ensure_search_index
+
+    models.Base.metadata.create_all(bind=engine)
+    ensure_search_index(engine)
+
+    catalog = make_catalog(catalog_size)
+    with engine.begin() as conn:
+        for batch in batched(catalog, 10000):
+            conn.execute(insert(models.MasterItem.__table__), batch)
+
+    price_list = make_price_list(catalog, rows)
+    db = SessionLocal()
+    ingest_supplier_items(db, price_list, SUPPLIER_NAME)
+    db.close()
+
+    # Scenarios get a copy of the database file alone: fold the WAL back into it first
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    engine.dispose()
+
+    with open(os.path.join(workdir, "truth.json"), "w", encoding="utf-8") as f:
+        json.dump([row["code_1c"] for row in price_list], f)
+
+    needed = {"csv"} | {name.split("_")[1] for name in scenarios if name.startswith("parse_")}
+    for extension in sorted(needed):
+        write_price_list(price_list, os.path.join(workdir, f"price_list.{extension}"))
+
+
+def run_worker(args):
+    """Subprocess entry point: runs one step in the current directory and prints its JSON result."""
+    if args.worker == "prepare":
+        prepare(os.getcwd(), args.rows, args.catalog_size, args.scenarios.split(","))
+        result = {}
+    else:
+        baseline_rss = peak_rss_mb()
+        result = SCENARIOS[args.worker](os.getcwd(), args.rows)
+        result["baseline_rss_mb"] = baseline_rss
+        result["peak_rss_mb"] = peak_rss_mb()
+        # Largest pool process, if the scenario started any (e.g. the batch match engine)
+        result["peak_rss_children_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    print(json.dumps(result))
+
+
+def spawn(step: str, workdir: str, rows: int, catalog_size: int, scenarios: list) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get("PYTHONPATH")])))
+    # The app's database URL is relative, so the working directory picks the database file
+    completed = subprocess.run(
+        [
+            sys.executable, "-m", "benchmarks.suite", "--worker", step,
+            "--rows", str(rows), "--catalog-size", str(catalog_size), "--scenarios", ",".join(scenarios),
+        ],
+        cwd=workdir, env=env, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{step} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_suite(sizes: list, scenarios: list, catalog_size: int = None, root: str = None) -> dict:
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": [],
+    }
+
+    keep_root = root is not None
+    root = root or tempfile.mkdtemp(prefix="nomenklatura-bench-")
+    try:
+        for rows in sizes:
+            size_catalog = catalog_size or rows
+            size_dir = os.path.join(root, str(rows))
+            os.makedirs(size_dir, exist_ok=True)
+            print(f"[{rows}] preparing {size_catalog} master items, {rows} supplier rows", file=sys.stderr)
+            spawn("prepare", size_dir, rows, size_catalog, scenarios)
+
+            for scenario in scenarios:
+                scenario_dir = os.path.join(size_dir, scenario)
+                os.makedirs(scenario_dir, exist_ok=True)
+                shutil.copy(os.path.join(size_dir, "nomenklatura.db"), scenario_dir)
+
+                result = spawn(scenario, scenario_dir, rows, size_catalog, scenarios)
+                result.update(scenario=scenario, rows=rows, catalog_size=size_catalog)
+                report["results"].append(result)
+                print(
+                    f"[{rows}] {scenario:<15} {result['seconds']:>9.3f}s {result['throughput_per_s'] or 0:>12,.0f}/s "
+                    f"p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms  peak {result['peak_rss_mb']} MB",
+                    file=sys.stderr,
+                )
+                shutil.rmtree(scenario_dir)
+    finally:
+        if not keep_root:
+            shutil.rmtree(root, ignore_errors=True)
+    return report
+
+
+def compare(old_report: dict, new_report: dict):
+    """Prints new/old ratios for every scenario and size present in both reports."""
+    old_results = {(r["scenario"], r["rows"]): r for r in old_report["results"]}
+    print(f"{'scenario':<15} {'rows':>8} {'throughput':>11} {'p50':>7} {'p99':>7} {'peak rss':>9}")
+    for result in new_report["results"]:
+        old = old_results.get((result["scenario"], result["rows"]))
+        if old is None:
+            continue
+        print(
+            f"{result['scenario']:<15} {result['rows']:>8} "
+            f"{_ratio(result['throughput_per_s'], old['throughput_per_s']):>11} "
+            f"{_ratio(result['p50_ms'], old['p50_ms']):>7} "
+            f"{_ratio(result['p99_ms'], old['p99_ms']):>7} "
+            f"{_ratio(result['peak_rss_mb'], old['peak_rss_mb']):>9}"
+        )
+
+
+def _ratio(new, old) -> str:
+    if not new or not old:
+        return "-"
+    return f"{new / old:.2f}x"
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="supplier rows per run, comma separated")
+    parser.add_argument("--catalog-size", type=int, default=None, help="master items (default: same as the size)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated, default: all")
+    parser.add_argument("--output", default="bench-report.json")
+    parser.add_argument("--workdir", default=None, help="scratch directory (default: a temporary one)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two reports and exit")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--rows", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    if args.compare:
+        reports = []
+        for path in args.compare:
+            with open(path, encoding="utf-8") as f:
+                reports.append(json.load(f))
+        compare(*reports)
+        return
+
+    scenarios = args.scenarios.split(",")
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (available: {', '.join(SCENARIOS)})")
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = run_suite(sizes, scenarios, args.catalog_size, args.workdir)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Report written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
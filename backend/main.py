@@ -1,19 +1,69 @@
-from fastapi import FastAPI, Depends, UploadFile, File, Form, HTTPException
-from fastapi.responses import Response
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Depends, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import select
 from typing import List, Optional
 
-from database import engine, get_db
-from models import MasterItem, SupplierItem, Base
-from services.parser import parse_price_list
-from services.matcher import match_supplier_items
-from services.export import generate_1c_export_csv, generate_1c_export_xml
+from database import engine, ensure_indexes, get_db, SessionLocal
+from models import MasterItem, MatchCandidate, PriceListUpload, SupplierItem, Base
+from services.ingest import INGEST_MODES, ensure_supplier_item_columns
+from services.uploads import (
+    UPLOAD_QUEUE_TIMEOUT, UploadQueueFull, process_catalog_import, run_in_upload_pool, run_upload, run_uploads,
+)
+from services.jobs import (
+    MatchJobConflict, cancel_local_jobs, cancel_match_job, get_match_job, job_to_dict,
+    list_match_jobs, start_match_job,
+)
+from services.matcher import REVIEW_CONFIDENCE_THRESHOLD, match_scope, store_candidates
+from services.results import fetch_results, fetch_review_queue, iter_results
+from services.match_memory import ensure_memory_name_keys, remember_match
+from services.review import apply_review_decisions
+from services.export import iter_1c_export_csv, iter_1c_export_xml, gzip_chunks
+from services.catalog_snapshot import open_master_index
+from services.master_index import ensure_catalog_state
+from services.search import MASTER_ITEM_FIELDS, ensure_search_index, search_master_items as search_master_index
+from services.normalize import ensure_normalized_names
+from services import metrics
 
 Base.metadata.create_all(bind=engine)
+ensure_catalog_state(engine)
+ensure_normalized_names(engine, [MasterItem.__table__, SupplierItem.__table__])
+ensure_supplier_item_columns(engine)
+ensure_memory_name_keys(engine)
+ensure_indexes(engine, [MatchCandidate.__table__])
+ensure_search_index(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Long-lived matcher index: loaded from the local snapshot when it is current,
+    # then kept in sync with master item changes instead of being rebuilt per match run.
+    # With SHARED_MASTER_INDEX all workers map one catalog snapshot file instead
+    db = SessionLocal()
+    try:
+        app.state.master_index = open_master_index(db)
+    finally:
+        db.close()
+
+    yield
+
+    cancel_local_jobs()
+    app.state.master_index.close()
 
-app = FastAPI(title="Nomenklatura Matcher API")
+
+app = FastAPI(title="Nomenklatura Matcher API", lifespan=lifespan)
+
+# Matched items read from the DB per batch while streaming an export
+EXPORT_BATCH_SIZE = 5000
+
+EXPORT_FORMATS = {
+    "csv": (iter_1c_export_csv, "text/csv"),
+    "xml": (iter_1c_export_xml, "application/xml"),
+}
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,48 +74,149 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    if not metrics.METRICS_ENABLED:
+        return await call_next(request)
+
+    with metrics.RequestTimings(request.method, request.url.path) as timings:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        timings.route = getattr(route, "path", None)
+        timings.status = response.status_code
+    return response
+
+
+@app.get("/api/metrics")
+def get_metrics():
+    """Stage timings and counters of upload, matching and export in the Prometheus text format."""
+    return Response(content=metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/api/master-items/")
 def get_master_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     """Fetch the reference nomenclature."""
-    return db.query(MasterItem).offset(skip).limit(limit).all()
+    rows = db.execute(select(*MASTER_ITEM_FIELDS).offset(skip).limit(limit))
+    return [row._asdict() for row in rows]
+
+
+@app.post("/api/master-items/import/")
+async def import_master_items(file: UploadFile = File(...)):
+    """
+    Imports or refreshes the 1C nomenclature from a CSV, XLSX or CommerceML XML export.
+    Rows are streamed and upserted by code_1c; unchanged items are not written.
+    """
+    try:
+        return await run_in_upload_pool(process_catalog_import, file.file, file.filename)
+    except UploadQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(UPLOAD_QUEUE_TIMEOUT)})
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post("/api/upload/")
 async def upload_supplier_price(
     supplier_name: str = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    mode: str = Form("delta"), # "delta" or "append"
 ):
-    """Uploads a price list, parses it and saves unmatched items to DB."""
-    contents = await file.read()
-    
+    """
+    Uploads a price list, parses it and saves its items to DB.
+    In "delta" mode (default) rows are upserted by supplier + barcode/article/name, only new
+    and changed rows are written, and a re-upload of the supplier's latest file is skipped.
+    Parsing and writing run on the upload pool, the event loop keeps serving other requests.
+    """
+    if mode not in INGEST_MODES:
+        raise HTTPException(status_code=400, detail="Invalid mode. Use 'delta' or 'append'")
+
     try:
-        records = parse_price_list(contents, file.filename, supplier_name)
+        return await run_upload(file.file, file.filename, supplier_name, mode)
+    except UploadQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(UPLOAD_QUEUE_TIMEOUT)})
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-        
-    db_items = []
-    for record in records:
-        db_item = SupplierItem(
-            supplier_name=supplier_name,
-            name=record['name'],
-            barcode=record['barcode'],
-            article=record['article'],
-            price=record['price']
+
+
+@app.post("/api/uploads/")
+async def upload_supplier_prices(
+    files: List[UploadFile] = File(...),
+    supplier_name: List[str] = Form(...),
+    mode: str = Form("delta"),
+):
+    """
+    Uploads several price lists at once, parsed in parallel on the upload pool.
+    Pass one supplier_name per file (in the same order), or a single one for all of them.
+    Returns a result per file; a file that fails doesn't stop the others.
+    """
+    if mode not in INGEST_MODES:
+        raise HTTPException(status_code=400, detail="Invalid mode. Use 'delta' or 'append'")
+    if len(supplier_name) not in (1, len(files)):
+        raise HTTPException(status_code=400, detail="Pass one supplier_name per file or a single one for all files")
+
+    supplier_names = supplier_name * len(files) if len(supplier_name) == 1 else supplier_name
+    results = await run_uploads(
+        [(file.file, file.filename, name) for file, name in zip(files, supplier_names)], mode
+    )
+    return {
+        "uploaded": sum(result["status"] == "ok" for result in results),
+        "failed": sum(result["status"] == "error" for result in results),
+        "results": results,
+    }
+
+
+@app.post("/api/match/", status_code=202)
+def run_matching(
+    request: Request,
+    supplier: Optional[str] = None,
+    upload_id: Optional[int] = None,
+    rescore: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Starts a background matching job for the unmatched supplier items of one supplier,
+    one upload batch or (without parameters) all of them.
+    Items that already failed against the current catalog are skipped unless `rescore=true`.
+    Poll /api/match/jobs/{job_id} for progress.
+    """
+    if supplier and upload_id is not None:
+        raise HTTPException(status_code=400, detail="Pass either supplier or upload_id, not both")
+    if upload_id is not None and not db.get(PriceListUpload, upload_id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+    try:
+        job = start_match_job(
+            db,
+            index=request.app.state.master_index,
+            scope=match_scope(supplier_name=supplier, upload_id=upload_id),
+            rescore=rescore,
         )
-        db_items.append(db_item)
-        
-    db.add_all(db_items)
-    db.commit()
-    
-    return {"message": f"Successfully parsed and saved {len(db_items)} items from {file.filename}"}
+    except MatchJobConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "job_id": e.job_id})
+    return job_to_dict(job)
+
+
+@app.get("/api/match/jobs/")
+def get_match_jobs(db: Session = Depends(get_db)):
+    """Recent matching jobs, newest first."""
+    return [job_to_dict(job) for job in list_match_jobs(db)]
 
 
-@app.post("/api/match/")
-def run_matching(db: Session = Depends(get_db)):
-    """Triggers the matching logic for all currently unmatched supplier items."""
-    result = match_supplier_items(db)
-    return {"message": "Matching run completed", **result}
+@app.get("/api/match/jobs/{job_id}")
+def get_match_job_status(job_id: int, db: Session = Depends(get_db)):
+    """Status and progress (processed items, matches per stage, ETA) of a matching job."""
+    job = get_match_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Matching job not found")
+    return job_to_dict(job)
+
+
+@app.post("/api/match/jobs/{job_id}/cancel")
+def cancel_matching(job_id: int, db: Session = Depends(get_db)):
+    """Cancels a matching job; items matched before the last checkpoint stay matched."""
+    job = cancel_match_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Matching job not found")
+    return job_to_dict(job)
 
 
 @app.get("/api/results/")
@@ -73,49 +224,39 @@ def get_results(
     status: Optional[str] = None, # "matched", "unmatched"
     skip: int = 0, 
     limit: int = 100, 
+    after_id: Optional[int] = None, # keyset cursor: `next_cursor` of the previous page
     db: Session = Depends(get_db)
 ):
-    """Returns the matching results."""
-    query = db.query(SupplierItem)
-    if status == "matched":
-        query = query.filter(SupplierItem.is_matched == True)
-    elif status == "unmatched":
-        query = query.filter(SupplierItem.is_matched == False)
-        
-    # Join with MasterItem to return the matched item details
-    items = query.offset(skip).limit(limit).all()
-    
-    # Format response
-    response_items = []
-    for item in items:
-        resp = {
-            "id": item.id,
-            "supplier_name": item.supplier_name,
-            "name": item.name,
-            "barcode": item.barcode,
-            "article": item.article,
-            "price": item.price,
-            "is_matched": item.is_matched,
-            "match_confidence": item.match_confidence,
-            "match_type": item.match_type
-        }
-        if item.is_matched and item.matched_master_id:
-            master = db.query(MasterItem).filter(MasterItem.id == item.matched_master_id).first()
-            if master:
-                resp["master_item"] = {
-                    "id": master.id,
-                    "name": master.name,
-                    "barcode": master.barcode,
-                    "article": master.article,
-                    "code_1c": master.code_1c
-                }
-        response_items.append(resp)
-        
-    return response_items
+    """
+    Returns the matching results with their matched master items (one joined query).
+    Page through large result sets with `after_id` instead of `skip`.
+    """
+    items, next_cursor = fetch_results(db, status=status, skip=skip, limit=limit, after_id=after_id)
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/api/review/")
+def get_review_queue(
+    limit: int = 50,
+    after_id: Optional[int] = None, # keyset cursor: `next_cursor` of the previous page
+    supplier: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Items waiting for manual review (unmatched or low-confidence fuzzy matches), each with
+    the best candidates scored by the last match run, so no per-row search is needed.
+    """
+    items, next_cursor = fetch_review_queue(
+        db, REVIEW_CONFIDENCE_THRESHOLD, limit=limit, after_id=after_id, supplier_name=supplier
+    )
+    return {"items": items, "next_cursor": next_cursor}
 
 @app.post("/api/manual-match/{supplier_item_id}")
 def manual_match(supplier_item_id: int, master_item_id: int, db: Session = Depends(get_db)):
-    """API to handle manual matching reviews by user"""
+    """
+    API to handle manual matching reviews by user.
+    The decision is also stored in match memory, so the same item from this supplier
+    is matched to the same master item by later runs without scoring.
+    """
     s_item = db.query(SupplierItem).filter(SupplierItem.id == supplier_item_id).first()
     if not s_item:
         raise HTTPException(status_code=404, detail="Supplier item not found")
@@ -128,43 +269,92 @@ def manual_match(supplier_item_id: int, master_item_id: int, db: Session = Depen
     s_item.matched_master_id = m_item.id
     s_item.match_confidence = 100.0
     s_item.match_type = "manual"
+    remember_match(db, s_item.supplier_name, s_item.barcode, s_item.article, s_item.name, m_item.id)
+    # Reviewed, its suggestions are no longer needed
+    store_candidates(db, [s_item.id], [])
     
     db.commit()
     return {"success": True}
 
+class ReviewDecision(BaseModel):
+    supplier_item_id: int
+    master_item_id: Optional[int] = None
+    action: str = "match" # "match", "reject" or "unmatch"
+
+
+class ReviewDecisions(BaseModel):
+    decisions: List[ReviewDecision]
+
+
+@app.post("/api/manual-match/")
+def manual_match_batch(payload: ReviewDecisions, db: Session = Depends(get_db)):
+    """
+    Applies many review decisions (matches, rejected suggestions, unmatches) at once,
+    validated with set-based queries and written in one transaction.
+    Returns an outcome per decision; invalid ones are reported and don't stop the rest.
+    """
+    outcomes = apply_review_decisions(
+        db, [(decision.supplier_item_id, decision.master_item_id, decision.action) for decision in payload.decisions]
+    )
+    return {
+        "applied": sum(outcome["status"] == "applied" for outcome in outcomes),
+        "failed": sum(outcome["status"] == "invalid" for outcome in outcomes),
+        "results": outcomes,
+    }
+
 @app.get("/api/search-master-items/")
 def search_master_items(query: str, db: Session = Depends(get_db)):
-    """Used in the frontend to search for master items during manual matching review."""
-    items = db.query(MasterItem).filter(
-        or_(
-            MasterItem.name.ilike(f"%{query}%"),
-            MasterItem.barcode.ilike(f"%{query}%"),
-            MasterItem.article.ilike(f"%{query}%")
-        )
-    ).limit(50).all()
-    return items
+    """
+    Used in the frontend to search for master items during manual matching review.
+    Exact barcode/article hits first, then codes and names starting with the query, then
+    names containing its terms. Name matches are ranked by similarity within the first
+    SEARCH_RANK_WINDOW matches by id (see services.search): for very common terms a
+    better match further down the catalog can be missed, a more specific query finds it.
+    """
+    return search_master_index(db, query)
 
 @app.get("/api/export/")
-def export_matched_items(format: str = "csv", db: Session = Depends(get_db)):
-    """Export all matched items for 1C import."""
-    matched_items = get_results(status="matched", skip=0, limit=100000, db=db)
-    
-    if not matched_items:
+def export_matched_items(format: str = "csv", gzip: bool = False, db: Session = Depends(get_db)):
+    """
+    Export all matched items for 1C import.
+    The file is streamed while matched items are read in batches, so there is no row cap;
+    `gzip=true` compresses it on the fly.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format. Use 'csv' or 'xml'")
+
+    has_matches = db.execute(
+        select(SupplierItem.id).where(SupplierItem.is_matched == True).limit(1)
+    ).first()
+    if not has_matches:
         raise HTTPException(status_code=404, detail="No matched items to export")
-        
-    if format == "csv":
-        csv_data = generate_1c_export_csv(matched_items)
-        return Response(
-            content=csv_data, 
-            media_type="text/csv", 
-            headers={"Content-Disposition": "attachment; filename=export_1c.csv"}
-        )
-    elif format == "xml":
-        xml_data = generate_1c_export_xml(matched_items)
-        return Response(
-            content=xml_data, 
-            media_type="application/xml", 
-            headers={"Content-Disposition": "attachment; filename=export_1c.xml"}
-        )
-    else:
-         raise HTTPException(status_code=400, detail="Invalid format. Use 'csv' or 'xml'")
+
+    generate_chunks, media_type = EXPORT_FORMATS[format]
+    filename = f"export_1c.{format}"
+
+    def stream():
+        # The request session is closed once the endpoint returns, stream with our own
+        export_db = SessionLocal()
+        try:
+            matched_items = metrics.timed_iter(
+                iter_results(export_db, status="matched", batch_size=EXPORT_BATCH_SIZE),
+                "export.fetch", "export_rows_total", format=format,
+            )
+            chunks = generate_chunks(matched_items)
+            if gzip:
+                yield from gzip_chunks(chunks)
+            else:
+                for chunk in chunks:
+                    yield chunk.encode("utf-8")
+        finally:
+            export_db.close()
+
+    if gzip:
+        media_type = "application/gzip"
+        filename += ".gz"
+
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
@@ -1,9 +1,23 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, Float, Boolean, ForeignKey, DateTime, JSON, Index, UniqueConstraint, event
 from sqlalchemy.ext.declarative import declarative_base
 
+from services.normalize import NORMALIZATION_VERSION, normalize_name
+
 Base = declarative_base()
 
-class MasterItem(Base):
+def _name_norm_default(context):
+    # Core inserts (bulk ingest, catalog imports) get the normalized name computed per row
+    return normalize_name(context.get_current_parameters().get("name"))
+
+class NormalizedName:
+    """
+    `name_norm` is the normalized form of `name` the matcher works on (see services.normalize),
+    computed when the item is written instead of on every comparison.
+    """
+    name_norm = Column(String, nullable=True, default=_name_norm_default)
+    name_norm_version = Column(Integer, nullable=True, default=NORMALIZATION_VERSION)
+
+class MasterItem(NormalizedName, Base):
     __tablename__ = "master_items"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -13,7 +27,7 @@ class MasterItem(Base):
     # The actual ID or code in 1C to identify the item on export
     code_1c = Column(String, unique=True, index=True, nullable=False)
 
-class SupplierItem(Base):
+class SupplierItem(NormalizedName, Base):
     __tablename__ = "supplier_items"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -22,9 +36,115 @@ class SupplierItem(Base):
     article = Column(String, index=True, nullable=True)
     name = Column(String, nullable=False)
     price = Column(Float, nullable=True)
+    # Natural key within the supplier's price list (barcode, else article, else name hash),
+    # delta uploads update the row with the same key instead of inserting a new one
+    item_key = Column(String, nullable=True)
+    # Upload batch (price_list_uploads) that last wrote the row
+    upload_id = Column(Integer, ForeignKey("price_list_uploads.id"), nullable=True, index=True)
     
     # Matching status
     is_matched = Column(Boolean, default=False)
     matched_master_id = Column(Integer, ForeignKey("master_items.id"), nullable=True)
     match_confidence = Column(Float, nullable=True) # E.g., 100 for exact, 85 for fuzzy
-    match_type = Column(String, nullable=True) # E.g., 'barcode', 'article', 'fuzzy', 'manual'
+    match_type = Column(String, nullable=True) # E.g., 'memory', 'barcode', 'article', 'fuzzy', 'manual'
+    # Catalog version of the last run that tried and failed to match the row;
+    # runs skip it until the catalog changes
+    match_attempted_version = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_supplier_items_supplier_key", "supplier_name", "item_key"),
+        # Hot filters: results/export pages and matcher runs (status, keyset by id),
+        # per supplier and per upload batch scopes, items matched to a master item
+        Index("ix_supplier_items_matched_id", "is_matched", "id"),
+        Index("ix_supplier_items_supplier_matched", "supplier_name", "is_matched", "id"),
+        Index("ix_supplier_items_upload_matched", "upload_id", "is_matched", "id"),
+        Index("ix_supplier_items_master_matched", "matched_master_id", "is_matched"),
+    )
+
+@event.listens_for(MasterItem.name, "set")
+@event.listens_for(SupplierItem.name, "set")
+def _normalize_name(target, value, oldvalue, initiator):
+    # ORM writes: keep the stored form in step with every name assignment
+    target.name_norm = normalize_name(value)
+    target.name_norm_version = NORMALIZATION_VERSION
+
+class PriceListUpload(Base):
+    __tablename__ = "price_list_uploads"
+
+    id = Column(Integer, primary_key=True, index=True)
+    supplier_name = Column(String, nullable=False, index=True)
+    filename = Column(String, nullable=True)
+    # SHA-256 of the uploaded file, a re-upload of the supplier's latest file is skipped
+    content_hash = Column(String, nullable=False)
+    mode = Column(String, nullable=False, default="delta") # 'delta' or 'append'
+
+    rows = Column(Integer, nullable=False, default=0)
+    inserted = Column(Integer, nullable=False, default=0)
+    updated = Column(Integer, nullable=False, default=0)
+    unchanged = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime, nullable=False)
+    # Set when all rows are written; an upload that failed midway keeps the rows it committed
+    completed_at = Column(DateTime, nullable=True)
+
+class MatchMemory(Base):
+    __tablename__ = "match_memory"
+
+    id = Column(Integer, primary_key=True, index=True)
+    supplier_name = Column(String, nullable=False)
+    # Natural key of the supplier item: "b:<barcode>", "a:<article>" or "t:<name hash>" (see services.ingest.item_key)
+    key = Column(String, nullable=False)
+    master_item_id = Column(Integer, ForeignKey("master_items.id"), nullable=False)
+    source = Column(String, nullable=False, default="manual") # Who made the decision, e.g. 'manual'
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("supplier_name", "key", name="uq_match_memory_supplier_key"),
+    )
+
+class MatchCandidate(Base):
+    __tablename__ = "match_candidates"
+
+    id = Column(Integer, primary_key=True)
+    # Top-k master items scored for an unmatched or low-confidence supplier item, kept for manual review
+    supplier_item_id = Column(Integer, ForeignKey("supplier_items.id"), nullable=False, index=True)
+    master_item_id = Column(Integer, ForeignKey("master_items.id"), nullable=False)
+    rank = Column(Integer, nullable=False) # 0 is the best candidate
+    score = Column(Float, nullable=False)
+    stage = Column(String, nullable=False) # Stage that scored it, e.g. 'fuzzy'
+
+    __table_args__ = (
+        # Covers the review queue join: an item's candidates in rank order without table lookups
+        Index("ix_match_candidates_item_rank", "supplier_item_id", "rank", "master_item_id", "score", "stage"),
+    )
+
+class CatalogState(Base):
+    __tablename__ = "catalog_state"
+
+    id = Column(Integer, primary_key=True)
+    # Bumped on every change of master_items, lets long-lived indexes detect stale data
+    version = Column(Integer, nullable=False, default=0)
+    # Random id of this database's catalog: a snapshot of another (e.g. recreated) database
+    # that happens to be at the same version isn't taken for current
+    epoch = Column(BigInteger)
+
+class MatchJob(Base):
+    __tablename__ = "match_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # Which supplier items the run covers, e.g. "all"
+    scope = Column(String, nullable=False, default="all")
+    status = Column(String, nullable=False, default="queued", index=True) # 'queued', 'running', 'completed', 'failed', 'cancelled'
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+
+    # Progress, updated at every matcher checkpoint
+    total = Column(Integer, nullable=True)
+    processed = Column(Integer, nullable=False, default=0)
+    matched_by_stage = Column(JSON, nullable=True) # E.g. {"barcode": 10, "article": 2, "fuzzy": 5}
+    error = Column(String, nullable=True)
+
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    # Heartbeat: a running job that stops updating is considered dead
+    updated_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
@@ -0,0 +1,107 @@
+import heapq
+import math
+from collections import defaultdict
+from typing import Iterable, List, Optional, Sized
+
+
+def name_tokens(name_norm: str) -> set:
+    """
+    Tokens of a normalized name (see services.normalize) used for candidate blocking.
+    They are exactly the tokens `token_set_ratio` compares, including the
+    separator-free forms of model codes ("wh-1000xm5" -> "wh1000xm5").
+    """
+    return set(name_norm.split()) if name_norm else set()
+
+
+class TokenBlockingIndex:
+    """
+    Inverted index from normalized name tokens to master item ids.
+    Used to pick a short list of candidates that share tokens with a supplier item
+    name, so the fuzzy scorer does not have to scan the whole nomenclature.
+    """
+
+    def __init__(self, items: Optional[Iterable[tuple]] = None):
+        # token -> set of master ids
+        self._postings = {}
+        self._ids = set()
+        # Tokens whose posting set belongs to this index alone, see copy()
+        self._owned = set()
+
+        for master_id, name in items or []:
+            self.add(master_id, name)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def copy(self) -> "TokenBlockingIndex":
+        """
+        Copy sharing the posting sets with this index: a set is only copied once either
+        index changes it, so a few changes to a copy of a big index stay cheap.
+        """
+        other = TokenBlockingIndex()
+        other._postings = dict(self._postings)
+        other._ids = set(self._ids)
+        self._owned = set()
+        return other
+
+    def add(self, master_id: int, name: str):
+        self._ids.add(master_id)
+        for token in name_tokens(name):
+            self._own(token).add(master_id)
+
+    def remove(self, master_id: int, name: str):
+        """Removes a master item; `name` must be the normalized name it was added with."""
+        self._ids.discard(master_id)
+        for token in name_tokens(name):
+            if token not in self._postings:
+                continue
+            posting = self._own(token)
+            posting.discard(master_id)
+            if not posting:
+                del self._postings[token]
+                self._owned.discard(token)
+
+    def candidates(self, name: str, limit: Optional[int]) -> List[int]:
+        """
+        Returns ids of the master items sharing the most (IDF-weighted) tokens with the
+        normalized name `name`, at most `limit` of them, ordered by id (the order the
+        nomenclature is scanned in).
+        """
+        return select_candidates(
+            (self._postings.get(token) for token in name_tokens(name)), len(self._ids), limit
+        )
+
+    def _own(self, token: str) -> set:
+        posting = self._postings.get(token)
+        if posting is None:
+            posting = self._postings[token] = set()
+        elif token not in self._owned:
+            posting = self._postings[token] = set(posting)
+        self._owned.add(token)
+        return posting
+
+
+def select_candidates(postings: Iterable[Optional[Sized]], total: int, limit: Optional[int]) -> List[int]:
+    """
+    Candidate selection of `TokenBlockingIndex.candidates` over the postings (master ids)
+    of a name's tokens, None for unknown tokens, in an index of `total` items.
+    """
+    weights = defaultdict(float)
+
+    for posting in postings:
+        if not posting:
+            continue
+        # Rare tokens (model codes, brands) say much more than "black" or "256gb"
+        idf = math.log(1 + total / len(posting))
+        for master_id in posting:
+            weights[master_id] += idf
+
+    if limit is not None and len(weights) > limit:
+        best = heapq.nlargest(
+            limit, weights.items(), key=lambda kv: (kv[1], -kv[0])
+        )
+        selected = [master_id for master_id, _ in best]
+    else:
+        selected = list(weights)
+
+    return sorted(selected)
@@ -0,0 +1,390 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Mapping
+from typing import Iterable, Iterator, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import MasterItem
+from services.blocking import name_tokens, select_candidates
+from services.master_index import MasterIndex, get_catalog_stamp, get_catalog_version
+from services.normalize import NORMALIZATION_VERSION
+
+# Matcher index backed by one memory-mapped catalog file shared by all worker processes
+# of the host (see SharedMasterIndex) instead of a private MasterIndex per worker
+SHARED_MASTER_INDEX = False
+
+# Catalog snapshot file; keep it on a local disk shared by the workers
+MASTER_CATALOG_SNAPSHOT_PATH = "./master_catalog.snapshot"
+
+# Layout: header, then int64 sections (ids, name/barcode/article offsets, barcode and
+# article hash tables, token offsets, posting offsets, postings, token hash table), then
+# the UTF-8 name, barcode, article and token bytes. Postings are the ids of the items
+# having a name token, for the token blocking index.
+# Bump SNAPSHOT_VERSION when it changes
+SNAPSHOT_MAGIC = b"NMKCATLG"
+SNAPSHOT_VERSION = 3
+_HEADER = struct.Struct("<8sIIqqqqqqqqqq")
+_INT = array("q").itemsize
+
+
+def write_catalog_snapshot(path: str, epoch: Optional[int], version: int, rows: Iterable[tuple]) -> int:
+    """
+    Writes (id, barcode, article, normalized name) rows, in id order, as a snapshot file
+    of catalog `version` of the catalog `epoch` (see services.master_index.get_catalog_stamp). The file is written next to `path` and renamed over it, so
+    readers either see the old snapshot or the complete new one. Returns the row count.
+    """
+    ids = array("q")
+    columns = [(array("q", [0]), bytearray()) for _ in range(3)]
+    barcode_rows, article_rows = {}, {}
+    postings = defaultdict(lambda: array("q"))
+
+    for row, (master_id, barcode, article, name) in enumerate(rows):
+        ids.append(master_id)
+        for (offsets, blob), value in zip(columns, (name, barcode, article)):
+            blob += (value or "").encode("utf-8")
+            offsets.append(len(blob))
+        # On duplicates the highest id wins, like MasterIndex.barcode_lookup
+        if barcode:
+            barcode_rows[barcode.encode("utf-8")] = row
+        if article:
+            article_rows[article.encode("utf-8")] = row
+        for token in name_tokens(name):
+            postings[token].append(master_id)
+
+    # Token n's postings are posting_ids[posting_offsets[n]:posting_offsets[n + 1]], in id order
+    token_offsets, token_blob = array("q", [0]), bytearray()
+    posting_offsets, posting_ids = array("q", [0]), array("q")
+    token_numbers = {}
+    for number, token in enumerate(sorted(postings)):
+        key = token.encode("utf-8")
+        token_blob += key
+        token_offsets.append(len(token_blob))
+        posting_ids.extend(postings.pop(token))
+        posting_offsets.append(len(posting_ids))
+        token_numbers[key] = number
+
+    barcode_table = _hash_table(barcode_rows)
+    article_table = _hash_table(article_rows)
+    token_table = _hash_table(token_numbers)
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, NORMALIZATION_VERSION, epoch or 0, version, len(ids),
+        len(barcode_table), len(barcode_rows), len(article_table), len(article_rows),
+        len(token_numbers), len(posting_ids), len(token_table),
+    )
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".master_catalog.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            for section in (
+                ids, *(offsets for offsets, _ in columns), barcode_table, article_table,
+                token_offsets, posting_offsets, posting_ids, token_table,
+            ):
+                section.tofile(f)
+            for _, blob in columns:
+                f.write(blob)
+            f.write(token_blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(ids)
+
+
+def _hash_table(rows: dict) -> array:
+    # Open addressing with linear probing, at most half full; slots hold row + 1, 0 is empty
+    size = 8
+    while size < 2 * len(rows):
+        size *= 2
+    table = array("q", bytes(size * _INT))
+    mask = size - 1
+    for key, row in rows.items():
+        slot = zlib.crc32(key) & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = row + 1
+    return table
+
+
+class CatalogSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot file written by `write_catalog_snapshot`.
+    Nothing is copied on open: the page cache holds one physical copy of the file for
+    every process mapping it.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (
+                magic, snapshot_version, normalization_version, self.epoch, self.version, self.count,
+                barcode_slots, barcode_keys, article_slots, article_keys,
+                token_count, posting_count, token_slots,
+            ) = _HEADER.unpack_from(self._mmap)
+        except struct.error:
+            self._mmap.close()
+            raise ValueError(f"Not a catalog snapshot: {path}")
+        if (magic, snapshot_version, normalization_version) != (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, NORMALIZATION_VERSION):
+            self._mmap.close()
+            raise ValueError(f"Incompatible catalog snapshot: {path}")
+
+        self._views = []
+        position = _HEADER.size
+        sections = []
+        for length in (
+            self.count, self.count + 1, self.count + 1, self.count + 1, barcode_slots, article_slots,
+            token_count + 1, token_count + 1, posting_count, token_slots,
+        ):
+            sections.append(self._view(position, position + length * _INT, "q"))
+            position += length * _INT
+        (
+            self.ids, name_offsets, barcode_offsets, article_offsets, barcode_table, article_table,
+            token_offsets, posting_offsets, posting_ids, token_table,
+        ) = sections
+
+        blobs = []
+        for offsets in (name_offsets, barcode_offsets, article_offsets, token_offsets):
+            blobs.append(self._view(position, position + offsets[-1]))
+            position += offsets[-1]
+
+        self.names = _Column(name_offsets, blobs[0])
+        self.barcodes = _Column(barcode_offsets, blobs[1])
+        self.articles = _Column(article_offsets, blobs[2])
+        self.barcode_lookup = CodeLookup(self, barcode_table, barcode_keys, self.barcodes)
+        self.article_lookup = CodeLookup(self, article_table, article_keys, self.articles)
+        self.blocking = SnapshotBlockingIndex(
+            self, token_table, _Column(token_offsets, blobs[3]), posting_offsets, posting_ids
+        )
+
+    @classmethod
+    def open(cls, path: str = MASTER_CATALOG_SNAPSHOT_PATH) -> Optional["CatalogSnapshot"]:
+        """Maps the snapshot file, or returns None when it is missing or has another layout."""
+        try:
+            return cls(path)
+        except (OSError, ValueError):
+            return None
+
+    def __len__(self):
+        return self.count
+
+    def row_of(self, master_id: int) -> int:
+        """Row of a master id (ids are stored sorted), -1 if absent."""
+        row = bisect_left(self.ids, master_id)
+        return row if row < self.count and self.ids[row] == master_id else -1
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        self._mmap.close()
+
+    def _view(self, start: int, end: int, item_format: str = "B") -> memoryview:
+        # Tracked so close() can release every buffer export before unmapping
+        with memoryview(self._mmap) as whole:
+            view = whole[start:end].cast(item_format)
+        self._views.append(view)
+        return view
+
+
+class _Column:
+    """Variable-length UTF-8 values of one column, addressed by row."""
+
+    def __init__(self, offsets: memoryview, blob: memoryview):
+        self.offsets = offsets
+        self.blob = blob
+
+    def raw(self, row: int) -> bytes:
+        return self.blob[self.offsets[row]:self.offsets[row + 1]].tobytes()
+
+    def __getitem__(self, row: int) -> str:
+        return str(self.blob[self.offsets[row]:self.offsets[row + 1]], "utf-8")
+
+
+class SnapshotNames(Mapping):
+    """Master id -> normalized name over a snapshot, iterated in id order like MasterIndex.names."""
+
+    def __init__(self, snapshot: CatalogSnapshot):
+        self.snapshot = snapshot
+
+    def __getitem__(self, master_id: int) -> str:
+        row = self.snapshot.row_of(master_id)
+        if row < 0:
+            raise KeyError(master_id)
+        return self.snapshot.names[row]
+
+    def __contains__(self, master_id) -> bool:
+        return isinstance(master_id, int) and self.snapshot.row_of(master_id) >= 0
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.snapshot.ids)
+
+    def __len__(self):
+        return self.snapshot.count
+
+    def values(self) -> Iterator[str]:
+        # Sequential scan instead of one id lookup per value
+        names = self.snapshot.names
+        return (names[row] for row in range(self.snapshot.count))
+
+    def items(self) -> Iterator[tuple]:
+        names = self.snapshot.names
+        return ((master_id, names[row]) for row, master_id in enumerate(self.snapshot.ids))
+
+
+class CodeLookup(Mapping):
+    """Barcode or article -> master id through a snapshot hash table."""
+
+    def __init__(self, snapshot: CatalogSnapshot, table: memoryview, keys: int, column: _Column):
+        self.snapshot = snapshot
+        self.table = table
+        self.keys_count = keys
+        self.column = column
+
+    def __getitem__(self, code: str) -> int:
+        if not isinstance(code, str) or not code:
+            raise KeyError(code)
+        row = _probe(self.table, self.column, code.encode("utf-8"))
+        if row < 0:
+            raise KeyError(code)
+        return self.snapshot.ids[row]
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.column[entry - 1] for entry in self.table if entry)
+
+    def __len__(self):
+        return self.keys_count
+
+
+class SnapshotBlockingIndex:
+    """
+    Read-only TokenBlockingIndex over the token postings of a snapshot: the same candidates,
+    without building per-process posting sets.
+    """
+
+    def __init__(self, snapshot: CatalogSnapshot, table: memoryview, tokens: _Column, offsets: memoryview, postings: memoryview):
+        self.snapshot = snapshot
+        self.table = table
+        self.tokens = tokens
+        self.offsets = offsets
+        self.postings = postings
+
+    def __len__(self):
+        return self.snapshot.count
+
+    def candidates(self, name: str, limit: Optional[int]) -> List[int]:
+        """See TokenBlockingIndex.candidates."""
+        return select_candidates((self._posting(token) for token in name_tokens(name)), self.snapshot.count, limit)
+
+    def _posting(self, token: str) -> Optional[memoryview]:
+        number = _probe(self.table, self.tokens, token.encode("utf-8"))
+        if number < 0:
+            return None
+        return self.postings[self.offsets[number]:self.offsets[number + 1]]
+
+
+def _probe(table: memoryview, column: _Column, key: bytes) -> int:
+    # Row of `key` in `column` through a hash table written by _hash_table, -1 if absent
+    mask = len(table) - 1
+    slot = zlib.crc32(key) & mask
+    while entry := table[slot]:
+        if column.raw(entry - 1) == key:
+            return entry - 1
+        slot = (slot + 1) & mask
+    return -1
+
+
+class SnapshotView:
+    """CatalogView (see services.master_index) over a mapped snapshot; read-only by nature."""
+
+    def __init__(self, snapshot: CatalogSnapshot):
+        self.snapshot = snapshot
+        self.epoch = snapshot.epoch
+        self.version = snapshot.version
+        self.names = SnapshotNames(snapshot)
+        self.barcode_lookup = snapshot.barcode_lookup
+        self.article_lookup = snapshot.article_lookup
+        self.blocking = snapshot.blocking
+
+    def __len__(self):
+        return len(self.snapshot)
+
+
+class SharedMasterIndex:
+    """
+    MasterIndex counterpart for multi-worker deployments: ids, codes, normalized names and
+    the token blocking postings live in a memory-mapped snapshot file (see
+    `write_catalog_snapshot`) shared by every worker, instead of per-process dicts. The
+    snapshot is read-only; when the catalog version changes, `ensure_current` maps the
+    newer file another worker already wrote, or rebuilds it from master_items and swaps it
+    in atomically. Runs keep the view of the snapshot they started with.
+    """
+
+    def __init__(self, snapshot: CatalogSnapshot, path: str = MASTER_CATALOG_SNAPSHOT_PATH):
+        self.path = path
+        # Held while the snapshot is checked and swapped, never while matching
+        self.lock = threading.RLock()
+        self._use(snapshot)
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    @property
+    def version(self) -> int:
+        return self._view.version
+
+    @classmethod
+    def open_or_build(cls, db: Session, path: str = MASTER_CATALOG_SNAPSHOT_PATH) -> "SharedMasterIndex":
+        return cls(_current_snapshot(db, path), path)
+
+    def current(self) -> SnapshotView:
+        return self._view
+
+    def ensure_current(self, db: Session, path: Optional[str] = None):
+        """Costs a single-row SELECT when the mapped snapshot reflects the current catalog version."""
+        with self.lock:
+            if self.version != get_catalog_version(db):
+                self._use(_current_snapshot(db, path or self.path))
+
+    def close(self):
+        self.snapshot.close()
+
+    def _use(self, snapshot: CatalogSnapshot):
+        # A replaced snapshot is unmapped once nothing references its views any more
+        self.snapshot = snapshot
+        self._view = SnapshotView(snapshot)
+
+
+def open_master_index(db: Session):
+    """The long-lived matcher index of an app process, as configured by SHARED_MASTER_INDEX."""
+    if SHARED_MASTER_INDEX:
+        return SharedMasterIndex.open_or_build(db)
+    return MasterIndex.load_or_build(db).attach()
+
+
+def _current_snapshot(db: Session, path: str) -> CatalogSnapshot:
+    epoch, version = get_catalog_stamp(db)
+    snapshot = CatalogSnapshot.open(path)
+    if snapshot is not None:
+        if (snapshot.epoch, snapshot.version) == (epoch or 0, version):
+            return snapshot
+        snapshot.close()
+
+    rows = db.execute(
+        select(MasterItem.id, MasterItem.barcode, MasterItem.article, MasterItem.name_norm)
+        .order_by(MasterItem.id)
+    )
+    write_catalog_snapshot(path, epoch, version, rows)
+    return CatalogSnapshot(path)
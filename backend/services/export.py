@@ -1,27 +1,36 @@
 import csv
+import zlib
 from io import StringIO
-from typing import List
-import xml.etree.ElementTree as ET
+from typing import Iterable, Iterator, List
+from xml.sax.saxutils import escape
 
-def generate_1c_export_csv(matched_items: List[dict]) -> str:
+# Rows written into the output buffer before it is handed to the response
+EXPORT_FLUSH_ROWS = 1000
+
+CSV_HEADER = [
+    "Код1С",          # Master Item code
+    "Номенклатура",   # Master Item name
+    "Поставщик",      # Supplier Name
+    "АртикулПоставщика",
+    "Штрихкод",
+    "Цена"
+]
+
+
+def iter_1c_export_csv(matched_items: Iterable[dict]) -> Iterator[str]:
     """
-    Generates a CSV string containing the matched items formatted for 1C import.
+    Streams CSV text containing the matched items formatted for 1C import.
     Expected to include the 1C Code of the Master Item, Supplier Code/Name, and Price.
+    The header is yielded straight away, then one chunk per EXPORT_FLUSH_ROWS rows.
     """
     output = StringIO()
     writer = csv.writer(output, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-    
+
     # Headers suitable for a typical 1C upload document
-    writer.writerow([
-        "Код1С",          # Master Item code
-        "Номенклатура",   # Master Item name
-        "Поставщик",      # Supplier Name
-        "АртикулПоставщика",
-        "Штрихкод",
-        "Цена"
-    ])
-    
-    for item in matched_items:
+    writer.writerow(CSV_HEADER)
+    yield _drain(output)
+
+    for i, item in enumerate(matched_items, 1):
         master = item.get("master_item", {})
         writer.writerow([
             master.get("code_1c", ""),
@@ -31,33 +40,87 @@ def generate_1c_export_csv(matched_items: List[dict]) -> str:
             item.get("barcode", ""),
             item.get("price", "")
         ])
-        
-    return output.getvalue()
+        if i % EXPORT_FLUSH_ROWS == 0:
+            yield _drain(output)
 
-def generate_1c_export_xml(matched_items: List[dict]) -> str:
+    tail = _drain(output)
+    if tail:
+        yield tail
+
+
+def iter_1c_export_xml(matched_items: Iterable[dict]) -> Iterator[str]:
     """
-    Generates an XML string (CommerceML-like) for 1C import.
+    Streams an XML document (CommerceML-like) for 1C import.
+    Writes the same indented document ElementTree used to build, one <Товар> fragment
+    at a time, so the whole tree never has to be held in memory.
     """
-    root = ET.Element("КоммерческаяИнформация", ВерсияСхемы="2.03", ДатаФормирования="")
-    docs = ET.SubElement(root, "Документ")
-    
+    yield (
+        "<?xml version='1.0' encoding='utf-8'?>\n"
+        '<КоммерческаяИнформация ВерсияСхемы="2.03" ДатаФормирования="">\n'
+        "  <Документ>\n"
+    )
+
     # Header metadata could go here (e.g., date, supplier, etc)
-    
-    items_node = ET.SubElement(docs, "Товары")
-    
+
+    buffer = []
+    has_items = False
     for item in matched_items:
+        if not has_items:
+            buffer.append("    <Товары>\n")
+            has_items = True
+
         master = item.get("master_item", {})
-        
-        item_node = ET.SubElement(items_node, "Товар")
-        ET.SubElement(item_node, "Ид").text = master.get("code_1c", "")
-        ET.SubElement(item_node, "Наименование").text = master.get("name", "")
-        ET.SubElement(item_node, "Поставщик").text = item.get("supplier_name", "")
-        ET.SubElement(item_node, "АртикулПоставщика").text = item.get("article", "")
-        ET.SubElement(item_node, "Штрихкод").text = item.get("barcode", "")
-        ET.SubElement(item_node, "ЦенаЗаЕдиницу").text = str(item.get("price", ""))
-        
-    # Pretty print hack (in Python 3.9+ use ET.indent, for older manual spacing)
-    if hasattr(ET, 'indent'):
-        ET.indent(root, space="  ", level=0)
-        
-    return ET.tostring(root, encoding='unicode', xml_declaration=True)
+        buffer.append(
+            "      <Товар>\n"
+            + _xml_element("Ид", master.get("code_1c", ""))
+            + _xml_element("Наименование", master.get("name", ""))
+            + _xml_element("Поставщик", item.get("supplier_name", ""))
+            + _xml_element("АртикулПоставщика", item.get("article", ""))
+            + _xml_element("Штрихкод", item.get("barcode", ""))
+            + _xml_element("ЦенаЗаЕдиницу", str(item.get("price", "")))
+            + "      </Товар>\n"
+        )
+        if len(buffer) >= EXPORT_FLUSH_ROWS:
+            yield "".join(buffer)
+            buffer = []
+
+    buffer.append("    </Товары>\n" if has_items else "    <Товары />\n")
+    buffer.append("  </Документ>\n</КоммерческаяИнформация>")
+    yield "".join(buffer)
+
+
+def generate_1c_export_csv(matched_items: List[dict]) -> str:
+    """
+    Generates a CSV string containing the matched items formatted for 1C import.
+    """
+    return "".join(iter_1c_export_csv(matched_items))
+
+
+def generate_1c_export_xml(matched_items: List[dict]) -> str:
+    """
+    Generates an XML string (CommerceML-like) for 1C import.
+    """
+    return "".join(iter_1c_export_xml(matched_items))
+
+
+def gzip_chunks(chunks: Iterable[str], encoding: str = "utf-8") -> Iterator[bytes]:
+    """Compresses a stream of text chunks into a gzip stream on the fly."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode(encoding))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _drain(output: StringIO) -> str:
+    data = output.getvalue()
+    output.seek(0)
+    output.truncate(0)
+    return data
+
+
+def _xml_element(tag: str, text) -> str:
+    if not text:
+        return f"        <{tag} />\n"
+    return f"        <{tag}>{escape(text)}</{tag}>\n"
@@ -0,0 +1,340 @@
+import hashlib
+from datetime import datetime, timezone
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from sqlalchemy import bindparam, insert, or_, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import add_missing_columns, ensure_indexes
+from models import MatchCandidate, PriceListUpload, SupplierItem
+from services.metrics import inc, span
+from services.normalize import NORMALIZATION_VERSION, normalize_name
+
+# Supplier items written to the DB per batch during an upload
+INGEST_BATCH_SIZE = 5000
+
+# Batches an upload writes per transaction. Bounds how long it holds the SQLite write
+# lock, so match checkpoints and edits commit in between instead of timing out
+INGEST_COMMIT_BATCHES = 2
+
+# Bytes read per call while hashing an uploaded file
+HASH_CHUNK_SIZE = 1 << 20
+
+# "delta"  - upsert rows by their natural key, only new and changed rows are written
+#            and unchanged rows keep their match results
+# "append" - insert every row as a new supplier item
+INGEST_MODES = ("delta", "append")
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """Yields lists of up to `size` items from `iterable`."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def item_key(barcode: Optional[str], article: Optional[str], name: str) -> str:
+    """
+    Natural key of a price list row within its supplier: barcode, else article, else a hash
+    of the name casefolded with whitespace collapsed. Unlike the normalized name, that form
+    doesn't change with NORMALIZATION_VERSION, so stored keys stay valid.
+    """
+    if barcode:
+        return f"b:{barcode}"
+    if article:
+        return f"a:{article}"
+    return _name_key(name)
+
+
+def natural_keys(barcode: Optional[str], article: Optional[str], name: Optional[str]) -> list:
+    """All the natural keys of a price list row, in `item_key` priority order."""
+    keys = []
+    if barcode:
+        keys.append(f"b:{barcode}")
+    if article:
+        keys.append(f"a:{article}")
+    if name:
+        keys.append(_name_key(name))
+    return keys
+
+
+def file_sha256(source: BinaryIO, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """Hashes a seekable binary file chunk by chunk and rewinds it."""
+    digest = hashlib.sha256()
+    source.seek(0)
+    while chunk := source.read(chunk_size):
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+def find_repeated_upload(db: Session, supplier_name: str, content_hash: str) -> Optional[PriceListUpload]:
+    """
+    Returns the supplier's latest upload if it had exactly this content and completed.
+    Only the latest one counts: re-sending an older file after a newer one changes the data,
+    and re-sending the file of an upload that failed midway finishes it.
+    """
+    latest = db.execute(
+        select(PriceListUpload)
+        .where(PriceListUpload.supplier_name == supplier_name)
+        .order_by(PriceListUpload.id.desc())
+        .limit(1)
+    ).scalar()
+    if latest is not None and latest.completed_at is not None and latest.content_hash == content_hash:
+        return latest
+    return None
+
+
+def ingest_supplier_items(
+    db: Session,
+    records: Iterable[dict],
+    supplier_name: str,
+    batch_size: int = INGEST_BATCH_SIZE,
+    upload_id: Optional[int] = None,
+) -> int:
+    """
+    Saves parsed price list records as supplier_items rows in fixed-size batches.
+    Each batch is one Core-level executemany INSERT (no ORM objects or unit of work),
+    so memory doesn't grow with the file size. The whole upload is still one transaction.
+    Returns the number of saved items.
+    """
+    saved = _insert_supplier_items(db, records, supplier_name, batch_size, upload_id)
+    with span("upload.commit"):
+        db.commit()
+    return saved
+
+
+def ingest_supplier_items_delta(
+    db: Session,
+    records: Iterable[dict],
+    supplier_name: str,
+    batch_size: int = INGEST_BATCH_SIZE,
+    upload_id: Optional[int] = None,
+    commit_every: Optional[int] = None,
+) -> dict:
+    """
+    Upserts parsed price list records by their natural key (see `item_key`), batch by batch:
+    - rows with a new key are inserted (unmatched)
+    - rows whose name, barcode or article changed are updated and sent back to matching
+    - rows where only the price changed are updated and keep their match
+    - unchanged rows are not written at all
+    Within one file the last row with a given key wins. Written rows are tagged with
+    `upload_id`. The upload is one transaction, or one per `commit_every` batches.
+    Returns the counts of inserted, updated and unchanged rows.
+    """
+    supplier_items = SupplierItem.__table__
+    insert_stmt = insert(supplier_items)
+    update_price_stmt = (
+        update(supplier_items)
+        .where(supplier_items.c.id == bindparam("b_id"))
+        .values(price=bindparam("b_price"), upload_id=upload_id)
+    )
+    update_item_stmt = (
+        update(supplier_items)
+        .where(supplier_items.c.id == bindparam("b_id"))
+        .values(
+            name=bindparam("b_name"),
+            name_norm=bindparam("b_name_norm"),
+            name_norm_version=NORMALIZATION_VERSION,
+            barcode=bindparam("b_barcode"),
+            article=bindparam("b_article"),
+            price=bindparam("b_price"),
+            upload_id=upload_id,
+            is_matched=False,
+            matched_master_id=None,
+            match_confidence=None,
+            match_type=None,
+            match_attempted_version=None,
+        )
+    )
+
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+    for number, batch in enumerate(batched(records, batch_size), 1):
+        stats["rows"] += len(batch)
+        keyed = {}
+        for record in batch:
+            params = _insert_params(record, supplier_name, upload_id)
+            keyed[params["item_key"]] = params
+
+        with span("upload.diff"):
+            # On duplicate keys left by older uploads the newest row is kept up to date
+            existing = {
+                row.item_key: row
+                for row in db.execute(
+                    select(
+                        SupplierItem.id, SupplierItem.item_key, SupplierItem.name,
+                        SupplierItem.barcode, SupplierItem.article, SupplierItem.price,
+                    )
+                    .where(SupplierItem.supplier_name == supplier_name, SupplierItem.item_key.in_(list(keyed)))
+                    .order_by(SupplierItem.id)
+                )
+            }
+
+        inserts, item_updates, price_updates = [], [], []
+        for key, params in keyed.items():
+            row = existing.get(key)
+            if row is None:
+                inserts.append(params)
+            elif (row.name, row.barcode, row.article) != (params["name"], params["barcode"], params["article"]):
+                item_updates.append({
+                    "b_id": row.id,
+                    "b_name": params["name"],
+                    "b_name_norm": params["name_norm"],
+                    "b_barcode": params["barcode"],
+                    "b_article": params["article"],
+                    "b_price": params["price"],
+                })
+            elif row.price != params["price"]:
+                price_updates.append({"b_id": row.id, "b_price": params["price"]})
+
+        with span("upload.insert"):
+            if inserts:
+                db.execute(insert_stmt, inserts)
+            if item_updates:
+                db.execute(update_item_stmt, item_updates)
+                # Review suggestions were scored for the old name
+                db.execute(MatchCandidate.__table__.delete().where(
+                    MatchCandidate.supplier_item_id.in_([params["b_id"] for params in item_updates])
+                ))
+            if price_updates:
+                db.execute(update_price_stmt, price_updates)
+
+        stats["inserted"] += len(inserts)
+        stats["updated"] += len(item_updates) + len(price_updates)
+        stats["unchanged"] += len(batch) - len(inserts) - len(item_updates) - len(price_updates)
+        if commit_every and number % commit_every == 0:
+            with span("upload.commit"):
+                db.commit()
+
+    for result in ("inserted", "updated", "unchanged"):
+        inc("upload_rows_total", stats[result], result=result)
+    return stats
+
+
+def ingest_price_list(
+    db: Session,
+    records: Iterable[dict],
+    supplier_name: str,
+    filename: Optional[str],
+    content_hash: str,
+    mode: str = "delta",
+) -> PriceListUpload:
+    """
+    Ingests a price list in the given mode as a new upload batch whose rows carry the batch id.
+    The rows are committed every INGEST_COMMIT_BATCHES batches, the batch counts and
+    `completed_at` with the last of them. If the upload fails midway, the rows committed so
+    far stay and the batch is left without `completed_at`.
+    """
+    if mode not in INGEST_MODES:
+        raise ValueError(f"Unknown ingestion mode: {mode}")
+
+    upload = PriceListUpload(
+        supplier_name=supplier_name,
+        filename=filename,
+        content_hash=content_hash,
+        mode=mode,
+        created_at=datetime.now(timezone.utc).replace(tzinfo=None),
+    )
+    db.add(upload)
+    db.commit()
+
+    if mode == "delta":
+        stats = ingest_supplier_items_delta(
+            db, records, supplier_name, upload_id=upload.id, commit_every=INGEST_COMMIT_BATCHES
+        )
+    else:
+        saved = _insert_supplier_items(
+            db, records, supplier_name, upload_id=upload.id, commit_every=INGEST_COMMIT_BATCHES
+        )
+        stats = {"rows": saved, "inserted": saved, "updated": 0, "unchanged": 0}
+
+    for field, value in stats.items():
+        setattr(upload, field, value)
+    upload.completed_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    with span("upload.commit"):
+        db.commit()
+    return upload
+
+
+def ensure_supplier_item_columns(engine: Engine, batch_size: int = INGEST_BATCH_SIZE) -> int:
+    """
+    Adds the natural key, upload batch and match attempt columns and their indexes (and
+    the upload completion column) to databases created before they existed, and fills `item_key` for supplier items
+    stored without one or with a legacy "n:" key (a hash of the normalized name, which
+    changed with NORMALIZATION_VERSION). Returns the number of rows updated.
+    """
+    supplier_items = SupplierItem.__table__
+    add_missing_columns(engine, supplier_items, ("item_key", "upload_id", "match_attempted_version"))
+    ensure_indexes(engine, [supplier_items])
+    add_missing_columns(engine, PriceListUpload.__table__, ("completed_at",))
+
+    update_stmt = (
+        update(supplier_items)
+        .where(supplier_items.c.id == bindparam("b_id"))
+        .values(item_key=bindparam("b_item_key"))
+    )
+    updated = 0
+    after_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(supplier_items.c.id, supplier_items.c.barcode, supplier_items.c.article, supplier_items.c.name)
+                .where(
+                    or_(supplier_items.c.item_key.is_(None), supplier_items.c.item_key.like("n:%")),
+                    supplier_items.c.id > after_id,
+                )
+                .order_by(supplier_items.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            conn.execute(update_stmt, [
+                {"b_id": row.id, "b_item_key": item_key(row.barcode, row.article, row.name)}
+                for row in rows
+            ])
+        updated += len(rows)
+        after_id = rows[-1].id
+    return updated
+
+
+def _name_key(name: str) -> str:
+    return "t:" + hashlib.sha1(" ".join(name.casefold().split()).encode("utf-8")).hexdigest()
+
+
+def _insert_supplier_items(
+    db: Session,
+    records: Iterable[dict],
+    supplier_name: str,
+    batch_size: int = INGEST_BATCH_SIZE,
+    upload_id: Optional[int] = None,
+    commit_every: Optional[int] = None,
+) -> int:
+    insert_stmt = insert(SupplierItem.__table__)
+
+    saved = 0
+    for number, batch in enumerate(batched(records, batch_size), 1):
+        with span("upload.insert"):
+            db.execute(insert_stmt, [_insert_params(record, supplier_name, upload_id) for record in batch])
+        saved += len(batch)
+        if commit_every and number % commit_every == 0:
+            with span("upload.commit"):
+                db.commit()
+    return saved
+
+
+def _insert_params(record: dict, supplier_name: str, upload_id: Optional[int] = None) -> dict:
+    name_norm = normalize_name(record['name'])
+    return {
+        "supplier_name": supplier_name,
+        "name": record['name'],
+        "name_norm": name_norm,
+        "name_norm_version": NORMALIZATION_VERSION,
+        "barcode": record['barcode'],
+        "article": record['article'],
+        "price": record['price'],
+        "item_key": item_key(record['barcode'], record['article'], record['name']),
+        "upload_id": upload_id,
+        "is_matched": False,
+    }
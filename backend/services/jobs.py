@@ -0,0 +1,215 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import MatchJob
+from services.master_index import MasterIndex
+from services.matcher import match_supplier_items
+from services.metrics import inc
+
+# Match runs executed at the same time by this process. Jobs with disjoint scopes (see
+# scopes_overlap) really run side by side: each one reads the catalog view current at its
+# start (see services.master_index.MasterIndex.current) and none holds the index lock.
+# With SQLite their checkpoint commits still take turns on the database write lock
+MATCH_JOB_THREADS = 2
+
+# A queued/running job whose heartbeat is older than this is treated as dead
+# (e.g. its worker process crashed) and no longer blocks new runs
+MATCH_JOB_STALE_AFTER = timedelta(minutes=10)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_executor = ThreadPoolExecutor(max_workers=MATCH_JOB_THREADS, thread_name_prefix="match-job")
+
+# Jobs started by this process, cancelled on shutdown
+_local_job_ids = set()
+
+
+class MatchJobConflict(Exception):
+    """Raised when another live job already covers (part of) the requested supplier items."""
+
+    def __init__(self, job_id: int):
+        super().__init__(f"Matching job {job_id} is already running for these items")
+        self.job_id = job_id
+
+
+def scopes_overlap(scope_a: str, scope_b: str) -> bool:
+    if scope_a == "all" or scope_b == "all" or scope_a == scope_b:
+        return True
+    # Two suppliers or two uploads are disjoint. An upload belongs to one supplier,
+    # without looking it up assume it may be that supplier's
+    return scope_a.partition(":")[0] != scope_b.partition(":")[0]
+
+
+def start_match_job(
+    db: Session,
+    index: Optional[MasterIndex] = None,
+    scope: str = "all",
+    rescore: bool = False,
+) -> MatchJob:
+    """
+    Registers a matching job over the supplier items of `scope` (see services.matcher)
+    and runs it in the background. `rescore` also retries items that already failed
+    against the current catalog.
+    Raises MatchJobConflict if a live job with an overlapping scope exists.
+    """
+    job = _create_job(db, scope)
+    _local_job_ids.add(job.id)
+    _executor.submit(run_match_job, job.id, index, rescore)
+    return job
+
+
+def get_match_job(db: Session, job_id: int) -> Optional[MatchJob]:
+    return db.get(MatchJob, job_id)
+
+
+def list_match_jobs(db: Session, limit: int = 20) -> list:
+    return db.query(MatchJob).order_by(MatchJob.id.desc()).limit(limit).all()
+
+
+def cancel_match_job(db: Session, job_id: int) -> Optional[MatchJob]:
+    """Asks the job to stop; a running job stops at its next checkpoint, keeping committed work."""
+    job = db.get(MatchJob, job_id)
+    if job is None:
+        return None
+    if job.status in ACTIVE_STATUSES:
+        job.cancel_requested = True
+        db.commit()
+    return job
+
+
+def cancel_local_jobs():
+    """Stops the jobs of this process at their next checkpoint (used on shutdown)."""
+    if not _local_job_ids:
+        return
+    db = SessionLocal()
+    try:
+        _update_job(db, *_local_job_ids, cancel_requested=True, only_active=True)
+    finally:
+        db.close()
+
+
+def run_match_job(job_id: int, index: Optional[MasterIndex] = None, rescore: bool = False):
+    """Executes a registered job with its own session, recording progress at every matcher checkpoint."""
+    db = SessionLocal()
+    try:
+        job = db.get(MatchJob, job_id)
+        if job.cancel_requested:
+            _finish(db, job_id, "cancelled")
+            return
+
+        # Re-check right before starting: a job that waited long in the queue may overlap a newer one
+        blocking = _find_blocking_job(db, job, statuses=("running",))
+        if blocking is not None:
+            _finish(db, job_id, "failed", error=str(MatchJobConflict(blocking.id)))
+            return
+
+        now = _now()
+        _update_job(db, job_id, status="running", started_at=now, updated_at=now)
+
+        def on_progress(stats: dict):
+            _update_job(
+                db,
+                job_id,
+                total=stats["total"],
+                processed=stats["processed"],
+                matched_by_stage=dict(stats["matched"]),
+                updated_at=_now(),
+            )
+
+        def is_cancelled() -> bool:
+            return bool(db.execute(select(MatchJob.cancel_requested).where(MatchJob.id == job_id)).scalar())
+
+        result = match_supplier_items(
+            db,
+            index=index,
+            on_progress=on_progress,
+            is_cancelled=is_cancelled,
+            scope=job.scope,
+            rescore=rescore,
+        )
+        _finish(db, job_id, "cancelled" if result.get("cancelled") else "completed")
+    except Exception as e:
+        db.rollback()
+        _finish(db, job_id, "failed", error=str(e))
+    finally:
+        _local_job_ids.discard(job_id)
+        db.close()
+
+
+def job_to_dict(job: MatchJob) -> dict:
+    return {
+        "id": job.id,
+        "scope": job.scope,
+        "status": job.status,
+        "cancel_requested": job.cancel_requested,
+        "total": job.total,
+        "processed": job.processed,
+        "matched_by_stage": job.matched_by_stage or {},
+        "eta_seconds": _eta_seconds(job),
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def _create_job(db: Session, scope: str) -> MatchJob:
+    now = _now()
+    job = MatchJob(scope=scope, status="queued", processed=0, created_at=now, updated_at=now)
+    db.add(job)
+    db.commit()
+
+    # Insert first, then look for older overlapping jobs: if two requests (or two worker
+    # processes) race, both rows are visible to both checks and the older job wins
+    blocking = _find_blocking_job(db, job)
+    if blocking is not None:
+        db.delete(job)
+        db.commit()
+        raise MatchJobConflict(blocking.id)
+    return job
+
+
+def _find_blocking_job(db: Session, job: MatchJob, statuses: tuple = ACTIVE_STATUSES) -> Optional[MatchJob]:
+    live_jobs = db.query(MatchJob).filter(
+        MatchJob.id < job.id,
+        MatchJob.status.in_(statuses),
+        MatchJob.updated_at >= _now() - MATCH_JOB_STALE_AFTER,
+    ).order_by(MatchJob.id)
+    for other in live_jobs:
+        if scopes_overlap(other.scope, job.scope):
+            return other
+    return None
+
+
+def _finish(db: Session, job_id: int, status: str, error: Optional[str] = None):
+    now = _now()
+    _update_job(db, job_id, status=status, error=error, finished_at=now, updated_at=now)
+    inc("match_jobs_total", status=status)
+
+
+def _update_job(db: Session, *job_ids: int, only_active: bool = False, **values):
+    stmt = update(MatchJob.__table__).where(MatchJob.id.in_(job_ids))
+    if only_active:
+        stmt = stmt.where(MatchJob.status.in_(ACTIVE_STATUSES))
+    db.execute(stmt.values(**values))
+    db.commit()
+
+
+def _eta_seconds(job: MatchJob) -> Optional[float]:
+    if job.status != "running" or not job.total or not job.processed or not job.started_at:
+        return None
+    elapsed = (job.updated_at - job.started_at).total_seconds()
+    rate = job.processed / elapsed if elapsed > 0 else None
+    if not rate:
+        return None
+    return round((job.total - job.processed) / rate, 1)
+
+
+def _now() -> datetime:
+    # Naive UTC, that's what the DateTime columns store
+    return datetime.now(timezone.utc).replace(tzinfo=None)
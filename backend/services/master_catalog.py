@@ -0,0 +1,106 @@
+from typing import Iterable
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import MasterItem
+from services.ingest import batched
+from services.master_index import get_catalog_version, record_master_changes
+from services.metrics import inc, span
+from services.normalize import NORMALIZATION_VERSION, normalize_name
+
+# Master items upserted per batch during a nomenclature import
+CATALOG_IMPORT_BATCH_SIZE = 5000
+
+
+def import_master_catalog(db: Session, records: Iterable[dict], batch_size: int = CATALOG_IMPORT_BATCH_SIZE) -> dict:
+    """
+    Upserts parsed 1C nomenclature records (see services.parser.iter_master_catalog) by
+    `code_1c`, batch by batch with executemany statements:
+    - new codes are inserted
+    - items whose name, barcode or article changed are updated
+    - unchanged items are not written at all
+    Items missing from the file are kept. Within one file the last row with a given code
+    wins. Changes are passed to the matcher indexes batch by batch. The import is one transaction.
+    Returns the counts of rows, inserted, updated and unchanged items.
+    """
+    master_items = MasterItem.__table__
+    insert_stmt = insert(master_items)
+    update_stmt = (
+        update(master_items)
+        .where(master_items.c.id == bindparam("b_id"))
+        .values(
+            name=bindparam("b_name"),
+            name_norm=bindparam("b_name_norm"),
+            name_norm_version=NORMALIZATION_VERSION,
+            barcode=bindparam("b_barcode"),
+            article=bindparam("b_article"),
+        )
+    )
+
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+    for batch in batched(records, batch_size):
+        stats["rows"] += len(batch)
+        keyed = {record["code_1c"]: record for record in batch}
+
+        with span("catalog.diff"):
+            existing = {
+                row.code_1c: row
+                for row in db.execute(
+                    select(MasterItem.id, MasterItem.code_1c, MasterItem.name, MasterItem.barcode, MasterItem.article)
+                    .where(MasterItem.code_1c.in_(list(keyed)))
+                )
+            }
+
+        inserts, updates, changes = [], [], []
+        for code, record in keyed.items():
+            row = existing.get(code)
+            if row is not None and (row.name, row.barcode, row.article) == (record["name"], record["barcode"], record["article"]):
+                continue
+            name_norm = normalize_name(record["name"])
+            if row is None:
+                inserts.append({
+                    "code_1c": code,
+                    "name": record["name"],
+                    "name_norm": name_norm,
+                    "name_norm_version": NORMALIZATION_VERSION,
+                    "barcode": record["barcode"],
+                    "article": record["article"],
+                })
+            else:
+                updates.append({
+                    "b_id": row.id,
+                    "b_name": record["name"],
+                    "b_name_norm": name_norm,
+                    "b_barcode": record["barcode"],
+                    "b_article": record["article"],
+                })
+                changes.append((row.id, record["barcode"], record["article"], name_norm))
+
+        with span("catalog.write"):
+            old_version = get_catalog_version(db)
+            if inserts:
+                db.execute(insert_stmt, inserts)
+                # executemany doesn't return the new ids, the matcher indexes need them
+                inserted = {row.code_1c: row.id for row in db.execute(
+                    select(MasterItem.id, MasterItem.code_1c)
+                    .where(MasterItem.code_1c.in_([params["code_1c"] for params in inserts]))
+                )}
+                changes.extend(
+                    (inserted[params["code_1c"]], params["barcode"], params["article"], params["name_norm"])
+                    for params in inserts
+                )
+            if updates:
+                db.execute(update_stmt, updates)
+            # Core writes aren't seen by the ORM flush hooks
+            record_master_changes(db, old_version, changes)
+
+        stats["inserted"] += len(inserts)
+        stats["updated"] += len(updates)
+        stats["unchanged"] += len(batch) - len(inserts) - len(updates)
+
+    with span("catalog.commit"):
+        db.commit()
+    for result in ("inserted", "updated", "unchanged"):
+        inc("catalog_rows_total", stats[result], result=result)
+    return stats
@@ -0,0 +1,403 @@
+import os
+import pickle
+import random
+import tempfile
+import threading
+import weakref
+from itertools import chain
+from typing import Iterable, List, Optional
+
+from sqlalchemy import event, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import add_missing_columns
+from models import CatalogState, MasterItem
+from services.blocking import TokenBlockingIndex
+from services.normalize import NORMALIZATION_VERSION
+
+# Local file the index is persisted to, so a restarted worker doesn't re-query master_items
+MASTER_INDEX_SNAPSHOT_PATH = "./master_index.snapshot"
+
+# Bump when the pickled layout of MasterIndex changes. Snapshots holding names
+# normalized by another NORMALIZATION_VERSION are discarded as well
+SNAPSHOT_FORMAT = (4, NORMALIZATION_VERSION)
+
+# The database bumps the catalog version itself on every write to master_items, so bulk
+# statements and other processes (e.g. tests/seed.py) can't leave an index stale unnoticed.
+# The version then grows by one per written row
+_VERSION_TRIGGERS_DDL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS catalog_version_ai AFTER INSERT ON master_items BEGIN
+        UPDATE catalog_state SET version = version + 1 WHERE id = 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS catalog_version_ad AFTER DELETE ON master_items BEGIN
+        UPDATE catalog_state SET version = version + 1 WHERE id = 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS catalog_version_au
+    AFTER UPDATE OF name, name_norm, barcode, article ON master_items BEGIN
+        UPDATE catalog_state SET version = version + 1 WHERE id = 1;
+    END
+    """,
+]
+
+# Indexes kept in sync with master_items changes committed through ORM sessions
+_attached_indexes = weakref.WeakSet()
+
+# Engines whose database bumps the catalog version by triggers, see ensure_catalog_state
+_version_trigger_engines = weakref.WeakSet()
+
+
+def ensure_catalog_state(engine: Engine) -> bool:
+    """
+    Creates the catalog_state row, gives the catalog an epoch and, on SQLite, installs the
+    triggers bumping its version on every write to master_items.
+    Returns False when the database can't have them; the version is then only bumped by
+    writes made through ORM sessions or reported with `record_master_changes`.
+    """
+    add_missing_columns(engine, CatalogState.__table__, ["epoch"])
+    with engine.begin() as conn:
+        row = conn.execute(select(CatalogState.epoch).where(CatalogState.id == 1)).first()
+        if row is None:
+            conn.execute(CatalogState.__table__.insert().values(id=1, version=0, epoch=_new_epoch()))
+        elif row.epoch is None:
+            conn.execute(update(CatalogState.__table__).where(CatalogState.id == 1).values(epoch=_new_epoch()))
+        if engine.dialect.name != "sqlite":
+            return False
+        for ddl in _VERSION_TRIGGERS_DDL:
+            conn.execute(text(ddl))
+
+    _version_trigger_engines.add(engine)
+    return True
+
+
+def get_catalog_version(db: Session) -> int:
+    version = db.execute(select(CatalogState.version).where(CatalogState.id == 1)).scalar()
+    return version or 0
+
+
+def get_catalog_stamp(db: Session) -> tuple:
+    """(epoch, version) of the catalog: identifies its content across databases."""
+    row = db.execute(select(CatalogState.epoch, CatalogState.version).where(CatalogState.id == 1)).first()
+    return (row.epoch, row.version) if row is not None else (None, 0)
+
+
+def bump_catalog_version(db: Session) -> tuple:
+    """
+    Increments the catalog version inside the current transaction.
+    Returns (old_version, new_version).
+    """
+    conn = db.connection()
+    old_version = conn.execute(select(CatalogState.version).where(CatalogState.id == 1)).scalar()
+    if old_version is None:
+        old_version = 0
+        conn.execute(CatalogState.__table__.insert().values(id=1, version=1, epoch=_new_epoch()))
+    else:
+        conn.execute(
+            update(CatalogState.__table__).where(CatalogState.id == 1).values(version=old_version + 1)
+        )
+    return old_version, old_version + 1
+
+
+def record_master_changes(db: Session, old_version: int, upserts: List[tuple] = (), deleted_ids: List[int] = ()):
+    """
+    Queues master_items changes written in the current transaction for the attached
+    indexes, which apply them once the transaction commits.
+    `old_version` is the catalog version read (see get_catalog_version) before the writes;
+    the triggers have bumped it since. Without triggers the version is bumped here.
+    `upserts` are (id, barcode, article, normalized name) tuples.
+    Code writing master_items with Core statements must call this itself;
+    ORM flushes are tracked automatically.
+    """
+    if not upserts and not deleted_ids:
+        return
+    if _has_version_triggers(db):
+        new_version = get_catalog_version(db)
+        if new_version == old_version:
+            # Nothing the index holds was written
+            return
+    else:
+        old_version, new_version = bump_catalog_version(db)
+    pending = db.info.setdefault("master_index_changes", [])
+    pending.append((old_version, new_version, list(upserts), list(deleted_ids)))
+
+
+def _has_version_triggers(db: Session) -> bool:
+    return db.get_bind() in _version_trigger_engines
+
+
+def _new_epoch() -> int:
+    return random.getrandbits(62)
+
+
+@event.listens_for(Session, "before_flush")
+def _read_version_before_flush(session, flush_context, instances):
+    if _has_version_triggers(session) and any(
+        isinstance(obj, MasterItem) for obj in chain(session.new, session.dirty, session.deleted)
+    ):
+        session.info["master_version_before_flush"] = get_catalog_version(session)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_master_changes(session, flush_context):
+    upserts = [
+        (obj.id, obj.barcode, obj.article, obj.name_norm)
+        for obj in chain(session.new, session.dirty)
+        if isinstance(obj, MasterItem) and (obj in session.new or session.is_modified(obj))
+    ]
+    deleted_ids = [obj.id for obj in session.deleted if isinstance(obj, MasterItem)]
+    old_version = session.info.pop("master_version_before_flush", None)
+    if old_version is None and _has_version_triggers(session):
+        # Can't tell which version the changes lead to; indexes notice the new version
+        # in ensure_current and rebuild
+        return
+    record_master_changes(session, old_version, upserts, deleted_ids)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_master_changes(orm_execute_state):
+    # ORM bulk UPDATE/DELETE, e.g. db.query(MasterItem).delete(), bypasses the flush hooks.
+    # Without triggers the version is bumped here; the changed rows aren't known, so
+    # indexes notice the new version in ensure_current and rebuild
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if any(mapper.class_ is MasterItem for mapper in orm_execute_state.all_mappers):
+        if not _has_version_triggers(orm_execute_state.session):
+            bump_catalog_version(orm_execute_state.session)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_master_changes(session):
+    pending = session.info.pop("master_index_changes", None)
+    if not pending:
+        return
+    for index in list(_attached_indexes):
+        index.apply_changes(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_master_changes(session):
+    session.info.pop("master_index_changes", None)
+    session.info.pop("master_version_before_flush", None)
+
+
+class CatalogView:
+    """
+    Lookup structures over one catalog version used by the matcher: exact barcode/article
+    lookups, id -> normalized name choices and the token blocking index.
+    Never changed once published by a MasterIndex: changes produce a new view (see
+    `with_changes`), so a match run reads the view it started with, without a lock, while
+    commits publish newer ones.
+    """
+
+    def __init__(self, epoch: Optional[int] = None, version: int = 0):
+        self.epoch = epoch
+        self.version = version
+        # id -> normalized name (see services.normalize), in id order (the order the nomenclature is scanned in)
+        self.names = {}
+        self.barcodes = {}
+        self.articles = {}
+        # barcode/article -> id. On duplicates the highest id wins,
+        # like the old dict comprehension over the id-ordered table
+        self.barcode_lookup = {}
+        self.article_lookup = {}
+        self.blocking = TokenBlockingIndex()
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def build(cls, db: Session) -> "CatalogView":
+        """Builds the view straight from master_items columns, without hydrating ORM objects."""
+        view = cls(*get_catalog_stamp(db))
+        rows = db.execute(
+            select(MasterItem.id, MasterItem.barcode, MasterItem.article, MasterItem.name_norm)
+            .order_by(MasterItem.id)
+        )
+        for master_id, barcode, article, name in rows:
+            view._add(master_id, barcode, article, name)
+        return view
+
+    def with_changes(self, version: int, changes: Iterable[tuple]) -> "CatalogView":
+        """
+        A copy of the view at `version` with (upserts, deleted_ids) change sets applied.
+        The dicts are copied, the blocking index shares the posting sets it doesn't change.
+        """
+        view = CatalogView(self.epoch, version)
+        view.names = dict(self.names)
+        view.barcodes = dict(self.barcodes)
+        view.articles = dict(self.articles)
+        view.barcode_lookup = dict(self.barcode_lookup)
+        view.article_lookup = dict(self.article_lookup)
+        view.blocking = self.blocking.copy()
+        for upserts, deleted_ids in changes:
+            for master_id in deleted_ids:
+                view._remove(master_id)
+            for master_id, barcode, article, name in upserts:
+                view._remove(master_id)
+                view._add(master_id, barcode, article, name)
+        return view
+
+    def _add(self, master_id: int, barcode: Optional[str], article: Optional[str], name: str):
+        self.names[master_id] = name
+        self.blocking.add(master_id, name)
+        if barcode:
+            self.barcodes[master_id] = barcode
+            if self.barcode_lookup.get(barcode, -1) < master_id:
+                self.barcode_lookup[barcode] = master_id
+        if article:
+            self.articles[master_id] = article
+            if self.article_lookup.get(article, -1) < master_id:
+                self.article_lookup[article] = master_id
+
+    def _remove(self, master_id: int):
+        name = self.names.pop(master_id, None)
+        if name is None:
+            return
+        self.blocking.remove(master_id, name)
+        barcode = self.barcodes.pop(master_id, None)
+        if barcode:
+            _drop_lookup(self.barcode_lookup, self.barcodes, barcode, master_id)
+        article = self.articles.pop(master_id, None)
+        if article:
+            _drop_lookup(self.article_lookup, self.articles, article, master_id)
+
+
+class MasterIndex:
+    """
+    The matcher's long-lived CatalogView of the nomenclature: built once, then kept up to
+    date incrementally by publishing a new view per committed change, tagged with the
+    catalog version it reflects. Readers take `current()` and keep it for a whole run.
+    """
+
+    def __init__(self, view: Optional[CatalogView] = None):
+        self._view = view or CatalogView()
+        # Held while a new view is published (and saved), never while matching
+        self.lock = threading.RLock()
+        # Held while the view is rebuilt, so concurrent runs don't rebuild it twice
+        self._refresh_lock = threading.Lock()
+        self.stale = False
+        self._snapshot_dirty = False
+
+    def __getstate__(self):
+        return {"view": self._view}
+
+    def __setstate__(self, state):
+        self.__init__(state["view"])
+
+    def __len__(self):
+        return len(self._view)
+
+    @property
+    def epoch(self) -> Optional[int]:
+        return self._view.epoch
+
+    @property
+    def version(self) -> int:
+        return self._view.version
+
+    def current(self) -> CatalogView:
+        """The latest published view; it stays valid (and unchanged) for as long as it is used."""
+        return self._view
+
+    @classmethod
+    def build(cls, db: Session) -> "MasterIndex":
+        return cls(CatalogView.build(db))
+
+    @classmethod
+    def load_or_build(cls, db: Session, path: str = MASTER_INDEX_SNAPSHOT_PATH) -> "MasterIndex":
+        """Loads the snapshot file if it matches the current catalog, otherwise rebuilds and saves it."""
+        index = cls.load(path)
+        if index is not None and (index.epoch, index.version) == get_catalog_stamp(db):
+            return index
+
+        index = cls.build(db)
+        index.save(path)
+        return index
+
+    @classmethod
+    def load(cls, path: str = MASTER_INDEX_SNAPSHOT_PATH) -> Optional["MasterIndex"]:
+        try:
+            with open(path, "rb") as f:
+                snapshot_format, index = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+            return None
+        return index if snapshot_format == SNAPSHOT_FORMAT else None
+
+    def save(self, path: str = MASTER_INDEX_SNAPSHOT_PATH):
+        """Writes the snapshot to a temp file and renames it over `path`, so readers never see a partial file."""
+        with self.lock:
+            directory = os.path.dirname(os.path.abspath(path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".master_index.")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump((SNAPSHOT_FORMAT, self), f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self._snapshot_dirty = False
+
+    def attach(self) -> "MasterIndex":
+        """Subscribes the index to master_items changes committed by ORM sessions of this process."""
+        _attached_indexes.add(self)
+        return self
+
+    def detach(self):
+        _attached_indexes.discard(self)
+
+    def close(self, path: str = MASTER_INDEX_SNAPSHOT_PATH):
+        """Stops tracking changes and saves the snapshot for the next start."""
+        self.detach()
+        self.save(path)
+
+    def ensure_current(self, db: Session, path: Optional[str] = MASTER_INDEX_SNAPSHOT_PATH):
+        """
+        Makes sure the index reflects the current catalog version, e.g. after another
+        worker process changed master items. Costs a single-row SELECT when nothing changed.
+        Commits keep publishing their changes while a rebuild runs.
+        """
+        with self._refresh_lock:
+            if self.stale or self.version != get_catalog_version(db):
+                view = CatalogView.build(db)
+                with self.lock:
+                    self._view = view
+                    self.stale = False
+                    self._snapshot_dirty = True
+
+            if self._snapshot_dirty and path:
+                self.save(path)
+
+    def apply_changes(self, pending: Iterable[tuple]):
+        """
+        Publishes a view with committed (old_version, new_version, upserts, deleted_ids)
+        change sets applied in order. Running matches keep the view they started with.
+        """
+        with self.lock:
+            version = self.version
+            changes = []
+            for old_version, new_version, upserts, deleted_ids in pending:
+                if self.stale or version != old_version:
+                    # Missed a change made elsewhere; ensure_current will rebuild
+                    self.stale = True
+                    return
+                changes.append((upserts, deleted_ids))
+                version = new_version
+            self._view = self._view.with_changes(version, changes)
+            self._snapshot_dirty = True
+
+
+def _drop_lookup(lookup: dict, values: dict, key: str, master_id: int):
+    # Fall back to the next item sharing the same code, if any (rare, so a scan is fine)
+    if lookup.get(key) != master_id:
+        return
+    others = [other_id for other_id, value in values.items() if value == key]
+    if others:
+        lookup[key] = max(others)
+    else:
+        del lookup[key]
+
@@ -0,0 +1,209 @@
+import hashlib
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, bindparam, delete, insert, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models import MatchMemory, SupplierItem
+from services.ingest import batched, item_key, natural_keys
+from services.normalize import normalize_name
+
+# Keys of one supplier looked up per query when recalling a checkpoint's items
+MEMORY_LOOKUP_BATCH_SIZE = 500
+
+
+def remember_match(
+    db: Session,
+    supplier_name: str,
+    barcode: Optional[str],
+    article: Optional[str],
+    name: Optional[str],
+    master_id: int,
+    source: str = "manual",
+):
+    """
+    Stores a decision for every natural key of the supplier item (barcode, article,
+    name), replacing earlier decisions for those keys. Not committed here.
+    """
+    keys = natural_keys(barcode, article, name)
+    if not keys:
+        return
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    existing = {
+        entry.key: entry
+        for entry in db.query(MatchMemory).filter(
+            MatchMemory.supplier_name == supplier_name, MatchMemory.key.in_(keys)
+        )
+    }
+    for key in keys:
+        entry = existing.get(key)
+        if entry is None:
+            db.add(MatchMemory(supplier_name=supplier_name, key=key, master_item_id=master_id, source=source, updated_at=now))
+        else:
+            entry.master_item_id = master_id
+            entry.source = source
+            entry.updated_at = now
+
+
+def remember_matches(db: Session, decisions: Iterable[tuple], source: str = "manual"):
+    """
+    Bulk `remember_match` for (supplier item, master id) pairs, where items need
+    supplier_name, barcode, article and name: one lookup query per supplier and key
+    batch, then executemany writes. Later pairs win on shared keys. Not committed here.
+    """
+    wanted = {}
+    for item, master_id in decisions:
+        for key in natural_keys(item.barcode, item.article, item.name):
+            wanted[(item.supplier_name, key)] = master_id
+    if not wanted:
+        return
+
+    keys_by_supplier = defaultdict(list)
+    for supplier_name, key in wanted:
+        keys_by_supplier[supplier_name].append(key)
+    existing = {}
+    for supplier_name, keys in keys_by_supplier.items():
+        for batch in batched(keys, MEMORY_LOOKUP_BATCH_SIZE):
+            for entry_id, key in db.execute(
+                select(MatchMemory.id, MatchMemory.key)
+                .where(MatchMemory.supplier_name == supplier_name, MatchMemory.key.in_(batch))
+            ):
+                existing[(supplier_name, key)] = entry_id
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    inserts, updates = [], []
+    for (supplier_name, key), master_id in wanted.items():
+        entry_id = existing.get((supplier_name, key))
+        if entry_id is None:
+            inserts.append({
+                "supplier_name": supplier_name, "key": key, "master_item_id": master_id,
+                "source": source, "updated_at": now,
+            })
+        else:
+            updates.append({"b_id": entry_id, "b_master_id": master_id})
+
+    if inserts:
+        db.execute(insert(MatchMemory.__table__), inserts)
+    if updates:
+        memory = MatchMemory.__table__
+        db.execute(
+            update(memory)
+            .where(memory.c.id == bindparam("b_id"))
+            .values(master_item_id=bindparam("b_master_id"), source=source, updated_at=now),
+            updates,
+        )
+
+
+def forget_matches(db: Session, decisions: Iterable[tuple]):
+    """
+    Drops the remembered decisions pointing the natural keys of the given supplier items
+    at the given master ids, for (supplier item, master id) pairs. Not committed here.
+    """
+    params = [
+        {"b_supplier": item.supplier_name, "b_key": key, "b_master_id": master_id}
+        for item, master_id in decisions
+        for key in natural_keys(item.barcode, item.article, item.name)
+    ]
+    if params:
+        memory = MatchMemory.__table__
+        db.execute(
+            delete(memory).where(and_(
+                memory.c.supplier_name == bindparam("b_supplier"),
+                memory.c.key == bindparam("b_key"),
+                memory.c.master_item_id == bindparam("b_master_id"),
+            )),
+            params,
+        )
+
+
+def recall_matches(db: Session, items: Iterable, known_master_ids=None) -> dict:
+    """
+    Returns {supplier item id: master id} for the items whose supplier already had a
+    decision for one of their natural keys; the highest priority key wins.
+    `items` need id, supplier_name, barcode, article and name. Decisions pointing at
+    master ids missing from `known_master_ids` (e.g. deleted items) are ignored.
+    """
+    item_keys = {
+        item.id: [(item.supplier_name, key) for key in natural_keys(item.barcode, item.article, item.name)]
+        for item in items
+        if item.supplier_name
+    }
+    keys_by_supplier = defaultdict(set)
+    for keys in item_keys.values():
+        for supplier_name, key in keys:
+            keys_by_supplier[supplier_name].add(key)
+
+    memory = {}
+    for supplier_name, keys in keys_by_supplier.items():
+        for batch in batched(keys, MEMORY_LOOKUP_BATCH_SIZE):
+            rows = db.execute(
+                select(MatchMemory.key, MatchMemory.master_item_id)
+                .where(MatchMemory.supplier_name == supplier_name, MatchMemory.key.in_(batch))
+            )
+            for key, master_id in rows:
+                if known_master_ids is None or master_id in known_master_ids:
+                    memory[(supplier_name, key)] = master_id
+
+    recalled = {}
+    for item_id, keys in item_keys.items():
+        for pair in keys:
+            if pair in memory:
+                recalled[item_id] = memory[pair]
+                break
+    return recalled
+
+
+def ensure_memory_name_keys(engine: Engine) -> int:
+    """
+    Moves decisions remembered under legacy "n:" keys (hashes of the normalized name, which
+    changed with NORMALIZATION_VERSION) to the current name keys (see services.ingest.item_key),
+    through the supplier items of the same supplier they were made for. Legacy keys no item
+    maps to any more could never be recalled and are dropped, as are those whose current key
+    already has a decision. Returns the number of decisions moved.
+    """
+    memory = MatchMemory.__table__
+    with engine.begin() as conn:
+        legacy = conn.execute(
+            select(memory.c.id, memory.c.supplier_name, memory.c.key).where(memory.c.key.like("n:%"))
+        ).all()
+        if not legacy:
+            return 0
+
+        by_supplier = defaultdict(list)
+        for entry in legacy:
+            by_supplier[entry.supplier_name].append(entry)
+
+        moves, drops = [], []
+        for supplier_name, entries in by_supplier.items():
+            current_keys = {}
+            for name, name_norm in conn.execute(
+                select(SupplierItem.name, SupplierItem.name_norm).where(SupplierItem.supplier_name == supplier_name)
+            ):
+                # The stored form, or the current one if the names were renormalized since
+                for legacy_form in (name_norm, normalize_name(name)):
+                    if legacy_form:
+                        current_keys.setdefault(_legacy_name_key(legacy_form), item_key(None, None, name))
+            taken = set(conn.execute(
+                select(memory.c.key).where(memory.c.supplier_name == supplier_name, memory.c.key.not_like("n:%"))
+            ).scalars())
+            for entry in entries:
+                key = current_keys.get(entry.key)
+                if key is None or key in taken:
+                    drops.append({"b_id": entry.id})
+                else:
+                    taken.add(key)
+                    moves.append({"b_id": entry.id, "b_key": key})
+
+        if moves:
+            conn.execute(update(memory).where(memory.c.id == bindparam("b_id")).values(key=bindparam("b_key")), moves)
+        if drops:
+            conn.execute(delete(memory).where(memory.c.id == bindparam("b_id")), drops)
+    return len(moves)
+
+
+def _legacy_name_key(name_norm: str) -> str:
+    return "n:" + hashlib.sha1(name_norm.encode("utf-8")).hexdigest()
@@ -1,81 +1,384 @@
+from collections import Counter
+from typing import Callable
+
+from sqlalchemy import bindparam, or_, select, update
 from sqlalchemy.orm import Session
-from thefuzz import fuzz, process
-from models import MasterItem, SupplierItem
+from rapidfuzz import fuzz, process
+from models import MatchCandidate, SupplierItem
+from services.ingest import batched
+from services.match_memory import recall_matches
+from services.master_index import CatalogView, MasterIndex, get_catalog_version
+from services.metrics import inc, span
+from services.scoring import DEFAULT_WORKERS, BatchScorer
+from services.tfidf import TfidfScorer, cached_tfidf_index
 
 # Configurable threshold for fuzzy matching
 FUZZY_MATCH_THRESHOLD = 80
 
-def match_supplier_items(db: Session):
+# How many master items (sharing the most tokens with the supplier name) are scored
+# per supplier item. None disables blocking and scores against the whole nomenclature.
+FUZZY_CANDIDATE_LIMIT = 200
+
+# Fuzzy matching engine:
+# "blocking" - one item at a time against its blocked candidates (see FUZZY_CANDIDATE_LIMIT)
+# "batch"    - chunks of items against the whole nomenclature with a `cdist` score matrix,
+#              spread over MATCH_WORKERS processes
+# "tfidf"    - chunks of items against character n-gram TF-IDF vectors of the nomenclature:
+#              cosine neighbours from one sparse matrix product, the best TFIDF_SHORTLIST
+#              re-scored with Token Set Ratio (see TFIDF_RESCORE)
+FUZZY_ENGINE = "blocking"
+FUZZY_ENGINES = ("blocking", "batch", "tfidf")
+
+# Worker processes for the "batch" engine
+MATCH_WORKERS = DEFAULT_WORKERS
+
+# Cosine neighbours per supplier item kept by the "tfidf" engine
+TFIDF_SHORTLIST = 20
+
+# Re-score the "tfidf" shortlist with Token Set Ratio, so confidences (and
+# FUZZY_MATCH_THRESHOLD) mean the same as with the other engines. Off: cosine x 100
+TFIDF_RESCORE = True
+
+# Match results written per UPDATE executemany; each batch is committed separately
+MATCH_UPDATE_BATCH_SIZE = 5000
+
+# Supplier items matched between two checkpoints. After each checkpoint the results
+# are committed and progress is reported, so a crash or cancel keeps the work done so far
+MATCH_CHECKPOINT_SIZE = 5000
+
+MATCH_STAGES = ("memory", "barcode", "article", "fuzzy")
+
+# Best fuzzy candidates stored per unmatched or low-confidence item for the manual
+# review queue (see match_candidates), taken from the scores the run computes anyway.
+# 0 keeps only the best hit and stores no candidates
+REVIEW_CANDIDATES = 5
+
+# Weakest fuzzy score still worth suggesting to a reviewer
+REVIEW_MIN_SCORE = 50
+
+# Fuzzy matches below this confidence stay in the review queue
+REVIEW_CONFIDENCE_THRESHOLD = 90
+
+# Which unmatched supplier items a run covers:
+# "all", "supplier:<supplier name>" or "upload:<price list upload id>"
+MATCH_SCOPE_ALL = "all"
+
+
+def match_scope(supplier_name: str | None = None, upload_id: int | None = None) -> str:
+    if upload_id is not None:
+        return f"upload:{upload_id}"
+    if supplier_name:
+        return f"supplier:{supplier_name}"
+    return MATCH_SCOPE_ALL
+
+
+def scope_condition(scope: str):
+    """SQL condition selecting the supplier items of a scope, None for "all"."""
+    if scope == MATCH_SCOPE_ALL:
+        return None
+    kind, _, value = scope.partition(":")
+    if kind == "supplier" and value:
+        return SupplierItem.supplier_name == value
+    if kind == "upload" and value.isdigit():
+        return SupplierItem.upload_id == int(value)
+    raise ValueError(f"Unknown matching scope: {scope}")
+
+
+def match_supplier_items(
+    db: Session,
+    index: MasterIndex | None = None,
+    candidate_limit: int | None = FUZZY_CANDIDATE_LIMIT,
+    engine: str = FUZZY_ENGINE,
+    workers: int = MATCH_WORKERS,
+    on_progress: Callable[[dict], None] | None = None,
+    is_cancelled: Callable[[], bool] | None = None,
+    scope: str = MATCH_SCOPE_ALL,
+    rescore: bool = False,
+):
     """
-    Attempts to match all currently unmatched SupplierItems against MasterItems.
+    Attempts to match the currently unmatched SupplierItems of `scope` against MasterItems.
+    Items a previous run already failed to match against the current catalog version are
+    skipped unless `rescore` is set, so the cost of a run follows the new data.
     Priority:
+    0. Match Memory (earlier manual decisions for the same supplier item)
     1. Exact Barcode Match
     2. Exact Article Match
     3. Fuzzy Name Match
+    `index` is the long-lived MasterIndex held by the app; without it one is built for this run.
+    The run reads the index view current at its start, so it holds no lock: catalog commits
+    and other runs go on meanwhile.
+    Items are processed in checkpoints of MATCH_CHECKPOINT_SIZE: after each one the results
+    are committed, `on_progress` gets the run stats and `is_cancelled` may stop the run.
     """
-    unmatched_items = db.query(SupplierItem).filter(SupplierItem.is_matched == False).all()
+    if engine not in FUZZY_ENGINES:
+        raise ValueError(f"Unknown fuzzy matching engine: {engine}")
+
+    # Plain rows instead of ORM objects: results are written back with bulk UPDATEs
+    query = (
+        select(
+            SupplierItem.id, SupplierItem.supplier_name, SupplierItem.barcode,
+            SupplierItem.article, SupplierItem.name, SupplierItem.name_norm,
+        )
+        .where(SupplierItem.is_matched == False)
+        .order_by(SupplierItem.id)
+    )
+    condition = scope_condition(scope)
+    if condition is not None:
+        query = query.where(condition)
+    if not rescore:
+        catalog_version = get_catalog_version(db)
+        query = query.where(or_(
+            SupplierItem.match_attempted_version.is_(None),
+            SupplierItem.match_attempted_version != catalog_version,
+        ))
+    unmatched_items = db.execute(query).all()
     if not unmatched_items:
         return {"matched": 0, "remaining": 0}
 
-    # Pre-load master items into memory for faster searching
-    # In a very large DB, we'd need a different strategy (chunking or DB-level full-text search)
-    # But for a standard nomenclature size (e.g., < 100k items), this is fine.
-    master_items = db.query(MasterItem).all()
-    
-    # Create lookup dicts for O(1) exact matches
-    barcode_lookup = {item.barcode: item for item in master_items if item.barcode}
-    article_lookup = {item.article: item for item in master_items if item.article}
-    
-    # List of tuples for fuzzy search: (name, MasterItem)
-    # thefuzz `process.extractOne` needs a dict or list of choices
-    name_choices = {item.id: item.name for item in master_items}
-    
-    matched_count = 0
-    
-    for s_item in unmatched_items:
-        # 1. Barcode Match
-        if s_item.barcode and s_item.barcode in barcode_lookup:
-            m_item = barcode_lookup[s_item.barcode]
-            s_item.is_matched = True
-            s_item.matched_master_id = m_item.id
-            s_item.match_confidence = 100.0
-            s_item.match_type = "barcode"
-            matched_count += 1
-            continue
+    with span("match.index"):
+        if index is None:
+            view = CatalogView.build(db)
+        else:
+            index.ensure_current(db)
+            view = index.current()
+
+    stats = {
+        "total": len(unmatched_items),
+        "processed": 0,
+        "matched": {stage: 0 for stage in MATCH_STAGES},
+    }
+    cancelled = False
+    if on_progress:
+        on_progress(stats)
+
+    scorer = None
+    if engine == "batch":
+        scorer = BatchScorer(view.names.keys(), view.names.values(), _fuzzy_score_cutoff(), workers)
+    elif engine == "tfidf":
+        # The master matrix is built once per catalog version and reused across runs
+        with span("match.tfidf_index"):
+            tfidf = cached_tfidf_index(view)
+        scorer = TfidfScorer(tfidf, _fuzzy_score_cutoff(), TFIDF_RESCORE, TFIDF_SHORTLIST)
+    try:
+        for chunk in batched(unmatched_items, MATCH_CHECKPOINT_SIZE):
+            if is_cancelled and is_cancelled():
+                cancelled = True
+                break
+
+            with span("match.memory"):
+                remembered = recall_matches(db, chunk, known_master_ids=view.names)
+            matches, candidates = _match_chunk(chunk, view, candidate_limit, scorer, remembered)
+            # Checkpoint: everything matched so far is committed
+            with span("match.apply"):
+                apply_matches(db, matches)
+                matched_ids = {item_id for item_id, _, _, _ in matches}
+                mark_attempted(db, [s_item.id for s_item in chunk if s_item.id not in matched_ids], view.version)
+                store_candidates(db, [s_item.id for s_item in chunk], candidates)
+                db.commit()
+
+            stats["processed"] += len(chunk)
+            chunk_matched = Counter(match_type for _, _, _, match_type in matches)
+            for stage, count in chunk_matched.items():
+                stats["matched"][stage] += count
+                inc("match_items_total", count, stage=stage)
+            if on_progress:
+                on_progress(stats)
+    finally:
+        if scorer is not None:
+            scorer.close()
+
+    matched_count = sum(stats["matched"].values())
+    remaining = len(unmatched_items) - matched_count
+    result = {
+        "matched": matched_count,
+        "remaining": remaining,
+        "by_stage": stats["matched"],
+    }
+    if cancelled:
+        result["cancelled"] = True
+    return result
+
+
+def _match_chunk(
+    unmatched_items: list,
+    view: CatalogView,
+    candidate_limit,
+    scorer: BatchScorer | TfidfScorer | None,
+    remembered: dict | None = None,
+) -> tuple[list, list]:
+    """
+    Returns (supplier item id, master id, confidence, match type) for every item matched,
+    and (supplier item id, master id, score, stage, rank) review candidates for the items
+    left unmatched or matched below REVIEW_CONFIDENCE_THRESHOLD.
+    `remembered` maps supplier item ids to the master ids recalled from match memory.
+    """
+    # O(1) lookups for exact matches and id -> name choices for the fuzzy search
+    barcode_lookup = view.barcode_lookup
+    article_lookup = view.article_lookup
+    name_choices = view.names
+
+    matches = []
 
-        # 2. Article Match
-        if s_item.article and s_item.article in article_lookup:
-            m_item = article_lookup[s_item.article]
-            s_item.is_matched = True
-            s_item.matched_master_id = m_item.id
-            s_item.match_confidence = 100.0
-            s_item.match_type = "article"
-            matched_count += 1
+    # 0. Match Memory: a decision already made for this supplier item, no scoring at all
+    barcode_pending = unmatched_items
+    if remembered:
+        barcode_pending = []
+        for s_item in unmatched_items:
+            if s_item.id in remembered:
+                matches.append((s_item.id, remembered[s_item.id], 100.0, "memory"))
+            else:
+                barcode_pending.append(s_item)
+
+    # 1. Barcode Match
+    with span("match.barcode"):
+        article_pending = []
+        for s_item in barcode_pending:
+            if s_item.barcode and s_item.barcode in barcode_lookup:
+                matches.append((s_item.id, barcode_lookup[s_item.barcode], 100.0, "barcode"))
+            else:
+                article_pending.append(s_item)
+
+    # 2. Article Match
+    with span("match.article"):
+        fuzzy_pending = []
+        for s_item in article_pending:
+            if s_item.article and s_item.article in article_lookup:
+                matches.append((s_item.id, article_lookup[s_item.article], 100.0, "article"))
+            elif s_item.name_norm and name_choices:
+                fuzzy_pending.append(s_item)
+
+    # 3. Fuzzy Name Match using Token Set Ratio (good for "Brand X Product Y" vs "Product Y Brand X")
+    # on the normalized names stored with the items, so no string is re-processed here
+    with span("match.fuzzy"):
+        inc("match_fuzzy_items_total", len(fuzzy_pending))
+        top_k = max(REVIEW_CANDIDATES, 1)
+        if scorer is not None:
+            top_matches = scorer.top_matches([s_item.name_norm for s_item in fuzzy_pending], top_k)
+            inc("match_fuzzy_candidates_total", len(fuzzy_pending) * scorer.candidates_per_item)
+        else:
+            top_matches = _blocked_top_matches(fuzzy_pending, view, candidate_limit, top_k)
+
+    candidates = []
+    for s_item, hits in zip(fuzzy_pending, top_matches):
+        confidence = None
+        if hits and hits[0][1] >= FUZZY_MATCH_THRESHOLD:
+            master_id, score = hits[0]
+            # thefuzz rounds the final score to an int after applying the cutoff
+            confidence = float(round(score))
+            matches.append((s_item.id, master_id, confidence, "fuzzy"))
+
+        if REVIEW_CANDIDATES and (confidence is None or confidence < REVIEW_CONFIDENCE_THRESHOLD):
+            candidates.extend(
+                (s_item.id, master_id, float(round(score)), "fuzzy", rank)
+                for rank, (master_id, score) in enumerate(hits)
+                if score >= REVIEW_MIN_SCORE
+            )
+
+    return matches, candidates
+
+
+def apply_matches(db: Session, matches: list, batch_size: int = MATCH_UPDATE_BATCH_SIZE):
+    """
+    Writes (supplier item id, master id, confidence, match type) results with
+    executemany UPDATEs keyed by id, committing after every batch so a long run
+    never holds one huge write transaction.
+    """
+    supplier_items = SupplierItem.__table__
+    update_stmt = (
+        update(supplier_items)
+        .where(supplier_items.c.id == bindparam("b_id"))
+        .values(
+            is_matched=True,
+            matched_master_id=bindparam("b_master_id"),
+            match_confidence=bindparam("b_confidence"),
+            match_type=bindparam("b_match_type"),
+        )
+    )
+
+    for batch in batched(matches, batch_size):
+        db.execute(update_stmt, [
+            {"b_id": item_id, "b_master_id": master_id, "b_confidence": confidence, "b_match_type": match_type}
+            for item_id, master_id, confidence, match_type in batch
+        ])
+        db.commit()
+
+
+def mark_attempted(db: Session, item_ids: list, catalog_version: int, batch_size: int = MATCH_UPDATE_BATCH_SIZE):
+    """Records that the items could not be matched against this catalog version."""
+    supplier_items = SupplierItem.__table__
+    for batch in batched(item_ids, batch_size):
+        db.execute(
+            update(supplier_items)
+            .where(supplier_items.c.id.in_(batch))
+            .values(match_attempted_version=catalog_version)
+        )
+        db.commit()
+
+
+def store_candidates(db: Session, item_ids: list, candidates: list, batch_size: int = MATCH_UPDATE_BATCH_SIZE):
+    """
+    Replaces the review candidates of the given supplier items with
+    (supplier item id, master id, score, stage, rank) rows. Not committed here.
+    """
+    match_candidates = MatchCandidate.__table__
+    for batch in batched(item_ids, batch_size):
+        db.execute(match_candidates.delete().where(match_candidates.c.supplier_item_id.in_(batch)))
+    for batch in batched(candidates, batch_size):
+        db.execute(match_candidates.insert(), [
+            {"supplier_item_id": item_id, "master_item_id": master_id, "score": score, "stage": stage, "rank": rank}
+            for item_id, master_id, score, stage, rank in batch
+        ])
+
+
+def _fuzzy_score_cutoff() -> float:
+    # Scores below the match threshold are still needed for review candidates
+    return min(FUZZY_MATCH_THRESHOLD, REVIEW_MIN_SCORE) if REVIEW_CANDIDATES else FUZZY_MATCH_THRESHOLD
+
+
+def _blocked_top_matches(s_items: list, view: CatalogView, candidate_limit: int | None, top_k: int = 1) -> list:
+    """
+    Scores supplier items one by one, each against the master items picked by the token
+    blocking index. Returns up to `top_k` (master_id, score) hits per item, best first.
+    Names are already normalized, so no processor runs. Scores are not rounded.
+    """
+    score_cutoff = _fuzzy_score_cutoff()
+    name_choices = view.names
+
+    results = []
+    scored = 0
+    for s_item in s_items:
+        if candidate_limit is not None:
+            # Only score master items sharing tokens with the supplier name
+            candidate_ids = view.blocking.candidates(s_item.name_norm, candidate_limit)
+            choices = {master_id: name_choices[master_id] for master_id in candidate_ids}
+        else:
+            choices = name_choices
+
+        if not choices:
+            results.append([])
             continue
-            
-        # 3. Fuzzy Name Match using Token Set Ratio (good for "Brand X Product Y" vs "Product Y Brand X")
-        if s_item.name and name_choices:
+        scored += len(choices)
+
+        if top_k == 1:
             # extractOne returns a tuple: (match_string, score, choice_key[id])
             best_match = process.extractOne(
-                s_item.name, 
-                name_choices, 
+                s_item.name_norm,
+                choices,
                 scorer=fuzz.token_set_ratio,
-                score_cutoff=FUZZY_MATCH_THRESHOLD
+                processor=None,
+                score_cutoff=score_cutoff
             )
-            
-            if best_match:
-                match_string, score, master_id = best_match
-                s_item.is_matched = True
-                s_item.matched_master_id = master_id
-                s_item.match_confidence = float(score)
-                s_item.match_type = "fuzzy"
-                matched_count += 1
-                
-    # Commit changes to database
-    db.commit()
-    
-    remaining = len(unmatched_items) - matched_count
-    return {
-        "matched": matched_count,
-        "remaining": remaining
-    }
+            hits = [best_match] if best_match else []
+        else:
+            hits = process.extract(
+                s_item.name_norm,
+                choices,
+                scorer=fuzz.token_set_ratio,
+                processor=None,
+                score_cutoff=score_cutoff,
+                limit=top_k,
+            )
+        results.append([(hit[2], hit[1]) for hit in hits])
+
+    inc("match_fuzzy_candidates_total", scored)
+    return results
@@ -0,0 +1,241 @@
+import json
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Iterable, Iterator, Optional
+
+# Master switch. When off, spans and counters are no-ops costing a flag check
+METRICS_ENABLED = True
+
+# Log one JSON line per API request with its duration and the time spent in each stage
+# (logger "nomenklatura.requests", INFO level)
+METRICS_REQUEST_LOG = False
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+METRIC_PREFIX = "nomenklatura_"
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+METRIC_HELP = {
+    "stage_duration_seconds": "Time spent in a stage of upload, matching or export",
+    "http_request_duration_seconds": "API request duration by route (without streamed response bodies)",
+    "upload_records_total": "Price list records parsed by uploads",
+    "upload_rows_total": "Delta upload rows by result (inserted, updated, unchanged)",
+    "upload_repeated_total": "Uploads skipped as an exact re-upload of the supplier's latest file",
+    "upload_rejected_total": "Uploads rejected because every upload slot stayed busy",
+    "catalog_records_total": "1C nomenclature records parsed by catalog imports",
+    "catalog_rows_total": "Catalog import rows by result (inserted, updated, unchanged)",
+    "match_items_total": "Supplier items matched, by stage",
+    "match_fuzzy_items_total": "Supplier items sent to the fuzzy stage",
+    "match_fuzzy_candidates_total": "Master items scored by the fuzzy stage (candidates per item, summed)",
+    "match_jobs_total": "Finished matching jobs, by final status",
+    "review_decisions_total": "Review decisions applied by the batch review endpoint, by action",
+    "export_rows_total": "Rows written by 1C exports, by format",
+}
+
+logger = logging.getLogger("nomenklatura.requests")
+
+# Stage -> seconds of the API request being handled, while request logging is on
+_request_stages: ContextVar[Optional[dict]] = ContextVar("request_stages", default=None)
+
+
+class MetricsRegistry:
+    """Thread-safe in-process counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets: tuple = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # (name, labels) -> value
+        self._counters = {}
+        # (name, labels) -> [count per bucket..., sum, count]
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(series)) for key, series in self._histograms.items())
+
+        lines = []
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.extend(_metric_header(name, "counter"))
+                last_name = name
+            lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), series in histograms:
+            if name != last_name:
+                lines.extend(_metric_header(name, "histogram"))
+                last_name = name
+            metric = METRIC_PREFIX + name
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{metric}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {count}")
+            lines.append(f"{metric}_bucket{_format_labels(labels + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {_format_value(series[-2])}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {series[-1]}")
+
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+REGISTRY = MetricsRegistry()
+
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record_stage(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def span(stage: str):
+    """Context manager timing a stage, e.g. `with span("match.fuzzy"): ...`."""
+    return _Span(stage) if METRICS_ENABLED else _NULL_SPAN
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Adds `value` to a counter."""
+    if METRICS_ENABLED and value:
+        REGISTRY.inc(name, value, **labels)
+
+
+def record_stage(stage: str, seconds: float):
+    REGISTRY.observe("stage_duration_seconds", seconds, stage=stage)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def timed_iter(iterable: Iterable, stage: str, counter: Optional[str] = None, **labels) -> Iterable:
+    """
+    Times the work done producing the items of a (lazy) iterable, excluding what the
+    consumer does in between, and records it as one `stage` observation once the
+    iteration ends. With `counter` the number of items is added to that counter.
+    """
+    if not METRICS_ENABLED:
+        return iterable
+    return _timed_iter(iterable, stage, counter, labels)
+
+
+def _timed_iter(iterable: Iterable, stage: str, counter: Optional[str], labels: dict) -> Iterator:
+    iterator = iter(iterable)
+    elapsed = 0.0
+    items = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                return
+            elapsed += time.perf_counter() - start
+            items += 1
+            yield item
+    finally:
+        record_stage(stage, elapsed)
+        if counter:
+            inc(counter, items, **labels)
+
+
+class RequestTimings:
+    """
+    Collects the stages run while handling one API request, records the request duration
+    per route and, with METRICS_REQUEST_LOG, logs them as one JSON line.
+    Stages running outside the request (background jobs, streamed bodies) are not included.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.route = None
+        self.status = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self._token = _request_stages.set(self.stages) if METRICS_REQUEST_LOG else None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        if self._token is not None:
+            _request_stages.reset(self._token)
+
+        status = self.status if exc_type is None else 500
+        REGISTRY.observe(
+            "http_request_duration_seconds", duration,
+            method=self.method, route=self.route or "unmatched", status=str(status),
+        )
+        if METRICS_REQUEST_LOG:
+            logger.info(json.dumps({
+                "method": self.method,
+                "path": self.path,
+                "status": status,
+                "duration_ms": round(duration * 1000, 2),
+                "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in self.stages.items()},
+            }, ensure_ascii=False))
+        return False
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+def _metric_header(name: str, metric_type: str) -> list:
+    header = []
+    if name in METRIC_HELP:
+        header.append(f"# HELP {METRIC_PREFIX}{name} {METRIC_HELP[name]}")
+    header.append(f"# TYPE {METRIC_PREFIX}{name} {metric_type}")
+    return header
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape_label(str(value))}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
@@ -0,0 +1,114 @@
+import re
+from typing import Iterable
+
+from sqlalchemy import Table, bindparam, or_, select, update
+from sqlalchemy.engine import Engine
+
+from database import add_missing_columns
+
+# Bump whenever `normalize_name` changes: stored forms with another version are recomputed
+NORMALIZATION_VERSION = 1
+
+# Rows renormalized per UPDATE executemany by `ensure_normalized_names`
+NORMALIZE_BATCH_SIZE = 5000
+
+# Cyrillic letters that look like Latin ones (after casefolding). Every token is folded,
+# so "Sаmsung" typed with a Cyrillic "а" and "СМАРТФОН" typed with Latin "C", "M", "A"
+# end up identical to their clean spellings
+_HOMOGLYPHS = str.maketrans("авеёкмнорстухіјѕ", "abeekmhopctyxijs")
+
+# Units written after a number -> canonical (Latin) unit glued to the number,
+# so "256GB", "256 Gb" and "256 ГБ" all become "256gb"
+_UNITS = {
+    "gb": "gb", "гб": "gb",
+    "tb": "tb", "тб": "tb",
+    "mb": "mb", "мб": "mb",
+    "kg": "kg", "кг": "kg",
+    "mg": "mg", "мг": "mg",
+    "g": "g", "г": "g", "гр": "g",
+    "ml": "ml", "мл": "ml",
+    "l": "l", "л": "l",
+    "mm": "mm", "мм": "mm",
+    "cm": "cm", "см": "cm",
+    "m": "m", "м": "m",
+    "kw": "kw", "квт": "kw",
+    "w": "w", "вт": "w",
+    "mah": "mah", "мач": "mah",
+    "ghz": "ghz", "ггц": "ghz",
+    "mhz": "mhz", "мгц": "mhz",
+    "hz": "hz", "гц": "hz",
+    '"': "inch", "дюйм": "inch", "дюйма": "inch", "дюймов": "inch",
+    "pcs": "pcs", "шт": "pcs",
+}
+_UNIT_RE = re.compile(
+    r"(?<![\w.])(\d+(?:\.\d+)?)\s*("
+    + "|".join(re.escape(unit) for unit in sorted(_UNITS, key=len, reverse=True))
+    + r")(?!\w)"
+)
+_DECIMAL_COMMA_RE = re.compile(r"(?<=\d),(?=\d)")
+
+# Words, numbers and decimals ("1.5l"); any other character separates tokens
+_TOKEN_RE = re.compile(r"[^\W_]+(?:\.\d+[^\W_]*)*")
+
+# Brand/model codes like "WH-1000XM5" or "A2337/M2": alphanumeric runs glued together
+# with dashes or slashes. The ones containing digits also get a separator-free token
+_CODE_RE = re.compile(r"[^\W_]+(?:[-/][^\W_]+)+")
+_CODE_SEPARATORS_RE = re.compile(r"[-/]")
+
+
+def normalize_name(name: str) -> str:
+    """
+    Canonical form of a product name the matcher scores and blocks on:
+    casefolded, units glued to their numbers in a canonical spelling, Cyrillic
+    homoglyphs folded to Latin, and the sorted set of tokens joined by spaces.
+    Computed once when an item is written (see models) and stored with it.
+    """
+    if not name:
+        return ""
+
+    value = _DECIMAL_COMMA_RE.sub(".", name.casefold())
+    value = _UNIT_RE.sub(lambda m: m.group(1) + _UNITS[m.group(2)], value)
+    value = value.translate(_HOMOGLYPHS)
+
+    tokens = set(_TOKEN_RE.findall(value))
+    for code in _CODE_RE.findall(value):
+        if any(ch.isdigit() for ch in code):
+            tokens.add(_CODE_SEPARATORS_RE.sub("", code))
+
+    return " ".join(sorted(tokens))
+
+
+def ensure_normalized_names(engine: Engine, tables: Iterable[Table], batch_size: int = NORMALIZE_BATCH_SIZE) -> int:
+    """
+    Adds the normalized name columns to tables created before they existed and
+    (re)computes `name_norm` for rows stored without it or with an older
+    NORMALIZATION_VERSION. Returns the number of rows updated.
+    """
+    updated = 0
+    for table in tables:
+        add_missing_columns(engine, table, ("name_norm", "name_norm_version"))
+
+        outdated = or_(table.c.name_norm_version.is_(None), table.c.name_norm_version != NORMALIZATION_VERSION)
+        update_stmt = (
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(name_norm=bindparam("b_name_norm"), name_norm_version=NORMALIZATION_VERSION)
+        )
+        after_id = 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    select(table.c.id, table.c.name)
+                    .where(outdated, table.c.id > after_id)
+                    .order_by(table.c.id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                conn.execute(update_stmt, [
+                    {"b_id": row_id, "b_name_norm": normalize_name(name)} for row_id, name in rows
+                ])
+            updated += len(rows)
+            after_id = rows[-1].id
+
+    return updated
@@ -1,6 +1,43 @@
+import numpy as np
 import pandas as pd
 import xml.etree.ElementTree as ET
 from io import BytesIO
+from typing import BinaryIO, Callable, Iterator
+
+import openpyxl
+
+# Rows read per chunk when streaming CSV/Excel files
+PARSE_CHUNK_SIZE = 10000
+
+# Repeated XML nodes treated as price list items
+XML_ITEM_TAGS = ("Item", "Товар")
+
+# Column name heuristics (lowercase substrings) for price lists
+PRICE_LIST_COLUMNS = {
+    "name": ["наименование", "название", "товар", "name", "item", "номенклатура"],
+    "barcode": ["штрихкод", "barcode", "штрих-код", "ean", "штрих код"],
+    "article": ["артикул", "article", "код", "sku"],
+    "price": ["цена", "price", "стоимость"]
+}
+
+# Column name heuristics for 1C nomenclature exports. The 1C code column is resolved
+# first (by substring, then by exact name) and is never reused for another field
+MASTER_CODE_COLUMNS = ["код 1с", "код1с", "код в 1с", "code_1c", "code1c", "идентификатор", "guid", "uuid"]
+MASTER_CODE_EXACT_COLUMNS = ("код", "ид", "id", "code")
+MASTER_CATALOG_COLUMNS = {
+    "name": PRICE_LIST_COLUMNS["name"],
+    "barcode": PRICE_LIST_COLUMNS["barcode"],
+    "article": ["артикул", "article", "sku"],
+}
+
+# CommerceML (1C exchange format) child elements of <Товар>, namespaces ignored
+COMMERCEML_FIELDS = {
+    "code_1c": ("Ид", "Код", "Id", "Code"),
+    "name": ("Наименование", "Name"),
+    "barcode": ("Штрихкод", "ШтрихКод", "Barcode"),
+    "article": ("Артикул", "Article"),
+}
+
 
 def parse_price_list(file_bytes: bytes, filename: str, supplier_name: str) -> list[dict]:
     """
@@ -14,58 +51,155 @@ def parse_price_list(file_bytes: bytes, filename: str, supplier_name: str) -> li
         "price": float | None
     }
     """
+    return list(iter_price_list(BytesIO(file_bytes), filename, supplier_name))
+
+
+def iter_price_list(source: BinaryIO, filename: str, supplier_name: str, chunk_size: int = PARSE_CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Streaming version of `parse_price_list`: reads a seekable binary file chunk by chunk
+    and yields the same records one at a time, so memory stays bounded for any file size.
+    """
     extension = filename.split(".")[-1].lower()
-    
+
+    def to_records(df, mapping):
+        return _df_to_records(df, supplier_name, mapping)
+
     if extension == "csv":
-        # Using a versatile separator attempt or default to comma/semicolon
-        try:
-            df = pd.read_csv(BytesIO(file_bytes), sep=';')
-            if len(df.columns) < 2:
-                df = pd.read_csv(BytesIO(file_bytes), sep=',')
-        except Exception as e:
-            raise ValueError(f"Failed to parse CSV: {e}")
-            
-        return _df_to_records(df, supplier_name)
-        
-    elif extension in ["xls", "xlsx"]:
+        yield from _iter_csv(source, chunk_size, to_records)
+
+    elif extension == "xlsx":
+        yield from _iter_xlsx(source, chunk_size, to_records)
+
+    elif extension == "xls":
+        # Legacy binary Excel can't be streamed by openpyxl, read it in one go
         try:
-            df = pd.read_excel(BytesIO(file_bytes))
+            df = pd.read_excel(source)
         except Exception as e:
             raise ValueError(f"Failed to parse Excel: {e}")
-            
-        return _df_to_records(df, supplier_name)
-        
+
+        yield from _df_to_records(df, supplier_name)
+
     elif extension == "xml":
         try:
-            return _parse_xml(file_bytes, supplier_name)
-        except Exception as e:
+            yield from _parse_xml(source, supplier_name)
+        except ET.ParseError as e:
             raise ValueError(f"Failed to parse XML: {e}")
-            
+
     else:
         raise ValueError(f"Unsupported file format: {extension}")
 
 
-def _df_to_records(df: pd.DataFrame, supplier_name: str) -> list[dict]:
+def iter_master_catalog(source: BinaryIO, filename: str, chunk_size: int = PARSE_CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Streams a 1C nomenclature export (.csv, .xlsx, CommerceML .xml) from a seekable
+    binary file, yielding {"code_1c", "name", "barcode", "article"} records.
+    Rows without a 1C code or a name are skipped.
+    """
+    extension = filename.split(".")[-1].lower()
+
+    if extension == "csv":
+        yield from _iter_csv(
+            source, chunk_size, _df_to_master_records, _resolve_master_columns, ("code_1c", "barcode", "article")
+        )
+
+    elif extension == "xlsx":
+        yield from _iter_xlsx(source, chunk_size, _df_to_master_records, _resolve_master_columns)
+
+    elif extension == "xml":
+        try:
+            yield from _parse_commerceml(source)
+        except ET.ParseError as e:
+            raise ValueError(f"Failed to parse XML: {e}")
+
+    else:
+        raise ValueError(f"Unsupported file format: {extension}")
+
+
+def _iter_csv(
+    source: BinaryIO,
+    chunk_size: int,
+    to_records: Callable[[pd.DataFrame, dict], list],
+    resolve_columns: Callable[[pd.DataFrame], dict] | None = None,
+    text_fields: tuple = ("barcode", "article"),
+) -> Iterator[dict]:
+    # Using a versatile separator attempt or default to comma/semicolon
+    try:
+        sep = ';'
+        header = pd.read_csv(source, sep=sep, nrows=0)
+        if len(header.columns) < 2:
+            sep = ','
+        source.seek(0)
+        first_chunk = pd.read_csv(source, sep=sep, nrows=chunk_size)
+    except Exception as e:
+        raise ValueError(f"Failed to parse CSV: {e}")
+
+    mapping = (resolve_columns or _resolve_columns)(first_chunk)
+
+    # Each chunk infers its own dtypes, so read barcodes/articles as text to keep
+    # them consistent between chunks (this also keeps leading zeros)
+    code_columns = {mapping[col]: str for col in text_fields if col in mapping}
+
+    try:
+        source.seek(0)
+        chunks = pd.read_csv(source, sep=sep, chunksize=chunk_size, dtype=code_columns)
+        for chunk in chunks:
+            yield from to_records(chunk, mapping)
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise ValueError(f"Failed to parse CSV: {e}")
+
+
+def _iter_xlsx(
+    source: BinaryIO,
+    chunk_size: int,
+    to_records: Callable[[pd.DataFrame, dict], list],
+    resolve_columns: Callable[[pd.DataFrame], dict] | None = None,
+) -> Iterator[dict]:
+    resolve_columns = resolve_columns or _resolve_columns
+    try:
+        workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    except Exception as e:
+        raise ValueError(f"Failed to parse Excel: {e}")
+
+    try:
+        # pandas reads the first sheet by default, keep doing the same
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(col) if col is not None else f"Unnamed: {i}" for i, col in enumerate(header)]
+
+        mapping = None
+        chunk = []
+        for row in rows:
+            chunk.append(row[:len(columns)] + (None,) * (len(columns) - len(row)))
+            if len(chunk) >= chunk_size:
+                df = pd.DataFrame(chunk, columns=columns)
+                mapping = mapping or resolve_columns(df)
+                yield from to_records(df, mapping)
+                chunk = []
+
+        if chunk or mapping is None:
+            df = pd.DataFrame(chunk, columns=columns)
+            yield from to_records(df, mapping or resolve_columns(df))
+    finally:
+        workbook.close()
+
+
+def _resolve_columns(df: pd.DataFrame, col_mapping: dict = PRICE_LIST_COLUMNS, exclusive: bool = False) -> dict:
     """
     Tries to intelligently map dataframe columns to our expected fields.
     This is a basic implementation; in a real scenario, you'd likely want 
     a mapping configuration per supplier.
+    With `exclusive` a column is mapped to one field at most.
     """
-    
-    # Simple heuristics for column names (case-insensitive)
-    col_mapping = {
-        "name": ["наименование", "название", "товар", "name", "item", "номенклатура"],
-        "barcode": ["штрихкод", "barcode", "штрих-код", "ean", "штрих код"],
-        "article": ["артикул", "article", "код", "sku"],
-        "price": ["цена", "price", "стоимость"]
-    }
-
-    # Find matching columns in the dataframe
+    # Find matching columns in the dataframe (heuristics are case-insensitive)
     df_cols = [str(c).lower().strip() for c in df.columns]
     
     actual_mapping = {}
     for standard_col, possible_names in col_mapping.items():
         for i, df_col in enumerate(df_cols):
+            if exclusive and df.columns[i] in actual_mapping.values():
+                continue
             if any(name in df_col for name in possible_names):
                 actual_mapping[standard_col] = df.columns[i]
                 break
@@ -73,80 +207,234 @@ def _df_to_records(df: pd.DataFrame, supplier_name: str) -> list[dict]:
     if "name" not in actual_mapping:
          # Fallback to the first string column if no clear name column is found
          for col in df.columns:
-             if df[col].dtype == 'object':
+             if df[col].dtype == 'object' or pd.api.types.is_string_dtype(df[col]):
                  actual_mapping["name"] = col
                  break
          
          if "name" not in actual_mapping:
             raise ValueError("Could not automatically determine the 'name' column in the file.")
 
-    records = []
-    # Replace NaNs with None
-    df = df.where(pd.notnull(df), None)
+    return actual_mapping
 
-    for _, row in df.iterrows():
-        # Ensure name isn't completely empty
-        raw_name = row.get(actual_mapping.get("name"))
-        if not raw_name or pd.isna(raw_name) or str(raw_name).strip() == "":
-            continue
-            
-        record = {
-            "supplier_name": supplier_name,
-            "name": str(raw_name).strip(),
-            "barcode": str(row.get(actual_mapping.get("barcode", "none_existent"))).strip() if actual_mapping.get("barcode") and row.get(actual_mapping.get("barcode")) else None,
-            "article": str(row.get(actual_mapping.get("article", "none_existent"))).strip() if actual_mapping.get("article") and row.get(actual_mapping.get("article")) else None,
-            "price": None
-        }
-        
-        # Handle barcodes that might have been parsed as floats (e.g. 4.60123e+12)
-        if record["barcode"] and record["barcode"].endswith(".0"):
-             record["barcode"] = record["barcode"][:-2]
-             
-        # Try to parse price reliably
-        if actual_mapping.get("price"):
-            raw_price = row.get(actual_mapping.get("price"))
-            if raw_price:
-                 try:
-                     record["price"] = float(str(raw_price).replace(',', '.'))
-                 except ValueError:
-                     pass
-
-        records.append(record)
-        
-    return records
-
-
-def _parse_xml(file_bytes: bytes, supplier_name: str) -> list[dict]:
+
+def _resolve_master_columns(df: pd.DataFrame) -> dict:
+    """Column mapping of a 1C nomenclature export; the 1C code and name columns are required."""
+    df_cols = [str(c).lower().strip() for c in df.columns]
+    code_column = next(
+        (df.columns[i] for i, df_col in enumerate(df_cols) if any(name in df_col for name in MASTER_CODE_COLUMNS)),
+        None,
+    )
+    if code_column is None:
+        code_column = next((df.columns[i] for i, df_col in enumerate(df_cols) if df_col in MASTER_CODE_EXACT_COLUMNS), None)
+    if code_column is None:
+        raise ValueError("Could not automatically determine the 1C code column in the file.")
+
+    mapping = _resolve_columns(df.drop(columns=[code_column]), MASTER_CATALOG_COLUMNS, exclusive=True)
+    mapping["code_1c"] = code_column
+    return mapping
+
+
+def _df_to_master_records(df: pd.DataFrame, actual_mapping: dict) -> list[dict]:
+    """Converts a dataframe of a 1C nomenclature export to master item records."""
+    df = df.reset_index(drop=True)
+    codes = _column_values(df, actual_mapping["code_1c"])
+    names = _column_values(df, actual_mapping.get("name"))
+    keep = codes.notna() & (codes != "") & names.notna() & (names != "")
+    if not keep.any():
+        return []
+
+    df = df[keep].reset_index(drop=True)
+    records = pd.DataFrame({
+        "code_1c": _repair_float_codes(codes[keep].reset_index(drop=True)),
+        "name": names[keep].reset_index(drop=True),
+        "barcode": _repair_float_codes(_column_values(df, actual_mapping.get("barcode"))),
+        "article": _column_values(df, actual_mapping.get("article")),
+    })
+    return records.to_dict("records")
+
+
+def _df_to_records(df: pd.DataFrame, supplier_name: str, actual_mapping: dict | None = None) -> list[dict]:
+    """
+    Converts a dataframe to records using the column mapping from `_resolve_columns`
+    (resolved from `df` itself when not given).
+    """
+    if actual_mapping is None:
+        actual_mapping = _resolve_columns(df)
+
+    # Whole-column version of the old per-row loop, with the same normalization:
+    # skip rows with an empty name, strip values, repair barcodes parsed as floats
+    # ("4601234567890.0") and parse comma-decimal prices
+    df = df.reset_index(drop=True)
+    names = _column_values(df, actual_mapping.get("name"))
+    keep = names.notna() & (names != "")
+    if not keep.any():
+        return []
+
+    df = df[keep].reset_index(drop=True)
+    names = names[keep].reset_index(drop=True)
+
+    barcodes = _repair_float_codes(_column_values(df, actual_mapping.get("barcode")))
+    articles = _column_values(df, actual_mapping.get("article"))
+
+    records = pd.DataFrame({
+        "supplier_name": supplier_name,
+        "name": names,
+        "barcode": barcodes,
+        "article": articles,
+        "price": _column_prices(df, actual_mapping.get("price")),
+    })
+
+    return records.to_dict("records")
+
+
+def _repair_float_codes(values: pd.Series) -> pd.Series:
+    # Handle codes that might have been parsed as floats (e.g. 4.60123e+12 -> "4601230000000.0")
+    float_codes = values.str.endswith(".0", na=False)
+    return values.mask(float_codes, values.str[:-2])
+
+
+def _truthy(column: pd.Series) -> pd.Series:
+    """Vectorized `bool(value)` for cell values: missing, 0 and "" are falsy."""
+    return column.notna() & ~column.astype(object).isin([0, ""])
+
+
+def _column_values(df: pd.DataFrame, column) -> pd.Series:
+    """Stripped string values of a column, None where the cell is empty (or no such column)."""
+    if column is None:
+        return pd.Series(np.full(len(df), None, dtype=object), index=df.index, dtype=object)
+
+    values = df[column]
+    truthy = _truthy(values)
+    stripped = values[truthy].astype(object).astype(str).str.strip()
+    return stripped.reindex(df.index).astype(object).where(truthy, None)
+
+
+def _column_prices(df: pd.DataFrame, column) -> pd.Series:
+    """Prices as floats (accepting comma decimals), None where empty or unparseable."""
+    prices = np.full(len(df), None, dtype=object)
+    if column is None:
+        return pd.Series(prices, dtype=object)
+
+    values = df[column]
+    truthy = _truthy(values)
+    raw = values[truthy].astype(object).astype(str).str.replace(',', '.', regex=False)
+    parsed = pd.to_numeric(raw, errors="coerce").astype(float)
+
+    # to_numeric is stricter than float() ("1_000", non-ASCII digits, "nan"),
+    # re-check whatever it rejected with float() itself
+    parsed_ok = parsed.notna()
+    for idx in parsed.index[~parsed_ok]:
+        try:
+            parsed[idx] = float(raw[idx])
+            parsed_ok[idx] = True
+        except ValueError:
+            pass
+
+    prices[parsed.index[parsed_ok]] = parsed[parsed_ok].tolist()
+    return pd.Series(prices, dtype=object)
+
+
+def _parse_xml(source: BinaryIO, supplier_name: str) -> Iterator[dict]:
     """
     Very basic XML parser expecting a flat list of items.
     Like CommerceML, but simplified for generic fallback.
+    Streams the document with `iterparse` and drops every item node once it is read.
     """
-    tree = ET.parse(BytesIO(file_bytes))
-    root = tree.getroot()
-    
-    records = []
-    
+    found = False
+    # Open elements, so a finished item can be detached from its parent
+    stack = []
+
     # We'll just look for elements that might represent an item
     # This highly depends on the XML structure; assuming a generic format where 
     # items are repeated nodes like <Item> or <Товар>
-    item_nodes = root.findall(".//Item") or root.findall(".//Товар")
-    
-    for node in item_nodes:
-        name_node = node.find("Name") or node.find("Наименование") or node.find("Название")
-        barcode_node = node.find("Barcode") or node.find("Штрихкод")
-        article_node = node.find("Article") or node.find("Артикул")
-        price_node = node.find("Price") or node.find("Цена")
-        
-        if name_node is not None and name_node.text:
-            records.append({
+    for event, node in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            stack.append(node)
+            continue
+
+        stack.pop()
+        if node.tag not in XML_ITEM_TAGS or not stack:
+            continue
+
+        name = _find_text(node, "Name", "Наименование", "Название")
+        if name:
+            barcode = _find_text(node, "Barcode", "Штрихкод")
+            article = _find_text(node, "Article", "Артикул")
+            price = _find_text(node, "Price", "Цена")
+            try:
+                price = float(price.replace(',', '.')) if price else None
+            except ValueError as e:
+                raise ValueError(f"Failed to parse XML: {e}")
+
+            found = True
+            yield {
                 "supplier_name": supplier_name,
-                "name": name_node.text.strip(),
-                "barcode": barcode_node.text.strip() if barcode_node is not None and barcode_node.text else None,
-                "article": article_node.text.strip() if article_node is not None and article_node.text else None,
-                "price": float(price_node.text.replace(',', '.')) if price_node is not None and price_node.text else None
-            })
-            
-    if not records:
+                "name": name,
+                "barcode": barcode or None,
+                "article": article or None,
+                "price": price
+            }
+
+        # Free the processed item so the tree never grows beyond the current node
+        node.clear()
+        stack[-1].remove(node)
+
+    if not found:
         raise ValueError("Could not find required item nodes (<Товар> или <Item>) or their <Наименование> in XML.")
-        
-    return records
+
+
+def _parse_commerceml(source: BinaryIO) -> Iterator[dict]:
+    """
+    Streams the <Товар> nodes of a CommerceML catalog (import.xml) or of a flat
+    <Item>/<Товар> list, whatever the namespace, dropping every node once it is read.
+    """
+    found = False
+    stack = []
+
+    for event, node in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            stack.append(node)
+            continue
+
+        stack.pop()
+        if _local_name(node.tag) not in XML_ITEM_TAGS or not stack:
+            continue
+
+        # Direct children only: nested <Ид> of groups or properties are not the item's
+        children = {}
+        for child in node:
+            if child.text and child.text.strip():
+                children.setdefault(_local_name(child.tag), child.text.strip())
+        fields = {
+            field: next((children[tag] for tag in tags if tag in children), None)
+            for field, tags in COMMERCEML_FIELDS.items()
+        }
+
+        if fields.get("code_1c") and fields.get("name"):
+            found = True
+            yield {
+                "code_1c": fields["code_1c"],
+                "name": fields["name"],
+                "barcode": fields.get("barcode"),
+                "article": fields.get("article"),
+            }
+
+        node.clear()
+        stack[-1].remove(node)
+
+    if not found:
+        raise ValueError("Could not find item nodes (<Товар> или <Item>) with <Ид> and <Наименование> in XML.")
+
+
+def _local_name(tag: str) -> str:
+    # "{urn:1C.ru:commerceml_2}Товар" -> "Товар"
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find_text(node: ET.Element, *tags: str) -> str | None:
+    """Returns the stripped text of the first existing child among `tags`."""
+    for tag in tags:
+        child = node.find(tag)
+        if child is not None:
+            return child.text.strip() if child.text else None
+    return None
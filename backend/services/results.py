@@ -0,0 +1,167 @@
+from typing import Iterator, Optional
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session, aliased
+from models import MasterItem, MatchCandidate, SupplierItem
+
+
+def results_query(status: Optional[str] = None):
+    """
+    Supplier items joined with their matched master item in a single SELECT, ordered by id.
+    status: None for all items, "matched" or "unmatched".
+    """
+    query = (
+        select(
+            SupplierItem.id,
+            SupplierItem.supplier_name,
+            SupplierItem.name,
+            SupplierItem.barcode,
+            SupplierItem.article,
+            SupplierItem.price,
+            SupplierItem.is_matched,
+            SupplierItem.match_confidence,
+            SupplierItem.match_type,
+            SupplierItem.matched_master_id,
+            MasterItem.name.label("master_name"),
+            MasterItem.barcode.label("master_barcode"),
+            MasterItem.article.label("master_article"),
+            MasterItem.code_1c.label("master_code_1c"),
+        )
+        .outerjoin(MasterItem, MasterItem.id == SupplierItem.matched_master_id)
+        .order_by(SupplierItem.id)
+    )
+    if status == "matched":
+        query = query.where(SupplierItem.is_matched == True)
+    elif status == "unmatched":
+        query = query.where(SupplierItem.is_matched == False)
+    return query
+
+
+def result_row_to_dict(row) -> dict:
+    """Formats a `results_query` row the way the API returns it."""
+    resp = {
+        "id": row.id,
+        "supplier_name": row.supplier_name,
+        "name": row.name,
+        "barcode": row.barcode,
+        "article": row.article,
+        "price": row.price,
+        "is_matched": row.is_matched,
+        "match_confidence": row.match_confidence,
+        "match_type": row.match_type
+    }
+    if row.is_matched and row.matched_master_id and row.master_code_1c is not None:
+        resp["master_item"] = {
+            "id": row.matched_master_id,
+            "name": row.master_name,
+            "barcode": row.master_barcode,
+            "article": row.master_article,
+            "code_1c": row.master_code_1c
+        }
+    return resp
+
+
+def fetch_results(
+    db: Session,
+    status: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+) -> tuple[list[dict], Optional[int]]:
+    """
+    Returns a page of results and the cursor for the next page (None on the last page).
+    With `after_id` the page is fetched by keyset (id > after_id) instead of OFFSET,
+    so deep pages cost the same as the first one.
+    """
+    query = results_query(status)
+    if after_id is not None:
+        query = query.where(SupplierItem.id > after_id)
+    if skip:
+        query = query.offset(skip)
+
+    rows = db.execute(query.limit(limit)).all()
+    items = [result_row_to_dict(row) for row in rows]
+
+    next_cursor = rows[-1].id if rows and len(rows) == limit else None
+    return items, next_cursor
+
+
+def iter_results(db: Session, status: Optional[str] = None, batch_size: int = 5000) -> Iterator[dict]:
+    """
+    Yields every result, reading them from the DB in keyset batches of `batch_size`
+    rows, so memory stays flat however many items are exported.
+    """
+    after_id = None
+    while True:
+        items, after_id = fetch_results(db, status=status, limit=batch_size, after_id=after_id)
+        yield from items
+        if after_id is None:
+            return
+
+
+def review_condition(confidence_threshold: float):
+    """Supplier items needing a reviewer: unmatched, or fuzzy matched below `confidence_threshold`."""
+    return or_(
+        SupplierItem.is_matched == False,
+        and_(SupplierItem.match_type == "fuzzy", SupplierItem.match_confidence < confidence_threshold),
+    )
+
+
+def fetch_review_queue(
+    db: Session,
+    confidence_threshold: float,
+    limit: int = 50,
+    after_id: Optional[int] = None,
+    supplier_name: Optional[str] = None,
+) -> tuple[list[dict], Optional[int]]:
+    """
+    Returns a page of review items, each with the candidates stored by the last match run
+    (best first), and the keyset cursor of the next page (None on the last page).
+    The page of items, their candidates and the candidates' master items come from one SELECT.
+    """
+    page = select(SupplierItem.id).where(review_condition(confidence_threshold))
+    if supplier_name:
+        page = page.where(SupplierItem.supplier_name == supplier_name)
+    if after_id is not None:
+        page = page.where(SupplierItem.id > after_id)
+    page = page.order_by(SupplierItem.id).limit(limit).subquery()
+
+    candidate_master = aliased(MasterItem)
+    base = results_query().subquery()
+    rows = db.execute(
+        select(
+            base,
+            MatchCandidate.master_item_id.label("candidate_id"),
+            MatchCandidate.score.label("candidate_score"),
+            MatchCandidate.stage.label("candidate_stage"),
+            candidate_master.name.label("candidate_name"),
+            candidate_master.barcode.label("candidate_barcode"),
+            candidate_master.article.label("candidate_article"),
+            candidate_master.code_1c.label("candidate_code_1c"),
+        )
+        .join(page, page.c.id == base.c.id)
+        .outerjoin(MatchCandidate, MatchCandidate.supplier_item_id == base.c.id)
+        .outerjoin(candidate_master, candidate_master.id == MatchCandidate.master_item_id)
+        .order_by(base.c.id, MatchCandidate.rank)
+    ).all()
+
+    items = {}
+    for row in rows:
+        item = items.get(row.id)
+        if item is None:
+            item = items[row.id] = result_row_to_dict(row)
+            item["candidates"] = []
+        if row.candidate_id is not None and row.candidate_code_1c is not None:
+            item["candidates"].append({
+                "id": row.candidate_id,
+                "name": row.candidate_name,
+                "barcode": row.candidate_barcode,
+                "article": row.candidate_article,
+                "code_1c": row.candidate_code_1c,
+                "score": row.candidate_score,
+                "stage": row.candidate_stage,
+            })
+
+    items = list(items.values())
+    next_cursor = items[-1]["id"] if items and len(items) == limit else None
+    return items, next_cursor
@@ -0,0 +1,184 @@
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, bindparam, delete, select, update
+from sqlalchemy.orm import Session
+
+from models import MasterItem, MatchCandidate, SupplierItem
+from services.ingest import batched
+from services.master_index import get_catalog_version
+from services.match_memory import forget_matches, remember_matches
+from services.metrics import inc, span
+
+# Ids validated per IN (...) query
+REVIEW_LOOKUP_BATCH_SIZE = 500
+
+# "match"   - match the supplier item to the master item (as /api/manual-match/ does)
+# "reject"  - the suggested master item is wrong: drop the suggestion, and the match if it
+#             points there
+# "unmatch" - undo the item's current match; it goes back to the review queue
+REVIEW_ACTIONS = ("match", "reject", "unmatch")
+
+
+def apply_review_decisions(db: Session, decisions: Iterable[tuple]) -> list:
+    """
+    Applies (supplier item id, master item id or None, action) review decisions in one
+    transaction. Ids are validated with set-based queries and the changes are written with
+    executemany statements, so the cost doesn't grow with round trips per decision.
+    If an item has several decisions the last one wins.
+    Returns one outcome per decision, in order: {"supplier_item_id", "master_item_id",
+    "action", "status": "applied" | "skipped" | "invalid" | "superseded", "error"?}.
+    Matches are remembered in match memory like single manual matches; rejected and
+    unmatched pairs are forgotten there.
+    """
+    decisions = list(decisions)
+    outcomes = [
+        {"supplier_item_id": item_id, "master_item_id": master_id, "action": action, "status": "applied"}
+        for item_id, master_id, action in decisions
+    ]
+
+    with span("review.validate"):
+        items = _fetch_by_ids(
+            db,
+            select(
+                SupplierItem.id, SupplierItem.supplier_name, SupplierItem.barcode, SupplierItem.article,
+                SupplierItem.name, SupplierItem.is_matched, SupplierItem.matched_master_id,
+            ),
+            SupplierItem.id,
+            {item_id for item_id, _, _ in decisions},
+        )
+        master_ids = {
+            row.id for row in _fetch_by_ids(
+                db, select(MasterItem.id), MasterItem.id,
+                {master_id for _, master_id, _ in decisions if master_id is not None},
+            ).values()
+        }
+
+    # Last valid decision per supplier item
+    latest = {}
+    for position, (item_id, master_id, action) in enumerate(decisions):
+        error = _validation_error(item_id, master_id, action, items, master_ids)
+        if error:
+            outcomes[position].update(status="invalid", error=error)
+            continue
+        if item_id in latest:
+            outcomes[latest[item_id]]["status"] = "superseded"
+        latest[item_id] = position
+
+    matches, rejections, unmatches = [], [], []
+    for item_id, position in latest.items():
+        _, master_id, action = decisions[position]
+        item = items[item_id]
+        if action == "match":
+            matches.append((item, master_id))
+        elif action == "reject":
+            rejections.append((item, master_id))
+            if item.is_matched and item.matched_master_id == master_id:
+                unmatches.append(item)
+        elif item.is_matched:
+            unmatches.append(item)
+        else:
+            outcomes[position]["status"] = "skipped"
+
+    with span("review.apply"):
+        try:
+            # Matches last: what they remember must survive a rejection of the same keys
+            _apply_rejections(db, rejections)
+            _apply_unmatches(db, unmatches)
+            _apply_matches(db, matches)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    for action, applied in (("match", matches), ("reject", rejections), ("unmatch", unmatches)):
+        inc("review_decisions_total", len(applied), action=action)
+    return outcomes
+
+
+def _fetch_by_ids(db: Session, query, id_column, ids: set) -> dict:
+    rows = {}
+    for batch in batched(ids, REVIEW_LOOKUP_BATCH_SIZE):
+        for row in db.execute(query.where(id_column.in_(batch))):
+            rows[row.id] = row
+    return rows
+
+
+def _validation_error(item_id: int, master_id: Optional[int], action: str, items: dict, master_ids: set) -> Optional[str]:
+    if action not in REVIEW_ACTIONS:
+        return f"Unknown action: {action}"
+    if item_id not in items:
+        return "Supplier item not found"
+    if action in ("match", "reject"):
+        if master_id is None:
+            return f"master_item_id is required to {action}"
+        if master_id not in master_ids:
+            return "Master item not found"
+    return None
+
+
+def _apply_matches(db: Session, matches: list):
+    if not matches:
+        return
+    supplier_items = SupplierItem.__table__
+    db.execute(
+        update(supplier_items)
+        .where(supplier_items.c.id == bindparam("b_id"))
+        .values(
+            is_matched=True,
+            matched_master_id=bindparam("b_master_id"),
+            match_confidence=100.0,
+            match_type="manual",
+        ),
+        [{"b_id": item.id, "b_master_id": master_id} for item, master_id in matches],
+    )
+    # A previous match of the item isn't remembered any more
+    forget_matches(db, [
+        (item, item.matched_master_id)
+        for item, master_id in matches
+        if item.is_matched and item.matched_master_id not in (None, master_id)
+    ])
+    remember_matches(db, matches)
+    # Reviewed, their suggestions are no longer needed
+    _delete_candidates(db, [item.id for item, _ in matches])
+
+
+def _apply_rejections(db: Session, rejections: list):
+    if not rejections:
+        return
+    match_candidates = MatchCandidate.__table__
+    db.execute(
+        delete(match_candidates).where(and_(
+            match_candidates.c.supplier_item_id == bindparam("b_id"),
+            match_candidates.c.master_item_id == bindparam("b_master_id"),
+        )),
+        [{"b_id": item.id, "b_master_id": master_id} for item, master_id in rejections],
+    )
+    forget_matches(db, rejections)
+
+
+def _apply_unmatches(db: Session, items: list):
+    if not items:
+        return
+    supplier_items = SupplierItem.__table__
+    # Marked as attempted against the current catalog, so the next run doesn't match them
+    # straight back; a rescore run or a catalog change retries them
+    catalog_version = get_catalog_version(db)
+    for batch in batched([item.id for item in items], REVIEW_LOOKUP_BATCH_SIZE):
+        db.execute(
+            update(supplier_items)
+            .where(supplier_items.c.id.in_(batch))
+            .values(
+                is_matched=False,
+                matched_master_id=None,
+                match_confidence=None,
+                match_type=None,
+                match_attempted_version=catalog_version,
+            )
+        )
+    forget_matches(db, [(item, item.matched_master_id) for item in items])
+
+
+def _delete_candidates(db: Session, item_ids: list):
+    match_candidates = MatchCandidate.__table__
+    for batch in batched(item_ids, REVIEW_LOOKUP_BATCH_SIZE):
+        db.execute(delete(match_candidates).where(match_candidates.c.supplier_item_id.in_(batch)))
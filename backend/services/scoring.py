@@ -0,0 +1,142 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Optional
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+# Supplier items scored per `cdist` call. The score matrix of a chunk is
+# chunk size x nomenclature size float64 values, so keep it modest for big catalogs.
+BATCH_CHUNK_SIZE = 64
+
+# Number of worker processes used by default for batch scoring
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Normalized master names, set once per pool process by `_init_worker`
+_worker_choices = None
+
+
+def _init_worker(choices: List[str]):
+    global _worker_choices
+    _worker_choices = choices
+
+
+def _score_chunk(queries: List[str], score_cutoff: float, choices: Optional[List[str]] = None, top_k: int = 1) -> list:
+    """
+    Scores a chunk of normalized supplier names against all master names at once
+    and returns, per query, up to `top_k` (choice index, score) hits best first.
+    """
+    if choices is None:
+        choices = _worker_choices
+
+    scores = process.cdist(
+        queries,
+        choices,
+        scorer=fuzz.token_set_ratio,
+        score_cutoff=score_cutoff,
+        dtype=np.float64,
+        workers=1,
+    )
+    # argmax returns the first maximum, same tie-breaking as extractOne
+    best_indexes = scores.argmax(axis=1)
+    top_k = min(top_k, len(choices))
+    if top_k > 1:
+        top_indexes = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+
+    results = []
+    for row, best_index in enumerate(best_indexes):
+        indexes = {int(best_index)}
+        if top_k > 1:
+            indexes.update(int(index) for index in top_indexes[row])
+
+        hits = []
+        for index in indexes:
+            score = float(scores[row, index])
+            if score >= score_cutoff and (score > 0 or score_cutoff <= 0):
+                hits.append((index, score))
+        # Highest score first, ties by choice order, so the best hit is argmax's
+        hits.sort(key=lambda hit: (-hit[1], hit[0]))
+        results.append(hits[:top_k])
+    return results
+
+
+class BatchScorer:
+    """
+    Scores batches of normalized supplier names against a fixed list of normalized
+    master names (see services.normalize). The process pool (if any) is kept alive
+    across calls, so a matching run can score its items checkpoint by checkpoint.
+    Use as a context manager or call `close()` to shut the pool down.
+    """
+
+    def __init__(
+        self,
+        choice_ids: List[int],
+        choice_names: List[str],
+        score_cutoff: float,
+        workers: int = DEFAULT_WORKERS,
+        chunk_size: int = BATCH_CHUNK_SIZE,
+    ):
+        self.choice_ids = list(choice_ids)
+        self.choices = list(choice_names)
+        self.score_cutoff = score_cutoff
+        self.workers = max(1, workers or 1)
+        self.chunk_size = chunk_size
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def candidates_per_item(self) -> int:
+        # Every name is scored against the whole nomenclature
+        return len(self.choices)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def top_matches(self, names: List[str], top_k: int) -> list:
+        """
+        Batch equivalent of `process.extract(name, choices, scorer=fuzz.token_set_ratio, limit=top_k)`
+        for every normalized name. Returns a list aligned with `names` holding the `top_k` best
+        (master_id, score) hits best first (an empty list when nothing reaches the cutoff).
+        Scores are not rounded. Names are split into chunks which are spread over the process
+        pool; results do not depend on the number of workers.
+        """
+        if not names or not self.choice_ids:
+            return [[] for _ in names]
+
+        queries = list(names)
+        chunks = [queries[i:i + self.chunk_size] for i in range(0, len(queries), self.chunk_size)]
+
+        if self.workers == 1 or len(chunks) == 1:
+            chunk_results = [_score_chunk(chunk, self.score_cutoff, self.choices, top_k) for chunk in chunks]
+        else:
+            # map keeps chunk order, so the output is deterministic
+            chunk_results = list(self._get_pool().map(
+                _score_chunk, chunks, repeat(self.score_cutoff), repeat(None), repeat(top_k)
+            ))
+
+        return [
+            [(self.choice_ids[index], score) for index, score in hits]
+            for chunk_result in chunk_results
+            for hits in chunk_result
+        ]
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # "spawn" so pool processes don't inherit the server's threads and DB connections
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.choices,),
+            )
+        return self._pool
+
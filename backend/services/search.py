@@ -0,0 +1,261 @@
+import re
+import weakref
+from typing import List
+
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+from sqlalchemy import or_, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from models import MasterItem
+
+# Results returned per search
+SEARCH_LIMIT = 50
+
+# Master item fields the API returns; the stored normalized name is internal to the matcher
+MASTER_ITEM_FIELDS = (MasterItem.id, MasterItem.name, MasterItem.barcode, MasterItem.article, MasterItem.code_1c)
+
+# The trigram tokenizer can only match terms of at least 3 characters;
+# shorter queries match the start of words in names instead ("LG", "S2" -> "S23")
+FTS_MIN_TERM_LENGTH = 3
+
+# Full-text matches ranked per search, per tier (names starting with the query, then names
+# containing its terms). Very common terms can match a large part of the catalog; only
+# the first SEARCH_RANK_WINDOW matches (by id) of a tier are ranked, so a better match
+# with a higher id can be missed until the query is refined
+SEARCH_RANK_WINDOW = 200
+
+FTS_TABLE = "master_items_fts"
+WORDS_TABLE = "master_items_words"
+
+# External content table: the index stores only trigrams and reads the text from master_items
+_FTS_TABLE_DDL = f"""
+CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+    name, barcode, article,
+    content='master_items', content_rowid='id', tokenize='trigram'
+)
+"""
+
+# Keep the index in sync with every write to master_items, ORM or Core
+_FTS_TRIGGERS_DDL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON master_items BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, barcode, article)
+        VALUES (new.id, new.name, new.barcode, new.article);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON master_items BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, barcode, article)
+        VALUES ('delete', old.id, old.name, old.barcode, old.article);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, barcode, article ON master_items BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, barcode, article)
+        VALUES ('delete', old.id, old.name, old.barcode, old.article);
+        INSERT INTO {FTS_TABLE}(rowid, name, barcode, article)
+        VALUES (new.id, new.name, new.barcode, new.article);
+    END
+    """,
+]
+
+# Word index of names for queries too short for trigrams; its 1 and 2 character prefix
+# indexes make word prefix lookups as cheap as whole word ones
+_WORDS_TABLE_DDL = f"""
+CREATE VIRTUAL TABLE {WORDS_TABLE} USING fts5(
+    name,
+    content='master_items', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='1 2'
+)
+"""
+
+_WORDS_TRIGGERS_DDL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {WORDS_TABLE}_ai AFTER INSERT ON master_items BEGIN
+        INSERT INTO {WORDS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {WORDS_TABLE}_ad AFTER DELETE ON master_items BEGIN
+        INSERT INTO {WORDS_TABLE}({WORDS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {WORDS_TABLE}_au AFTER UPDATE OF name ON master_items BEGIN
+        INSERT INTO {WORDS_TABLE}({WORDS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO {WORDS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+]
+
+_WORDS_PREFIX_SQL = text(f"""
+    SELECT rowid FROM {WORDS_TABLE}
+    WHERE {WORDS_TABLE} MATCH :match
+    ORDER BY rowid
+    LIMIT :limit
+""")
+
+# Walking the trigram doclists in rowid order is cheap; bm25() or any other ORDER BY is
+# not, they visit every match of the query (~100 ms for a term in every sixth name of
+# 300k). So a window of matches is fetched and ranked in Python
+_FTS_WINDOW_SQL = text(f"""
+    SELECT m.id, m.name, m.barcode, m.article
+    FROM {FTS_TABLE} f JOIN master_items m ON m.id = f.rowid
+    WHERE {FTS_TABLE} MATCH :match
+    ORDER BY f.rowid
+    LIMIT :window
+""")
+
+# Engines whose database has the FTS indexes, see ensure_search_index
+_fts_engines = weakref.WeakSet()
+
+
+def ensure_search_index(engine: Engine) -> bool:
+    """
+    Creates the FTS5 trigram and word indexes over master_items and their sync triggers
+    (SQLite only), filling them from the existing rows on first creation.
+    Returns False when the database can't have them; search then falls back to ILIKE scans.
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+
+    with engine.begin() as conn:
+        for table, table_ddl, triggers_ddl in (
+            (FTS_TABLE, _FTS_TABLE_DDL, _FTS_TRIGGERS_DDL),
+            (WORDS_TABLE, _WORDS_TABLE_DDL, _WORDS_TRIGGERS_DDL),
+        ):
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table}
+            ).first()
+            if not exists:
+                try:
+                    conn.execute(text(table_ddl))
+                except OperationalError:
+                    # SQLite built without FTS5 or older than 3.34 (no trigram tokenizer)
+                    return False
+                conn.execute(text(f"INSERT INTO {table}({table}) VALUES ('rebuild')"))
+            for ddl in triggers_ddl:
+                conn.execute(text(ddl))
+
+    _fts_engines.add(engine)
+    return True
+
+
+def search_master_items(db: Session, query: str, limit: int = SEARCH_LIMIT) -> List[dict]:
+    """
+    Searches master items by name, barcode or article; returns MASTER_ITEM_FIELDS dicts.
+    Exact barcode/article hits are returned straight away (plain index lookups).
+    Otherwise barcodes/articles starting with the query come first, then names starting
+    with it, then names or codes containing its terms, each full-text tier ranked by name
+    similarity within its first SEARCH_RANK_WINDOW matches by id. Queries too short for
+    trigrams match names having words that start with the query terms.
+    """
+    query = query.strip()
+    if not query or limit <= 0:
+        return []
+
+    # Fast path: a scanned barcode or a typed article is an indexed equality lookup
+    ids = list(db.execute(
+        select(MasterItem.id)
+        .where(or_(MasterItem.barcode == query, MasterItem.article == query))
+        .order_by(MasterItem.id)
+        .limit(limit)
+    ).scalars())
+
+    if not ids:
+        ids = _code_prefix_search(db, query, limit)
+        if len(ids) < limit:
+            if db.get_bind() not in _fts_engines:
+                more_ids = _ilike_search(db, query, limit)
+            elif len(query) < FTS_MIN_TERM_LENGTH:
+                more_ids = _word_prefix_search(db, query, limit)
+            else:
+                more_ids = _fts_search(db, query, limit)
+            ids = list(dict.fromkeys(ids + more_ids))[:limit]
+
+    if not ids:
+        return []
+    items = {row.id: row._asdict() for row in db.execute(select(*MASTER_ITEM_FIELDS).where(MasterItem.id.in_(ids)))}
+    return [items[master_id] for master_id in ids if master_id in items]
+
+
+def _fts_search(db: Session, query: str, limit: int) -> List[int]:
+    terms = query.split()
+    long_terms = [term for term in terms if len(term) >= FTS_MIN_TERM_LENGTH]
+    if not long_terms:
+        # e.g. "A 1": nothing the trigram index can look up
+        return _word_prefix_search(db, query, limit)
+
+    # Names starting with the query first: "^" anchors the phrase at the start of the name,
+    # so this tier covers the whole catalog rather than a window of all matches
+    prefix_match = "name : ^" + _fts_phrase(" ".join(terms))
+    prefix_rows = db.execute(_FTS_WINDOW_SQL, {"match": prefix_match, "window": SEARCH_RANK_WINDOW}).all()
+    ids = _rank_by_similarity(query, prefix_rows)
+    if len(ids) >= limit:
+        return ids[:limit]
+
+    # Then names or codes containing every term (implicit AND)
+    match = " ".join(_fts_phrase(term) for term in long_terms)
+    rows = db.execute(_FTS_WINDOW_SQL, {"match": match, "window": SEARCH_RANK_WINDOW}).all()
+
+    # Short terms can't be looked up in the index, check them on the window
+    short_terms = [term.casefold() for term in terms if len(term) < FTS_MIN_TERM_LENGTH]
+    if short_terms:
+        rows = [row for row in rows if all(term in _row_text(row) for term in short_terms)]
+
+    ids.extend(_rank_by_similarity(query, rows))
+    return list(dict.fromkeys(ids))[:limit]
+
+
+def _rank_by_similarity(query: str, rows: list) -> List[int]:
+    if not rows:
+        return []
+    scores = process.cdist([query], [row.name for row in rows], scorer=fuzz.WRatio, processor=default_process)[0]
+    ranked = sorted(zip(rows, scores), key=lambda ranked_row: (-ranked_row[1], ranked_row[0].id))
+    return [row.id for row, _ in ranked]
+
+
+def _code_prefix_search(db: Session, query: str, limit: int) -> List[int]:
+    """Barcodes, then articles starting with the query: range scans over their indexes."""
+    ids = []
+    for column in (MasterItem.barcode, MasterItem.article):
+        ids.extend(db.execute(
+            select(MasterItem.id)
+            .where(column >= query, column < query + "\U0010ffff")
+            .order_by(column, MasterItem.id)
+            .limit(limit)
+        ).scalars())
+    return list(dict.fromkeys(ids))[:limit]
+
+
+def _word_prefix_search(db: Session, query: str, limit: int) -> List[int]:
+    """Names with a word starting with every query term, e.g. "LG" or "S2" for "Galaxy S23"."""
+    match = " ".join('"' + term.replace('"', '""') + '"*' for term in query.split())
+    return list(db.execute(_WORDS_PREFIX_SQL, {"match": match, "limit": limit}).scalars())
+
+
+def _ilike_search(db: Session, query: str, limit: int) -> List[int]:
+    # Databases without the FTS index (e.g. PostgreSQL, where a pg_trgm GIN index makes this fast)
+    pattern = f"%{_escape_like(query)}%"
+    return list(db.execute(
+        select(MasterItem.id).where(or_(
+            MasterItem.name.ilike(pattern, escape="\\"),
+            MasterItem.barcode.ilike(pattern, escape="\\"),
+            MasterItem.article.ilike(pattern, escape="\\"),
+        )).order_by(MasterItem.id).limit(limit)
+    ).scalars())
+
+
+def _row_text(row) -> str:
+    return " ".join(value for value in (row.name, row.barcode, row.article) if value).casefold()
+
+
+def _fts_phrase(value: str) -> str:
+    # Quoting makes the value a literal string rather than FTS5 query syntax
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _escape_like(value: str) -> str:
+    return re.sub(r"([\\%_])", r"\\\1", value)
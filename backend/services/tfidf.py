@@ -0,0 +1,163 @@
+import math
+import threading
+import weakref
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+from rapidfuzz import fuzz, process
+from scipy import sparse
+
+# Character n-gram length. Names are padded with a space on both sides, so word
+# starts and ends get their own n-grams
+NGRAM_SIZE = 3
+
+# N-grams found in more than this share of the nomenclature are dropped: they carry
+# almost no weight and would make every query a neighbour of most of the catalog
+MAX_DOCUMENT_FREQUENCY = 0.3
+
+# Supplier names multiplied against the master matrix at once. The product holds one
+# float per (query, master sharing an n-gram) pair, so keep it modest for big catalogs
+QUERY_CHUNK_SIZE = 256
+
+# Nearest neighbours (by cosine) re-scored with token_set_ratio per supplier name
+SHORTLIST_SIZE = 20
+
+# Matrices built per catalog view, dropped with it
+_cache = weakref.WeakKeyDictionary()
+_cache_lock = threading.Lock()
+
+
+def char_ngrams(name_norm: str, size: int = NGRAM_SIZE) -> Counter:
+    padded = f" {name_norm} "
+    return Counter(padded[i:i + size] for i in range(len(padded) - size + 1))
+
+
+class TfidfIndex:
+    """
+    Character n-gram TF-IDF vectors of the normalized master names as one L2-normalized
+    sparse matrix, so the cosine neighbours of a whole batch of supplier names are found
+    with a single sparse matrix product.
+    """
+
+    def __init__(self, choice_ids: List[int], choice_names: List[str], version: int = 0):
+        self.version = version
+        self.choice_ids = np.asarray(list(choice_ids), dtype=np.int64)
+        self.choice_names = list(choice_names)
+
+        grams_per_name = [char_ngrams(name) for name in self.choice_names]
+        document_frequency = Counter(gram for grams in grams_per_name for gram in grams)
+        total = len(grams_per_name)
+        max_frequency = max(1, int(MAX_DOCUMENT_FREQUENCY * total))
+
+        self.vocabulary: Dict[str, int] = {}
+        idf = []
+        for gram, frequency in document_frequency.items():
+            if frequency <= max_frequency:
+                self.vocabulary[gram] = len(idf)
+                # Smoothed idf, as in scikit-learn's TfidfVectorizer
+                idf.append(math.log((1 + total) / (1 + frequency)) + 1)
+        self.idf = np.asarray(idf, dtype=np.float64)
+
+        # Transposed once: vocabulary x masters, ready for query @ matrix
+        self.matrix_t = self._vectorize(grams_per_name).T.tocsr()
+
+    def __len__(self):
+        return len(self.choice_ids)
+
+    def neighbours(self, names_norm: List[str], top_k: int) -> list:
+        """Returns up to `top_k` (choice index, cosine similarity) per name, most similar first."""
+        results = []
+        for start in range(0, len(names_norm), QUERY_CHUNK_SIZE):
+            chunk = names_norm[start:start + QUERY_CHUNK_SIZE]
+            similarities = (self._vectorize([char_ngrams(name) for name in chunk]) @ self.matrix_t).tocsr()
+            for row in range(len(chunk)):
+                begin, end = similarities.indptr[row], similarities.indptr[row + 1]
+                indexes = similarities.indices[begin:end]
+                values = similarities.data[begin:end]
+                if len(values) > top_k:
+                    selected = np.argpartition(-values, top_k - 1)[:top_k]
+                    indexes, values = indexes[selected], values[selected]
+                # Most similar first, ties by choice order
+                order = np.lexsort((indexes, -values))
+                results.append([(int(indexes[i]), float(values[i])) for i in order])
+        return results
+
+    def _vectorize(self, grams_per_name: List[Counter]) -> sparse.csr_matrix:
+        rows, columns, counts = [], [], []
+        for row, grams in enumerate(grams_per_name):
+            for gram, count in grams.items():
+                column = self.vocabulary.get(gram)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+                    counts.append(count)
+
+        matrix = sparse.csr_matrix(
+            (np.asarray(counts, dtype=np.float64) * self.idf[columns], (rows, columns)),
+            shape=(len(grams_per_name), len(self.idf)),
+        )
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.diags(1 / norms) @ matrix
+
+
+def cached_tfidf_index(view) -> TfidfIndex:
+    """
+    TF-IDF matrix of the names of a catalog view (see services.master_index.CatalogView),
+    built on first use and reused by every run reading the same view.
+    """
+    with _cache_lock:
+        tfidf = _cache.get(view)
+        if tfidf is None or tfidf.version != view.version:
+            tfidf = TfidfIndex(view.names.keys(), view.names.values(), view.version)
+            _cache[view] = tfidf
+        return tfidf
+
+
+class TfidfScorer:
+    """
+    Fuzzy engine over a TfidfIndex with the BatchScorer interface: the SHORTLIST_SIZE
+    nearest neighbours of every name are re-scored with token_set_ratio (`rescore`),
+    so confidences stay comparable with the other engines, or scored as cosine x 100.
+    """
+
+    def __init__(self, tfidf: TfidfIndex, score_cutoff: float, rescore: bool = True, shortlist_size: int = SHORTLIST_SIZE):
+        self.tfidf = tfidf
+        self.score_cutoff = score_cutoff
+        self.rescore = rescore
+        self.shortlist_size = shortlist_size
+
+    @property
+    def candidates_per_item(self) -> int:
+        return min(self.shortlist_size, len(self.tfidf))
+
+    def close(self):
+        pass
+
+    def top_matches(self, names: List[str], top_k: int) -> list:
+        """Up to `top_k` (master_id, score) hits per normalized name, best first. Scores are not rounded."""
+        if not names or not len(self.tfidf):
+            return [[] for _ in names]
+
+        shortlist_size = max(self.shortlist_size, top_k)
+        results = []
+        for name, shortlist in zip(names, self.tfidf.neighbours(list(names), shortlist_size)):
+            if self.rescore:
+                choices = {index: self.tfidf.choice_names[index] for index, _ in shortlist}
+                hits = [
+                    (index, score)
+                    for _, score, index in process.extract(
+                        name, choices, scorer=fuzz.token_set_ratio, processor=None,
+                        score_cutoff=self.score_cutoff, limit=top_k,
+                    )
+                ]
+            else:
+                hits = [
+                    (index, similarity * 100)
+                    for index, similarity in shortlist[:top_k]
+                    if similarity * 100 >= self.score_cutoff
+                ]
+            results.append([(int(self.tfidf.choice_ids[index]), score) for index, score in hits])
+        return results
+
@@ -0,0 +1,224 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional
+
+from database import SessionLocal, engine
+from services.ingest import INGEST_BATCH_SIZE, batched, file_sha256, find_repeated_upload, ingest_price_list
+from services.master_catalog import import_master_catalog
+from services.metrics import inc, span, timed_iter
+from services.parser import iter_master_catalog, iter_price_list
+
+# Price lists parsed at the same time by this process, off the event loop
+UPLOAD_WORKERS = 4
+
+# Uploads admitted at once (running or waiting for a worker). Further uploads wait for a
+# slot up to UPLOAD_QUEUE_TIMEOUT seconds and are then rejected, so a burst of big files
+# can't pile up unbounded spooled files and parsed rows
+UPLOAD_MAX_PENDING = 8
+UPLOAD_QUEUE_TIMEOUT = 30
+
+# Batches of INGEST_BATCH_SIZE parsed rows an upload may hold ahead of its write, e.g.
+# while it waits for the write lock. Bounds the parsed rows in memory to about
+# UPLOAD_WORKERS * UPLOAD_PARSE_AHEAD * INGEST_BATCH_SIZE
+UPLOAD_PARSE_AHEAD = 2
+
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+
+# SQLite has a single writer: uploads are written one at a time instead of failing with
+# "database is locked" while another upload's transaction is open. Parsing runs ahead of
+# the write only by UPLOAD_PARSE_AHEAD batches
+_write_lock = threading.Lock() if engine.dialect.name == "sqlite" else nullcontext()
+
+_slots: Optional[asyncio.Semaphore] = None
+
+
+class UploadQueueFull(Exception):
+    """Raised when no upload slot frees up within UPLOAD_QUEUE_TIMEOUT."""
+
+    def __init__(self):
+        super().__init__("Too many uploads in progress, retry later")
+
+
+def process_upload(source: BinaryIO, filename: str, supplier_name: str, mode: str = "delta") -> dict:
+    """
+    Hashes, parses and ingests one price list with its own session (see services.ingest).
+    Blocking: runs on the upload pool. Parse errors are raised as ValueError.
+    """
+    db = SessionLocal()
+    try:
+        # Starlette already spools the upload to a temporary file, hash and parse straight from it
+        # instead of reading the whole file into memory
+        with span("upload.hash"):
+            content_hash = file_sha256(source)
+
+        if mode == "delta":
+            previous = find_repeated_upload(db, supplier_name, content_hash)
+            if previous is not None:
+                inc("upload_repeated_total")
+                return {
+                    "message": f"{filename} is identical to the last price list of {supplier_name}, nothing changed",
+                    "upload_id": previous.id,
+                    "skipped": True,
+                }
+            # Don't hold a read transaction open while parsing
+            db.rollback()
+
+        # Parsed on a separate thread while the upload waits for the write lock and while it
+        # writes, but only a few batches ahead: the file is never held in memory as a whole
+        records = _ReadAhead(timed_iter(
+            iter_price_list(source, filename, supplier_name), "upload.parse", "upload_records_total"
+        ))
+        try:
+            with _write_lock:
+                upload = ingest_price_list(db, records, supplier_name, filename, content_hash, mode=mode)
+        finally:
+            records.close()
+
+        return {
+            "message": (
+                f"Successfully parsed {upload.rows} items from {filename}: "
+                f"{upload.inserted} new, {upload.updated} updated, {upload.unchanged} unchanged"
+            ),
+            "upload_id": upload.id,
+            "inserted": upload.inserted,
+            "updated": upload.updated,
+            "unchanged": upload.unchanged,
+        }
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def process_catalog_import(source: BinaryIO, filename: str) -> dict:
+    """
+    Streams a 1C nomenclature file into master_items (see services.master_catalog) with its
+    own session. Blocking: runs on the upload pool. Parse errors are raised as ValueError.
+    """
+    db = SessionLocal()
+    try:
+        records = timed_iter(iter_master_catalog(source, filename), "catalog.parse", "catalog_records_total")
+        # Streamed straight into the write, the file is never held in memory as a whole
+        with _write_lock:
+            stats = import_master_catalog(db, records)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    return {
+        "message": (
+            f"Imported {stats['rows']} nomenclature rows from {filename}: "
+            f"{stats['inserted']} new, {stats['updated']} updated, {stats['unchanged']} unchanged"
+        ),
+        **stats,
+    }
+
+
+class _ReadAhead:
+    """
+    Iterates `records` on a separate thread from creation on, at most `depth` batches ahead
+    of the consumer. Errors of the iteration are raised to the consumer. `close()` stops the
+    thread after its current batch.
+    """
+
+    _DONE = object()
+
+    def __init__(self, records: Iterable[dict], batch_size: int = INGEST_BATCH_SIZE, depth: int = UPLOAD_PARSE_AHEAD):
+        self._batches = queue.Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        self._current = iter(())
+        self._thread = threading.Thread(target=self._produce, args=(records, batch_size), name="upload-parse", daemon=True)
+        self._thread.start()
+
+    def __iter__(self) -> Iterator[dict]:
+        return self
+
+    def __next__(self) -> dict:
+        while True:
+            record = next(self._current, self._DONE)
+            if record is not self._DONE:
+                return record
+            batch = self._batches.get()
+            if batch is self._DONE:
+                self._batches.put(batch)
+                raise StopIteration
+            if isinstance(batch, BaseException):
+                raise batch
+            self._current = iter(batch)
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _produce(self, records: Iterable[dict], batch_size: int):
+        try:
+            for batch in batched(records, batch_size):
+                if not self._put(batch):
+                    return
+        except BaseException as exc:
+            self._put(exc)
+        else:
+            self._put(self._DONE)
+
+    def _put(self, item) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self._batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+async def run_upload(source: BinaryIO, filename: str, supplier_name: str, mode: str = "delta") -> dict:
+    """
+    Runs `process_upload` on the upload pool and awaits it without blocking the event loop.
+    Raises UploadQueueFull when no slot frees up in time.
+    """
+    return await run_in_upload_pool(process_upload, source, filename, supplier_name, mode)
+
+
+async def run_in_upload_pool(func: Callable, *args):
+    """Runs a blocking file processing function on the upload pool once a slot is free."""
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(UPLOAD_MAX_PENDING)
+    try:
+        await asyncio.wait_for(_slots.acquire(), UPLOAD_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        inc("upload_rejected_total")
+        raise UploadQueueFull()
+
+    loop = asyncio.get_running_loop()
+    future = _executor.submit(func, *args)
+    # The slot is freed when the work is really done, even if the request went away meanwhile
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(_slots.release))
+    return await asyncio.wrap_future(future)
+
+
+async def run_uploads(files: list, mode: str = "delta") -> list:
+    """
+    Processes several (source, filename, supplier name) uploads concurrently.
+    Returns one result per file, in order: the `process_upload` result with "status": "ok",
+    or "status": "error" with the error message. A failing file doesn't affect the others.
+    """
+    outcomes = await asyncio.gather(
+        *(run_upload(source, filename, supplier_name, mode) for source, filename, supplier_name in files),
+        return_exceptions=True,
+    )
+
+    results = []
+    for (_, filename, supplier_name), outcome in zip(files, outcomes):
+        result = {"filename": filename, "supplier_name": supplier_name}
+        if isinstance(outcome, BaseException):
+            result.update(status="error", error=str(outcome), retry=isinstance(outcome, UploadQueueFull))
+        else:
+            result.update(outcome, status="ok")
+        results.append(result)
+    return results
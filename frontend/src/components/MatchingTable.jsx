@@ -5,7 +5,7 @@ import { cn } from '../lib/utils';
 
 export function MatchingTable({ refreshTrigger }) {
     const [items, setItems] = useState([]);
-    const [filter, setFilter] = useState('all'); // 'all', 'matched', 'unmatched'
+    const [filter, setFilter] = useState('all'); // 'all', 'matched', 'unmatched', 'review'
     const [loading, setLoading] = useState(false);
     const [manualMatchModalOpen, setManualMatchModalOpen] = useState(false);
     const [selectedItem, setSelectedItem] = useState(null);
@@ -13,11 +13,14 @@ export function MatchingTable({ refreshTrigger }) {
     const fetchItems = async () => {
         setLoading(true);
         try {
+            // The review queue comes with the candidates scored by the match run
             const url = filter === 'all'
                 ? 'http://localhost:8000/api/results/'
-                : `http://localhost:8000/api/results/?status=${filter}`;
+                : filter === 'review'
+                    ? 'http://localhost:8000/api/review/'
+                    : `http://localhost:8000/api/results/?status=${filter}`;
             const res = await axios.get(url);
-            setItems(res.data);
+            setItems(res.data.items);
         } catch (err) {
             console.error("Failed to fetch matches", err);
         } finally {
@@ -70,6 +73,7 @@ export function MatchingTable({ refreshTrigger }) {
                     <option value="all">Все записи ({items.length})</option>
                     <option value="matched">Сопоставленные</option>
                     <option value="unmatched">Требуют внимания</option>
+                    <option value="review">На проверку (с кандидатами)</option>
                 </select>
             </div>
 
@@ -152,6 +156,11 @@ function ManualMatchModal({ item, onClose, onSuccess }) {
     const [searching, setSearching] = useState(false);
 
     useEffect(() => {
+        // Candidates stored by the match run, no search needed
+        if (item.candidates?.length) {
+            setResults(item.candidates);
+            return;
+        }
         // Initial search attempt with part of the name
         const initialWords = item.name.split(' ').slice(0, 3).join(' ');
         setQuery(initialWords);
@@ -236,6 +245,7 @@ function ManualMatchModal({ item, onClose, onSuccess }) {
                                                 <span>Код 1С: {r.code_1c}</span>
                                                 {r.barcode && <span>ШК: {r.barcode}</span>}
                                                 {r.article && <span>Арт: {r.article}</span>}
+                                                {r.score != null && <span>Сходство: {r.score}%</span>}
                                             </div>
                                         </div>
                                         <button
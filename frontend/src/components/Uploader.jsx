@@ -3,6 +3,33 @@ import { useDropzone } from 'react-dropzone';
 import { UploadCloud, File, X, CheckCircle } from 'lucide-react';
 import axios from 'axios';
 
+const API_URL = 'http://localhost:8000';
+
+// Matching runs as a background job on the server: wait until it is finished
+async function waitForMatchJob(jobId) {
+    while (true) {
+        const res = await axios.get(`${API_URL}/api/match/jobs/${jobId}`);
+        if (!['queued', 'running'].includes(res.data.status)) {
+            return res.data;
+        }
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+}
+
+// Only the items of the given upload batch are matched
+async function runMatching(uploadId) {
+    try {
+        const res = await axios.post(`${API_URL}/api/match/`, null, { params: { upload_id: uploadId } });
+        return await waitForMatchJob(res.data.id);
+    } catch (err) {
+        // A run over the same items is already in progress, wait for that one instead
+        if (err.response?.status === 409) {
+            return await waitForMatchJob(err.response.data.detail.job_id);
+        }
+        throw err;
+    }
+}
+
 export function Uploader({ onUploadSuccess }) {
     const [file, setFile] = useState(null);
     const [supplierName, setSupplierName] = useState('');
@@ -47,12 +74,12 @@ export function Uploader({ onUploadSuccess }) {
         formData.append('supplier_name', supplierName);
 
         try {
-            await axios.post('http://localhost:8000/api/upload/', formData, {
+            const res = await axios.post('http://localhost:8000/api/upload/', formData, {
                 headers: { 'Content-Type': 'multipart/form-data' }
             });
 
             // Auto-trigger match after upload
-            await axios.post('http://localhost:8000/api/match/');
+            await runMatching(res.data.upload_id);
 
             setFile(null);
             setSupplierName('');